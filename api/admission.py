@@ -0,0 +1,194 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import structlog
+
+from .metrics import (
+    ADMISSION_ACTIVE,
+    ADMISSION_QUEUE_DEPTH,
+    ADMISSION_WAIT_TIME,
+    ADMISSION_SHED
+)
+
+logger = structlog.get_logger()
+
+PRIORITY_CLASSES: Dict[str, int] = {
+    "interactive": 0,
+    "default": 1,
+    "batch": 2
+}
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of being admitted to the backend."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(f"Request shed ({reason}), retry after {retry_after}s")
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+class _Waiter:
+    def __init__(self, priority: str, deadline: float):
+        self.priority = priority
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+class AdmissionController:
+    """Bounds concurrent generations and queues the rest by priority and deadline.
+
+    Up to ``max_concurrency`` requests hold a permit at once. Waiting requests
+    are ordered by priority class, then by earliest deadline. A request is
+    shed with 429 when the queue is full (after evicting a lower-priority
+    waiter if there is one), and with 503 as soon as it can no longer start
+    early enough to finish before its deadline.
+
+    With several workers, ``permits`` (api.shared_state.SharedPermits)
+    holds the global count and ``max_concurrency`` applies to all of them
+    together. Each worker still queues its own requests in priority order,
+    and retries every ``poll_interval`` seconds, because a permit released
+    by another worker does not wake this worker's waiters.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, permits=None, poll_interval: float = 0.02):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.permits = permits
+        self.poll_interval = poll_interval
+        self.active = 0
+        self.service_time = 0.0
+        self._queue: List = []
+        self._waiting = 0
+        self._sequence = itertools.count()
+        self._poller: Optional[asyncio.Task] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._waiting
+
+    def retry_after(self) -> int:
+        estimate = (self._waiting / self.max_concurrency + 1) * self.service_time
+        return max(1, math.ceil(estimate))
+
+    @asynccontextmanager
+    async def admit(self, priority: str = "default", deadline: Optional[float] = None):
+        """Hold a permit for the duration of the block; ``deadline`` is a monotonic time."""
+        await self.acquire(priority, deadline)
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start_time)
+
+    async def acquire(self, priority: str = "default", deadline: Optional[float] = None):
+        if priority not in PRIORITY_CLASSES:
+            priority = "default"
+        deadline = deadline if deadline is not None else math.inf
+
+        if not self._waiting and self._try_grant():
+            ADMISSION_WAIT_TIME.labels(priority=priority).observe(0)
+            return
+
+        if self._waiting >= self.max_queue and not self._evict_lower_priority(priority):
+            self._shed(priority, 429, "queue_full")
+
+        if time.monotonic() + self.service_time > deadline:
+            self._shed(priority, 503, "deadline")
+
+        waiter = _Waiter(priority, deadline)
+        heapq.heappush(self._queue, (PRIORITY_CLASSES[priority], deadline, next(self._sequence), waiter))
+        self._waiting += 1
+        ADMISSION_QUEUE_DEPTH.labels(priority=priority).inc()
+        if self.permits is not None and (self._poller is None or self._poller.done()):
+            self._poller = asyncio.create_task(self._poll())
+
+        # Give up once starting any later would overrun the deadline
+        timeout = None if deadline == math.inf else max(0.0, deadline - self.service_time - time.monotonic())
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            if not waiter.future.done():
+                waiter.future.cancel()
+                self._dequeued(waiter)
+                self._shed(priority, 503, "deadline")
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                self.release(0.0)
+            elif not waiter.future.done():
+                waiter.future.cancel()
+                self._dequeued(waiter)
+            raise
+
+        # Raises AdmissionRejected if the waiter was evicted by a higher priority
+        waiter.future.result()
+        ADMISSION_WAIT_TIME.labels(priority=priority).observe(time.monotonic() - waiter.enqueued_at)
+
+    def release(self, service_time: float):
+        self.active -= 1
+        if self.permits is not None:
+            self.permits.release()
+        ADMISSION_ACTIVE.set(self.active)
+        if service_time > 0:
+            # Exponentially weighted moving average of how long a permit is held
+            self.service_time = service_time if self.service_time == 0 else 0.8 * self.service_time + 0.2 * service_time
+
+        self._grant_waiters()
+
+    def _grant_waiters(self):
+        while self._queue:
+            waiter = self._queue[0][3]
+            if waiter.future.done():
+                heapq.heappop(self._queue)
+                continue
+            if not self._try_grant():
+                return
+            heapq.heappop(self._queue)
+            self._dequeued(waiter)
+            waiter.future.set_result(None)
+
+    async def _poll(self):
+        while self._waiting:
+            await asyncio.sleep(self.poll_interval)
+            self._grant_waiters()
+
+    def _try_grant(self) -> bool:
+        if self.active >= self.max_concurrency:
+            return False
+        if self.permits is not None and not self.permits.try_acquire():
+            return False
+        self.active += 1
+        ADMISSION_ACTIVE.set(self.active)
+        return True
+
+    def _dequeued(self, waiter: _Waiter):
+        self._waiting -= 1
+        ADMISSION_QUEUE_DEPTH.labels(priority=waiter.priority).dec()
+
+    def _evict_lower_priority(self, priority: str) -> bool:
+        candidates = [entry for entry in self._queue if not entry[3].future.done()]
+        if not candidates:
+            return False
+        victim = max(candidates, key=lambda entry: (entry[0], entry[1], entry[2]))
+        if victim[0] <= PRIORITY_CLASSES[priority]:
+            return False
+
+        waiter = victim[3]
+        self._dequeued(waiter)
+        ADMISSION_SHED.labels(priority=waiter.priority, reason="preempted").inc()
+        waiter.future.set_exception(AdmissionRejected(429, "preempted", self.retry_after()))
+        return True
+
+    def _shed(self, priority: str, status_code: int, reason: str):
+        ADMISSION_SHED.labels(priority=priority, reason=reason).inc()
+        retry_after = self.retry_after()
+        logger.warning("Request shed by admission control",
+                       priority=priority,
+                       reason=reason,
+                       queue_depth=self._waiting,
+                       retry_after=retry_after)
+        raise AdmissionRejected(status_code, reason, retry_after)
@@ -0,0 +1,163 @@
+import random
+import time
+from typing import Dict, Any, List, Optional, Iterable
+
+import structlog
+
+from .metrics import BACKEND_OUTSTANDING_REQUESTS, BACKEND_HEALTHY, BACKEND_EJECTIONS, BACKEND_CIRCUIT_OPEN, CIRCUIT_REJECTED_REQUESTS
+
+logger = structlog.get_logger()
+
+class BackendUnavailable(Exception):
+    """Raised instead of contacting a backend while every circuit is open."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"No healthy llama.cpp backend, retry after {retry_after}s")
+        self.status_code = 503
+        self.reason = "circuit_open"
+        self.retry_after = retry_after
+
+class Backend:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        # Base URL requests are sent to; differs from the endpoint for unix:// sockets
+        self.url = endpoint
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.admitted_at = 0.0
+        self.circuit_open = False
+
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+    def weight(self, now: float, slow_start: float) -> float:
+        """Routing weight ramping linearly from 10% to 100% after re-admission."""
+        if slow_start <= 0 or self.admitted_at == 0.0:
+            return 1.0
+        return min(1.0, max(0.1, (now - self.admitted_at) / slow_start))
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        return {
+            "endpoint": self.endpoint,
+            "outstanding": self.outstanding,
+            "ejected": self.is_ejected(now),
+            "circuit_open": self.circuit_open,
+            "consecutive_failures": self.consecutive_failures
+        }
+
+class BackendPool:
+    """Routes generations to the llama.cpp backend with the fewest outstanding requests.
+
+    Backends are ejected after ``failure_threshold`` consecutive failures for
+    ``ejection_time`` seconds, doubling on each repeated ejection up to
+    ``max_ejection_time``. Once re-admitted they receive a reduced share of
+    traffic for ``slow_start`` seconds.
+
+    Backends whose circuit has been opened by the health prober receive no
+    traffic at all; when every circuit is open, ``BackendUnavailable`` is
+    raised straight away instead of waiting on timeouts and retries.
+    """
+
+    def __init__(self, endpoints: Iterable[str], failure_threshold: int = 3, ejection_time: float = 10.0,
+                 max_ejection_time: float = 300.0, slow_start: float = 30.0, circuit_retry_after: int = 5):
+        self.backends: List[Backend] = [Backend(endpoint) for endpoint in endpoints]
+        if not self.backends:
+            raise ValueError("BackendPool requires at least one endpoint")
+        self.failure_threshold = failure_threshold
+        self.ejection_time = ejection_time
+        self.max_ejection_time = max_ejection_time
+        self.slow_start = slow_start
+        self.circuit_retry_after = circuit_retry_after
+
+        for backend in self.backends:
+            BACKEND_HEALTHY.labels(backend=backend.endpoint).set(1)
+            BACKEND_CIRCUIT_OPEN.labels(backend=backend.endpoint).set(0)
+            BACKEND_OUTSTANDING_REQUESTS.labels(backend=backend.endpoint).set(0)
+
+    def __len__(self) -> int:
+        return len(self.backends)
+
+    def select(self, exclude: Iterable[Backend] = ()) -> Backend:
+        """Pick the backend with the lowest outstanding load relative to its weight.
+
+        Ejected backends are skipped unless every candidate is ejected, in
+        which case the one closest to re-admission is used. Backends with an
+        open circuit are never used.
+        """
+        now = time.monotonic()
+        excluded = set(id(backend) for backend in exclude)
+        candidates = [backend for backend in self.backends if id(backend) not in excluded] or self.backends
+        candidates = [backend for backend in candidates if not backend.circuit_open]
+        if not candidates:
+            CIRCUIT_REJECTED_REQUESTS.inc()
+            raise BackendUnavailable(self.circuit_retry_after)
+
+        available = [backend for backend in candidates if not backend.is_ejected(now)]
+        if not available:
+            return min(candidates, key=lambda backend: backend.ejected_until)
+
+        def load(backend: Backend) -> float:
+            return (backend.outstanding + 1) / backend.weight(now, self.slow_start)
+
+        lowest = min(load(backend) for backend in available)
+        return random.choice([backend for backend in available if load(backend) == lowest])
+
+    def get(self, endpoint: str) -> Optional[Backend]:
+        return next((backend for backend in self.backends if backend.endpoint == endpoint), None)
+
+    def acquire(self, exclude: Iterable[Backend] = (), prefer: Optional[Backend] = None) -> Backend:
+        """Reserve a backend, using ``prefer`` when it is routable and not excluded."""
+        exclude = list(exclude)
+        if prefer is not None and prefer not in exclude and not prefer.circuit_open and not prefer.is_ejected(time.monotonic()):
+            backend = prefer
+        else:
+            backend = self.select(exclude)
+        backend.outstanding += 1
+        BACKEND_OUTSTANDING_REQUESTS.labels(backend=backend.endpoint).set(backend.outstanding)
+        return backend
+
+    def release(self, backend: Backend):
+        backend.outstanding -= 1
+        BACKEND_OUTSTANDING_REQUESTS.labels(backend=backend.endpoint).set(backend.outstanding)
+
+    def record_success(self, backend: Backend):
+        now = time.monotonic()
+        if backend.ejected_until and not backend.is_ejected(now):
+            logger.info("Backend re-admitted", endpoint=backend.endpoint)
+            backend.ejected_until = 0.0
+            BACKEND_HEALTHY.labels(backend=backend.endpoint).set(1)
+        backend.consecutive_failures = 0
+        if backend.weight(now, self.slow_start) >= 1.0:
+            backend.ejections = 0
+
+    def record_failure(self, backend: Backend, error: Optional[str] = None):
+        now = time.monotonic()
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures < self.failure_threshold or backend.is_ejected(now):
+            return
+
+        duration = min(self.max_ejection_time, self.ejection_time * (2 ** backend.ejections))
+        backend.ejections += 1
+        backend.ejected_until = now + duration
+        backend.admitted_at = backend.ejected_until
+        backend.consecutive_failures = 0
+        BACKEND_HEALTHY.labels(backend=backend.endpoint).set(0)
+        BACKEND_EJECTIONS.labels(backend=backend.endpoint).inc()
+        logger.warning("Backend ejected",
+                       endpoint=backend.endpoint,
+                       ejection_seconds=duration,
+                       error=error)
+
+    def set_circuit(self, backend: Backend, open: bool):
+        backend.circuit_open = open
+        BACKEND_CIRCUIT_OPEN.labels(backend=backend.endpoint).set(1 if open else 0)
+
+    @property
+    def has_closed_circuit(self) -> bool:
+        return any(not backend.circuit_open for backend in self.backends)
+
+    def status(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [backend.to_dict(now) for backend in self.backends]
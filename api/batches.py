@@ -0,0 +1,415 @@
+import asyncio
+import fcntl
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+import structlog
+
+from .admission import AdmissionRejected
+from .backend_pool import BackendUnavailable
+from .models import parse_chat_request, build_chat_completion
+from .quotas import ANONYMOUS_KEY
+from .metrics import BATCH_REQUESTS_COMPLETED, BATCH_JOBS_ACTIVE
+
+logger = structlog.get_logger()
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+# How often a worker that does not run a job re-reads its progress from disk
+REMOTE_POLL_INTERVAL = 1.0
+
+class BatchJob:
+    """One offline translation job, persisted under ``<batch_dir>/<job_id>/``.
+
+    ``input.jsonl`` holds the uploaded requests, ``output.jsonl`` receives one
+    result line per request in completion order and ``job.json`` holds the
+    job metadata, so a job can be resumed from disk after a restart.
+
+    The worker running a job holds an exclusive lock on ``run.lock``; other
+    workers see the job through its files and ask for cancellation by
+    creating ``cancel``.
+    """
+
+    def __init__(self, job_id: str, directory: str, metadata: Dict[str, Any]):
+        self.id = job_id
+        self.directory = directory
+        self.metadata = metadata
+        self.task: Optional[asyncio.Task] = None
+        self.changed = asyncio.Event()
+        self._lock_fd: Optional[int] = None
+
+    @property
+    def input_path(self) -> str:
+        return os.path.join(self.directory, "input.jsonl")
+
+    @property
+    def output_path(self) -> str:
+        return os.path.join(self.directory, "output.jsonl")
+
+    @property
+    def metadata_path(self) -> str:
+        return os.path.join(self.directory, "job.json")
+
+    @property
+    def cancel_path(self) -> str:
+        return os.path.join(self.directory, "cancel")
+
+    @property
+    def finished(self) -> bool:
+        return self.metadata["status"] in TERMINAL_STATUSES
+
+    @property
+    def remote(self) -> bool:
+        """Whether another worker is responsible for this unfinished job."""
+        return self._lock_fd is None and not self.finished
+
+    def claim(self) -> bool:
+        """Take the job's run lock; False if another worker holds it."""
+        if self._lock_fd is not None:
+            return True
+        fd = os.open(os.path.join(self.directory, "run.lock"), os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def unclaim(self):
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def reload(self):
+        with open(self.metadata_path) as f:
+            self.metadata = json.load(f)
+
+    def save(self):
+        tmp_path = self.metadata_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.metadata, f)
+        os.replace(tmp_path, self.metadata_path)
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    def status(self) -> Dict[str, Any]:
+        metadata = self.metadata
+        started_at = metadata.get("started_at")
+        end_time = metadata.get("finished_at") or time.time()
+        elapsed = end_time - started_at if started_at else 0.0
+        done = metadata["completed"] + metadata["failed"]
+        remaining = metadata["total"] - done
+
+        # Throughput covers the current run only, so it stays meaningful after a resume
+        run_elapsed = end_time - metadata["resumed_at"] if metadata.get("resumed_at") else 0.0
+        requests_per_second = metadata.get("run_completed", 0) / run_elapsed if run_elapsed > 0 else 0.0
+        tokens_per_second = metadata.get("run_completion_tokens", 0) / run_elapsed if run_elapsed > 0 else 0.0
+
+        return {
+            "id": self.id,
+            "object": "batch",
+            "status": metadata["status"],
+            "created_at": int(metadata["created_at"]),
+            "started_at": int(started_at) if started_at else None,
+            "finished_at": int(metadata["finished_at"]) if metadata.get("finished_at") else None,
+            "request_counts": {
+                "total": metadata["total"],
+                "completed": metadata["completed"],
+                "failed": metadata["failed"]
+            },
+            "progress": done / metadata["total"] if metadata["total"] else 1.0,
+            "elapsed_seconds": elapsed,
+            "requests_per_second": requests_per_second,
+            "completion_tokens_per_second": tokens_per_second,
+            "estimated_seconds_remaining": remaining / requests_per_second if requests_per_second and not self.finished else None
+        }
+
+class BatchManager:
+    """Runs JSONL batch jobs against a LlamaClient with bounded concurrency.
+
+    Requests are submitted at ``batch`` priority so interactive traffic keeps
+    precedence in admission control. Each request line may be a bare chat
+    completion body or ``{"custom_id": ..., "body": {...}}``; requests
+    without a ``custom_id`` are identified by their line number.
+
+    With several workers, each job runs in the worker that created it or
+    that claimed it on startup; the others serve its status and results
+    from disk.
+
+    Generated tokens are charged to the API key that submitted the job,
+    and while that key's token quota is exhausted the job pauses instead
+    of failing its requests.
+    """
+
+    def __init__(self, llama_client, batch_dir: str, concurrency: int, quotas=None):
+        self.llama_client = llama_client
+        self.batch_dir = batch_dir
+        self.concurrency = concurrency
+        self.quotas = quotas
+        self.jobs: Dict[str, BatchJob] = {}
+        os.makedirs(batch_dir, exist_ok=True)
+
+    def create(self, upload_path: str, key_name: str = ANONYMOUS_KEY) -> BatchJob:
+        """Register a job from an uploaded JSONL file, taking ownership of the file."""
+        job_id = f"batch_{uuid.uuid4().hex}"
+        directory = os.path.join(self.batch_dir, job_id)
+        os.makedirs(directory)
+        shutil.move(upload_path, os.path.join(directory, "input.jsonl"))
+
+        with open(os.path.join(directory, "input.jsonl"), "rb") as f:
+            total = sum(1 for line in f if line.strip())
+
+        job = BatchJob(job_id, directory, {
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "total": total,
+            "completed": 0,
+            "failed": 0,
+            "api_key_name": key_name
+        })
+        job.save()
+        open(job.output_path, "w").close()
+        self.jobs[job_id] = job
+        job.claim()
+        self._start(job)
+        logger.info("Batch job created", job_id=job_id, total=total)
+        return job
+
+    def resume_all(self):
+        """Reload jobs from disk and restart any that had not finished."""
+        for job_id in sorted(os.listdir(self.batch_dir)):
+            if job_id in self.jobs:
+                continue
+            job = self._load(job_id)
+            if job is None:
+                continue
+            self.jobs[job_id] = job
+
+            if job.finished or not job.claim():
+                # Done, or being run by another worker
+                continue
+            # Another worker may have finished it since it was read
+            job.reload()
+            if job.finished:
+                job.unclaim()
+                continue
+            logger.info("Resuming batch job", job_id=job_id)
+            self._start(job)
+
+    def _load(self, job_id: str) -> Optional[BatchJob]:
+        directory = os.path.join(self.batch_dir, job_id)
+        metadata_path = os.path.join(directory, "job.json")
+        if not job_id.startswith("batch_") or os.sep in job_id or not os.path.isfile(metadata_path):
+            return None
+        with open(metadata_path) as f:
+            return BatchJob(job_id, directory, json.load(f))
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        job = self.jobs.get(job_id)
+        if job is None:
+            # Created by another worker
+            job = self._load(job_id)
+            if job is None:
+                return None
+            self.jobs[job_id] = job
+        elif job.remote:
+            job.reload()
+        return job
+
+    def list_jobs(self) -> List[BatchJob]:
+        jobs = [self.get(job_id) for job_id in os.listdir(self.batch_dir)]
+        return sorted((job for job in jobs if job is not None), key=lambda job: job.metadata["created_at"], reverse=True)
+
+    async def cancel(self, job: BatchJob):
+        if job.task is not None and not job.task.done():
+            job.task.cancel()
+            try:
+                await job.task
+            except asyncio.CancelledError:
+                pass
+        elif job.remote:
+            # The worker running the job stops at its next request and releases the
+            # run lock; if that worker has exited, the lock is free straight away
+            open(job.cancel_path, "w").close()
+            while not job.claim():
+                await asyncio.sleep(REMOTE_POLL_INTERVAL)
+            job.reload()
+        if not job.finished:
+            self._finish(job, "cancelled")
+        if job.task is None:
+            job.unclaim()
+
+    async def shutdown(self):
+        # Leave jobs in their running state on disk so they resume on restart
+        tasks = [job.task for job in self.jobs.values() if job.task is not None and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def results(self, job: BatchJob, follow: bool = True) -> AsyncIterator[bytes]:
+        """Yield output lines as they are written, until the job finishes."""
+        with open(job.output_path, "rb") as f:
+            while True:
+                changed = job.changed
+                finished = job.finished
+                line = f.readline()
+                while line:
+                    if line.endswith(b"\n"):
+                        yield line
+                    else:
+                        # Partially written line; re-read it once complete
+                        f.seek(-len(line), os.SEEK_CUR)
+                        break
+                    line = f.readline()
+                if finished or not follow:
+                    return
+                if job.remote:
+                    await asyncio.sleep(REMOTE_POLL_INTERVAL)
+                    job.reload()
+                else:
+                    await changed.wait()
+
+    def _start(self, job: BatchJob):
+        BATCH_JOBS_ACTIVE.inc()
+        job.task = asyncio.create_task(self._run(job))
+        job.task.add_done_callback(lambda _: (BATCH_JOBS_ACTIVE.dec(), job.unclaim()))
+
+    def _finish(self, job: BatchJob, status: str):
+        job.metadata["status"] = status
+        job.metadata["finished_at"] = time.time()
+        job.save()
+        job.notify()
+        logger.info("Batch job finished",
+                    job_id=job.id,
+                    status=status,
+                    completed=job.metadata["completed"],
+                    failed=job.metadata["failed"])
+
+    def _finished_ids(self, job: BatchJob) -> Set[str]:
+        done = set()
+        completed = failed = 0
+        valid_bytes = 0
+        with open(job.output_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                valid_bytes += len(line)
+                result = json.loads(line)
+                done.add(result["custom_id"])
+                if result.get("error"):
+                    failed += 1
+                else:
+                    completed += 1
+        # Drop a trailing partial line left by a crash mid-write
+        with open(job.output_path, "r+b") as f:
+            f.truncate(valid_bytes)
+        job.metadata["completed"] = completed
+        job.metadata["failed"] = failed
+        return done
+
+    async def _run(self, job: BatchJob):
+        metadata = job.metadata
+        done = self._finished_ids(job)
+        metadata["status"] = "in_progress"
+        metadata["started_at"] = metadata.get("started_at") or time.time()
+        metadata["resumed_at"] = time.time()
+        metadata["run_completed"] = 0
+        metadata["run_completion_tokens"] = 0
+        job.save()
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending: Set[asyncio.Task] = set()
+        cancelled = False
+
+        try:
+            with open(job.input_path, "rb") as f_in, open(job.output_path, "ab") as f_out:
+                line_number = 0
+                for raw_line in f_in:
+                    if not raw_line.strip():
+                        continue
+                    line_number += 1
+
+                    try:
+                        line = json.loads(raw_line)
+                    except ValueError:
+                        line = {"custom_id": f"line-{line_number}", "body": None}
+                    if not isinstance(line, dict):
+                        line = {"custom_id": f"line-{line_number}", "body": line}
+                    custom_id = str(line.get("custom_id") or f"line-{line_number}")
+                    if custom_id in done:
+                        continue
+                    body = line["body"] if "body" in line else line
+
+                    # Cancellation requested through another worker
+                    if os.path.exists(job.cancel_path):
+                        cancelled = True
+                        break
+
+                    await semaphore.acquire()
+                    task = asyncio.create_task(self._process(job, custom_id, body, f_out))
+                    pending.add(task)
+                    task.add_done_callback(lambda t: (pending.discard(t), semaphore.release()))
+
+                if pending:
+                    await asyncio.gather(*pending)
+
+            self._finish(job, "cancelled" if cancelled else "completed")
+        except asyncio.CancelledError:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            job.save()
+            raise
+        except Exception as e:
+            logger.error("Batch job failed", job_id=job.id, error=str(e))
+            metadata["error"] = str(e)
+            self._finish(job, "failed")
+
+    async def _process(self, job: BatchJob, custom_id: str, body: Any, f_out):
+        result_line = {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": custom_id, "response": None, "error": None}
+        try:
+            chat_request = parse_chat_request(body)
+            chat_request.stream = False
+            key_name = job.metadata.get("api_key_name", ANONYMOUS_KEY)
+            result = await self._generate(chat_request, key_name)
+            if self.quotas is not None:
+                self.quotas.charge_result(key_name, result)
+            result_line["response"] = {"status_code": 200, "body": build_chat_completion(result)}
+            job.metadata["completed"] += 1
+            job.metadata["run_completion_tokens"] += result.get("tokens_predicted", 0)
+            BATCH_REQUESTS_COMPLETED.labels(status="completed").inc()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result_line["error"] = {"message": str(e)}
+            job.metadata["failed"] += 1
+            BATCH_REQUESTS_COMPLETED.labels(status="failed").inc()
+
+        job.metadata["run_completed"] += 1
+        f_out.write((json.dumps(result_line) + "\n").encode("utf-8"))
+        f_out.flush()
+        job.notify()
+
+        if job.metadata["run_completed"] % 50 == 0:
+            job.save()
+
+    async def _generate(self, chat_request, key_name: str) -> Dict[str, Any]:
+        while True:
+            wait = self.quotas.token_wait(key_name) if self.quotas is not None else 0
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                return await self.llama_client.generate(chat_request, priority="batch")
+            except (AdmissionRejected, BackendUnavailable) as e:
+                # Batch work waits for capacity or a healthy backend rather than failing
+                await asyncio.sleep(e.retry_after)
@@ -0,0 +1,254 @@
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from .models import ChatCompletionRequest
+from .metrics import (
+    RESPONSE_CACHE_HITS,
+    RESPONSE_CACHE_MISSES,
+    RESPONSE_CACHE_EVICTIONS,
+    RESPONSE_CACHE_BYTES,
+    TEMPLATE_CACHE_LOOKUPS,
+    TEMPLATE_CACHE_OBSERVATIONS
+)
+
+# Rough per-entry bookkeeping cost (key, timestamps, dict) on top of the content
+ENTRY_OVERHEAD_BYTES = 256
+
+def normalize_prompt(prompt_text: str) -> str:
+    return " ".join(prompt_text.split())
+
+def sampling_key(request: ChatCompletionRequest, prompt_text: str) -> str:
+    """Cache key covering the normalized prompt and every sampling parameter."""
+    stop = request.stop if isinstance(request.stop, list) else [request.stop] if request.stop else []
+    material = json.dumps([
+        normalize_prompt(prompt_text),
+        request.max_tokens,
+        request.temperature,
+        request.top_p,
+        request.top_k,
+        request.repeat_penalty,
+        stop,
+        request.output_mode
+    ], ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """Bounded LRU cache of generation results with per-entry TTL.
+
+    Entries are evicted least-recently-used first once either ``max_entries``
+    or ``max_bytes`` would be exceeded, and lazily on lookup once expired.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float, max_temperature: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def is_cacheable(self, request: ChatCompletionRequest) -> bool:
+        return (request.temperature or 0.0) <= self.max_temperature
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            RESPONSE_CACHE_MISSES.inc()
+            return None
+
+        expires_at, _, result = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            RESPONSE_CACHE_EVICTIONS.labels(reason="expired").inc()
+            RESPONSE_CACHE_MISSES.inc()
+            return None
+
+        self._entries.move_to_end(key)
+        RESPONSE_CACHE_HITS.inc()
+        return result
+
+    def put(self, key: str, result: Dict[str, Any], ttl: Optional[float] = None):
+        size = len(key) + len(result.get("content", "").encode("utf-8")) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        while self._entries and (len(self._entries) >= self.max_entries or self.total_bytes + size > self.max_bytes):
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            RESPONSE_CACHE_EVICTIONS.labels(reason="capacity").inc()
+
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (expires_at, size, result)
+        self.total_bytes += size
+        RESPONSE_CACHE_BYTES.set(self.total_bytes)
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+        RESPONSE_CACHE_BYTES.set(0)
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+        RESPONSE_CACHE_BYTES.set(self.total_bytes)
+
+# Quoted strings (not apostrophes inside words) or bare numbers
+LITERAL_PATTERN = re.compile(r"""(?<!\w)'([^']*)'(?!\w)|(?<!\w)"([^"]*)"(?!\w)|(?<![\w.$])(-?\d+(?:\.\d+)?)(?![\w.])""")
+PARAM_PATTERN = re.compile(r"\$p(\d+)\b")
+STRING_SLOT = "\x00s\x00"
+NUMBER_SLOT = "\x00n\x00"
+
+def extract_literals(prompt_text: str) -> Tuple[str, List[Tuple[str, str]]]:
+    """Split a prompt into a de-literalized template and its ordered literals.
+
+    Each literal is returned as ``(kind, value)`` where kind is ``"string"``
+    or ``"number"``.
+    """
+    literals = []
+
+    def replace(match):
+        if match.group(3) is not None:
+            literals.append(("number", match.group(3)))
+            return NUMBER_SLOT
+        value = match.group(1) if match.group(1) is not None else match.group(2)
+        literals.append(("string", value))
+        return STRING_SLOT
+
+    template = LITERAL_PATTERN.sub(replace, normalize_prompt(prompt_text))
+    return template, literals
+
+def cypher_literal(kind: str, value: str) -> str:
+    if kind == "number":
+        return value
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+def parameter_value(kind: str, value: str):
+    if kind == "number":
+        return float(value) if "." in value else int(value)
+    return value
+
+def parameterize_query(query: str, literals: List[Tuple[str, str]]) -> Optional[str]:
+    """Replace each prompt literal in a generated query with a ``$pN`` parameter.
+
+    Returns None when the mapping is not trustworthy: a literal is missing
+    from the query, two literals share a value, the query already uses
+    ``$pN`` names, or a literal still appears unparameterized afterwards.
+    """
+    if PARAM_PATTERN.search(query):
+        return None
+    if len({value for _, value in literals}) != len(literals):
+        return None
+
+    parameterized = query
+    for index, (kind, value) in enumerate(literals):
+        if kind == "number":
+            pattern = re.compile(r"(?<![\w.$])" + re.escape(value) + r"(?![\w.])")
+        else:
+            pattern = re.compile("'" + re.escape(value) + "'|\"" + re.escape(value) + "\"")
+
+        parameterized, count = pattern.subn(f"$p{index}", parameterized)
+        if count == 0:
+            return None
+
+    remainder = PARAM_PATTERN.sub("", parameterized)
+    for _, value in literals:
+        if value and value in remainder:
+            return None
+
+    return parameterized
+
+class TemplateCache:
+    """Cache of generated Cypher keyed on the de-literalized prompt template.
+
+    A template is only served from the cache after ``min_confirmations``
+    generations with different literals have produced the same
+    parameterized query; any disagreement resets its confirmations.
+    """
+
+    def __init__(self, max_entries: int, min_confirmations: int, max_temperature: float, entries=None):
+        self.max_entries = max_entries
+        self.min_confirmations = min_confirmations
+        self.max_temperature = max_temperature
+        # An OrderedDict, or api.shared_state.SharedEntries when workers share the cache
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = entries if entries is not None else OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def is_cacheable(self, request: ChatCompletionRequest) -> bool:
+        return (request.temperature or 0.0) <= self.max_temperature
+
+    def lookup(self, request: ChatCompletionRequest, prompt_text: str) -> Optional[Dict[str, Any]]:
+        template, literals = extract_literals(prompt_text)
+        if not literals:
+            return None
+
+        key = sampling_key(request, template)
+        entry = self._entries.get(key)
+        if entry is None:
+            TEMPLATE_CACHE_LOOKUPS.labels(result="miss").inc()
+            return None
+        if entry["confirmations"] < self.min_confirmations:
+            TEMPLATE_CACHE_LOOKUPS.labels(result="unconfirmed").inc()
+            return None
+
+        self._entries.move_to_end(key)
+        TEMPLATE_CACHE_LOOKUPS.labels(result="hit").inc()
+
+        query = entry["query"]
+        content = PARAM_PATTERN.sub(lambda m: cypher_literal(*literals[int(m.group(1))]), query)
+        return {
+            "content": content,
+            "tokens_predicted": 0,
+            "tokens_evaluated": 0,
+            "generation_time": 0.0,
+            "tokens_per_second": 0,
+            "truncated": False,
+            "stop_reason": "stop",
+            "cypher_template": {
+                "query": query,
+                "params": {f"p{index}": parameter_value(kind, value) for index, (kind, value) in enumerate(literals)}
+            }
+        }
+
+    def learn(self, request: ChatCompletionRequest, prompt_text: str, content: str):
+        template, literals = extract_literals(prompt_text)
+        if not literals:
+            return
+
+        key = sampling_key(request, template)
+        query = parameterize_query(content, literals)
+        # Lists rather than tuples, so entries compare equal after a JSON round trip
+        literals = [list(literal) for literal in literals]
+        if query is None:
+            self._entries.pop(key, None)
+            TEMPLATE_CACHE_OBSERVATIONS.labels(outcome="rejected").inc()
+            return
+
+        entry = self._entries.get(key)
+        if entry is not None and entry["query"] == query:
+            if entry["literals"] != literals:
+                entry["confirmations"] += 1
+                entry["literals"] = literals
+                self._entries[key] = entry
+            self._entries.move_to_end(key)
+            TEMPLATE_CACHE_OBSERVATIONS.labels(outcome="confirmed").inc()
+            return
+
+        if entry is None:
+            while len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+
+        self._entries[key] = {"query": query, "literals": literals, "confirmations": 1}
+        self._entries.move_to_end(key)
+        TEMPLATE_CACHE_OBSERVATIONS.labels(outcome="learned" if entry is None else "conflict").inc()
@@ -1,33 +1,145 @@
 from pydantic import BaseModel, Field, validator
 from pydantic_settings import BaseSettings
-from typing import Optional, Literal
+from typing import Optional, Literal, List, Dict
 import os
 
+ENDPOINT_SCHEMES = ('http://', 'https://', 'unix://')
+
 class LlamaConfig(BaseModel):
     endpoint: str = Field(..., description="Llama.cpp server endpoint")
+    endpoints: List[str] = Field(default_factory=list, description="All llama.cpp server endpoints to balance across")
     timeout: int = Field(default=30, description="Request timeout in seconds")
+    max_connections: int = Field(default=100, ge=1, description="Maximum open connections to all backends")
+    max_keepalive_connections: int = Field(default=20, ge=0, description="Idle connections kept open for reuse")
+    keepalive_expiry: float = Field(default=30.0, ge=0, description="Seconds an idle connection is kept before closing")
     max_retries: int = Field(default=3, description="Maximum retry attempts")
+    failure_threshold: int = Field(default=3, ge=1, description="Consecutive failures before a backend is ejected")
+    ejection_time: float = Field(default=10.0, gt=0, description="Initial ejection period in seconds")
+    max_ejection_time: float = Field(default=300.0, gt=0, description="Upper bound on the ejection period in seconds")
+    slow_start: float = Field(default=30.0, ge=0, description="Seconds over which a re-admitted backend ramps up to full weight")
+    health_interval: float = Field(default=5.0, gt=0, description="Seconds between background health probes")
+    health_timeout: float = Field(default=2.0, gt=0, description="Timeout of a single health probe in seconds")
+    health_rise: int = Field(default=2, ge=1, description="Consecutive successful probes before a backend is healthy again")
+    health_fall: int = Field(default=3, ge=1, description="Consecutive failed probes before a backend's circuit opens")
+    retry_budget_ratio: float = Field(default=0.1, ge=0, description="Retries and hedges allowed as a fraction of recent requests")
+    retry_budget_min_per_second: float = Field(default=1.0, ge=0, description="Retries per second always allowed regardless of traffic, per API worker")
+    retry_backoff_base: float = Field(default=0.5, gt=0, description="Base delay in seconds for jittered exponential backoff")
+    retry_backoff_max: float = Field(default=5.0, gt=0, description="Upper bound on a single backoff delay in seconds")
+    hedging_enabled: bool = Field(default=False, description="Send a duplicate generation to another backend when the first is slow")
+    hedge_quantile: float = Field(default=0.95, gt=0, lt=1, description="Time-to-first-token quantile after which a generation is hedged")
+    hedge_delay: float = Field(default=2.0, gt=0, description="Hedge delay in seconds until enough latencies have been observed")
+    hedge_min_delay: float = Field(default=0.25, ge=0, description="Lower bound on the hedge delay in seconds")
+    role_stop_sequences: bool = Field(default=False, description="Also stop text-mode generations when the model starts a new role-prefixed turn")
     
     @validator('endpoint')
     def validate_endpoint(cls, v):
-        if not v.startswith(('http://', 'https://')):
-            raise ValueError('Endpoint must start with http:// or https://')
+        if not v.startswith(ENDPOINT_SCHEMES):
+            raise ValueError('Endpoint must start with http://, https:// or unix://')
+        return v
+    
+    @validator('endpoints', each_item=True)
+    def validate_endpoints(cls, v):
+        if not v.startswith(ENDPOINT_SCHEMES):
+            raise ValueError('Endpoint must start with http://, https:// or unix://')
         return v
+    
+    @property
+    def backend_endpoints(self) -> List[str]:
+        return self.endpoints or [self.endpoint]
 
 class APIConfig(BaseModel):
     api_key: Optional[str] = Field(default=None, description="API key for authentication")
+    api_keys: Dict[str, str] = Field(default_factory=dict, description="Key name per accepted API key")
     max_tokens: int = Field(default=512, ge=1, le=4096, description="Maximum tokens to generate")
     temperature: float = Field(default=0.7, ge=0.0, le=2.0, description="Sampling temperature")
     top_p: float = Field(default=0.9, ge=0.0, le=1.0, description="Top-p sampling parameter")
     
+class CacheConfig(BaseModel):
+    enabled: bool = Field(default=True, description="Enable the response cache")
+    max_entries: int = Field(default=1024, ge=1, description="Maximum number of cached responses")
+    max_bytes: int = Field(default=16 * 1024 * 1024, ge=1, description="Maximum total size of cached responses in bytes")
+    ttl: float = Field(default=3600.0, gt=0, description="Time-to-live of a cached response in seconds")
+    max_temperature: float = Field(default=0.1, ge=0.0, le=2.0, description="Highest temperature treated as deterministic")
+
+class TemplateCacheConfig(BaseModel):
+    enabled: bool = Field(default=False, description="Enable the parameterized template cache")
+    max_entries: int = Field(default=512, ge=1, description="Maximum number of cached templates")
+    min_confirmations: int = Field(default=2, ge=1, description="Agreeing generations required before a template is served")
+    max_temperature: float = Field(default=0.1, ge=0.0, le=2.0, description="Highest temperature treated as deterministic")
+
+class SlotAffinityConfig(BaseModel):
+    enabled: bool = Field(default=True, description="Pin conversations to llama.cpp slots")
+    slots_per_backend: int = Field(default=4, ge=1, description="Parallel slots per llama.cpp server (--parallel)")
+    prefix_chars: int = Field(default=512, ge=1, description="Prompt prefix length hashed when no session ID is sent")
+
+class PromptBudgetConfig(BaseModel):
+    enabled: bool = Field(default=True, description="Trim conversation history to fit the context window")
+    context_size: int = Field(default=1024, ge=1, description="Per-slot context size used when llama.cpp does not report one")
+    margin: int = Field(default=16, ge=0, description="Tokens kept free for special tokens and tokenization drift")
+    max_entries: int = Field(default=8192, ge=1, description="Maximum number of cached per-message token counts")
+
+class SessionConfig(BaseModel):
+    max_sessions: int = Field(default=1000, ge=1, description="Maximum number of conversations kept in memory")
+    max_bytes: int = Field(default=64 * 1024 * 1024, ge=1, description="Approximate memory cap for all conversations in bytes")
+    idle_ttl: float = Field(default=1800.0, gt=0, description="Seconds a conversation may stay idle before it is dropped")
+    lease_ttl: float = Field(default=600.0, gt=0, description="Seconds after which a turn left unfinished by an exited worker unlocks its conversation")
+
+class AdmissionConfig(BaseModel):
+    enabled: bool = Field(default=True, description="Queue requests in front of the llama.cpp backends")
+    max_concurrency: int = Field(default=4, ge=1, description="Concurrent generations allowed across all backends")
+    max_queue: int = Field(default=64, ge=0, description="Maximum number of queued requests before shedding")
+    api_key_priorities: Dict[str, str] = Field(default_factory=dict, description="Priority class per API key name")
+
+class QuotaLimits(BaseModel):
+    requests_per_second: float = Field(default=0.0, ge=0, description="Requests per second, 0 for no limit")
+    tokens_per_minute: float = Field(default=0.0, ge=0, description="Prompt plus completion tokens per minute, 0 for no limit")
+
+class QuotaConfig(BaseModel):
+    enabled: bool = Field(default=True, description="Enforce per-API-key quotas")
+    default: QuotaLimits = Field(default_factory=QuotaLimits, description="Limits for keys without their own")
+    per_key: Dict[str, QuotaLimits] = Field(default_factory=dict, description="Limits per key name")
+
+class WarmupConfig(BaseModel):
+    enabled: bool = Field(default=True, description="Warm up and prime the backends before reporting ready")
+    prompts_file: Optional[str] = Field(default=None, description="JSON list of warm-up prompts or chat requests")
+    slots_per_backend: int = Field(default=4, ge=1, description="Slots primed on each backend")
+    timeout: float = Field(default=300.0, gt=0, description="Seconds after which warm-up is abandoned")
+    max_backoff: float = Field(default=10.0, gt=0, description="Longest wait in seconds between checks for a loading backend")
+
+class WorkerConfig(BaseModel):
+    workers: int = Field(default=1, ge=1, description="Uvicorn worker processes serving the API")
+    shared_state_dir: str = Field(default="/dev/shm/cypher-api", description="Directory of the state shared between workers")
+    admission_poll_interval: float = Field(default=0.02, gt=0, description="Seconds between retries for permits released by other workers")
+    
+    @property
+    def shared(self) -> bool:
+        return self.workers > 1
+
+class LoggingConfig(BaseModel):
+    level: Literal["DEBUG", "INFO", "WARNING", "ERROR"] = Field(default="INFO", description="Lowest level logged")
+    queue_enabled: bool = Field(default=True, description="Render and write log records on a background thread")
+    queue_size: int = Field(default=10000, ge=1, description="Records buffered for the writer thread before new ones are dropped")
+    sample_rate: float = Field(default=1.0, ge=0, le=1, description="Fraction of requests whose INFO and DEBUG events are logged")
+    rate_limits: Dict[str, float] = Field(default_factory=dict, description="Events per second allowed per level")
+
 class MonitoringConfig(BaseModel):
     enable_metrics: bool = Field(default=True, description="Enable Prometheus metrics")
     metrics_port: int = Field(default=8001, description="Port for metrics endpoint")
 
 class Settings(BaseSettings):
     llama_endpoint: str = Field(default="http://localhost:8080", env="LLAMA_ENDPOINT")
+    llama_endpoints: Optional[str] = Field(default=None, env="LLAMA_ENDPOINTS")
     api_key: Optional[str] = Field(default=None, env="API_KEY")
+    api_keys: Optional[str] = Field(default=None, env="API_KEYS")
     log_level: Literal["DEBUG", "INFO", "WARNING", "ERROR"] = Field(default="INFO", env="LOG_LEVEL")
+    log_queue_enabled: bool = Field(default=True, env="LOG_QUEUE_ENABLED")
+    log_queue_size: int = Field(default=10000, env="LOG_QUEUE_SIZE")
+    log_sample_rate: float = Field(default=1.0, env="LOG_SAMPLE_RATE")
+    log_rate_limits: Optional[str] = Field(default=None, env="LOG_RATE_LIMITS")
+    
+    api_workers: int = Field(default=1, env="API_WORKERS")
+    shared_state_dir: str = Field(default="/dev/shm/cypher-api", env="SHARED_STATE_DIR")
+    admission_poll_interval: float = Field(default=0.02, env="ADMISSION_POLL_INTERVAL")
     
     max_tokens: int = Field(default=512, env="MAX_TOKENS")
     temperature: float = Field(default=0.7, env="TEMPERATURE")
@@ -39,33 +151,264 @@ class Settings(BaseSettings):
     request_timeout: int = Field(default=30, env="REQUEST_TIMEOUT")
     max_retries: int = Field(default=3, env="MAX_RETRIES")
     
+    llama_max_connections: int = Field(default=100, env="LLAMA_MAX_CONNECTIONS")
+    llama_max_keepalive_connections: int = Field(default=20, env="LLAMA_MAX_KEEPALIVE_CONNECTIONS")
+    llama_keepalive_expiry: float = Field(default=30.0, env="LLAMA_KEEPALIVE_EXPIRY")
+    
+    backend_failure_threshold: int = Field(default=3, env="BACKEND_FAILURE_THRESHOLD")
+    backend_ejection_time: float = Field(default=10.0, env="BACKEND_EJECTION_TIME")
+    backend_max_ejection_time: float = Field(default=300.0, env="BACKEND_MAX_EJECTION_TIME")
+    backend_slow_start: float = Field(default=30.0, env="BACKEND_SLOW_START")
+    
+    health_probe_interval: float = Field(default=5.0, env="HEALTH_PROBE_INTERVAL")
+    health_probe_timeout: float = Field(default=2.0, env="HEALTH_PROBE_TIMEOUT")
+    health_rise: int = Field(default=2, env="HEALTH_RISE")
+    health_fall: int = Field(default=3, env="HEALTH_FALL")
+    
+    retry_budget_ratio: float = Field(default=0.1, env="RETRY_BUDGET_RATIO")
+    retry_budget_min_per_second: float = Field(default=1.0, env="RETRY_BUDGET_MIN_PER_SECOND")
+    retry_backoff_base: float = Field(default=0.5, env="RETRY_BACKOFF_BASE")
+    retry_backoff_max: float = Field(default=5.0, env="RETRY_BACKOFF_MAX")
+    hedging_enabled: bool = Field(default=False, env="HEDGING_ENABLED")
+    hedge_quantile: float = Field(default=0.95, env="HEDGE_QUANTILE")
+    hedge_delay: float = Field(default=2.0, env="HEDGE_DELAY")
+    hedge_min_delay: float = Field(default=0.25, env="HEDGE_MIN_DELAY")
+    
+    role_stop_sequences: bool = Field(default=False, env="ROLE_STOP_SEQUENCES")
+    
+    slot_affinity_enabled: bool = Field(default=True, env="SLOT_AFFINITY_ENABLED")
+    parallel_slots: int = Field(default=4, env="PARALLEL_SLOTS")
+    slot_affinity_prefix_chars: int = Field(default=512, env="SLOT_AFFINITY_PREFIX_CHARS")
+    
+    prompt_trimming_enabled: bool = Field(default=True, env="PROMPT_TRIMMING_ENABLED")
+    context_size: int = Field(default=4096, env="CONTEXT_SIZE")
+    prompt_token_margin: int = Field(default=16, env="PROMPT_TOKEN_MARGIN")
+    token_count_cache_entries: int = Field(default=8192, env="TOKEN_COUNT_CACHE_ENTRIES")
+    
+    session_max_count: int = Field(default=1000, env="SESSION_MAX_COUNT")
+    session_max_bytes: int = Field(default=64 * 1024 * 1024, env="SESSION_MAX_BYTES")
+    session_idle_ttl: float = Field(default=1800.0, env="SESSION_IDLE_TTL")
+    session_lease_ttl: float = Field(default=600.0, env="SESSION_LEASE_TTL")
+    
+    admission_enabled: bool = Field(default=True, env="ADMISSION_ENABLED")
+    admission_max_concurrency: int = Field(default=4, env="ADMISSION_MAX_CONCURRENCY")
+    admission_max_queue: int = Field(default=64, env="ADMISSION_MAX_QUEUE")
+    api_key_priorities: Optional[str] = Field(default=None, env="API_KEY_PRIORITIES")
+    
+    quota_enabled: bool = Field(default=True, env="QUOTA_ENABLED")
+    quota_requests_per_second: float = Field(default=0.0, env="QUOTA_REQUESTS_PER_SECOND")
+    quota_tokens_per_minute: float = Field(default=0.0, env="QUOTA_TOKENS_PER_MINUTE")
+    api_key_quotas: Optional[str] = Field(default=None, env="API_KEY_QUOTAS")
+    
+    warmup_enabled: bool = Field(default=True, env="WARMUP_ENABLED")
+    warmup_prompts_file: Optional[str] = Field(default=None, env="WARMUP_PROMPTS_FILE")
+    warmup_timeout: float = Field(default=300.0, env="WARMUP_TIMEOUT")
+    warmup_max_backoff: float = Field(default=10.0, env="WARMUP_MAX_BACKOFF")
+    
+    batch_dir: str = Field(default="data/batches", env="BATCH_DIR")
+    batch_concurrency: int = Field(default=8, env="BATCH_CONCURRENCY")
+    
+    single_flight_enabled: bool = Field(default=True, env="SINGLE_FLIGHT_ENABLED")
+    
+    response_cache_enabled: bool = Field(default=True, env="RESPONSE_CACHE_ENABLED")
+    response_cache_max_entries: int = Field(default=1024, env="RESPONSE_CACHE_MAX_ENTRIES")
+    response_cache_max_bytes: int = Field(default=16 * 1024 * 1024, env="RESPONSE_CACHE_MAX_BYTES")
+    response_cache_ttl: float = Field(default=3600.0, env="RESPONSE_CACHE_TTL")
+    response_cache_max_temperature: float = Field(default=0.1, env="RESPONSE_CACHE_MAX_TEMPERATURE")
+    
+    template_cache_enabled: bool = Field(default=False, env="TEMPLATE_CACHE_ENABLED")
+    template_cache_max_entries: int = Field(default=512, env="TEMPLATE_CACHE_MAX_ENTRIES")
+    template_cache_min_confirmations: int = Field(default=2, env="TEMPLATE_CACHE_MIN_CONFIRMATIONS")
+    template_cache_max_temperature: float = Field(default=0.1, env="TEMPLATE_CACHE_MAX_TEMPERATURE")
+    
     class Config:
         env_file = ".env"
         case_sensitive = False
     
     @validator('llama_endpoint')
     def validate_llama_endpoint(cls, v):
-        if not v.startswith(('http://', 'https://')):
-            raise ValueError('LLAMA_ENDPOINT must start with http:// or https://')
+        if not v.startswith(ENDPOINT_SCHEMES):
+            raise ValueError('LLAMA_ENDPOINT must start with http://, https:// or unix://')
+        return v
+    
+    @validator('llama_endpoints')
+    def validate_llama_endpoints(cls, v):
+        if v:
+            for endpoint in v.split(','):
+                if not endpoint.strip().startswith(ENDPOINT_SCHEMES):
+                    raise ValueError('LLAMA_ENDPOINTS entries must start with http://, https:// or unix://')
         return v
     
+    @property
+    def llama_endpoint_list(self) -> List[str]:
+        if self.llama_endpoints:
+            return [endpoint.strip() for endpoint in self.llama_endpoints.split(',') if endpoint.strip()]
+        return [self.llama_endpoint]
+    
     @property
     def llama_config(self) -> LlamaConfig:
+        endpoints = self.llama_endpoint_list
         return LlamaConfig(
-            endpoint=self.llama_endpoint,
+            endpoint=endpoints[0],
+            endpoints=endpoints,
             timeout=self.request_timeout,
-            max_retries=self.max_retries
+            max_retries=self.max_retries,
+            max_connections=self.llama_max_connections,
+            max_keepalive_connections=self.llama_max_keepalive_connections,
+            keepalive_expiry=self.llama_keepalive_expiry,
+            failure_threshold=self.backend_failure_threshold,
+            ejection_time=self.backend_ejection_time,
+            max_ejection_time=self.backend_max_ejection_time,
+            slow_start=self.backend_slow_start,
+            health_interval=self.health_probe_interval,
+            health_timeout=self.health_probe_timeout,
+            health_rise=self.health_rise,
+            health_fall=self.health_fall,
+            retry_budget_ratio=self.retry_budget_ratio,
+            # Every worker keeps its own retry budget; the ratio already scales with its share of the traffic
+            retry_budget_min_per_second=self.retry_budget_min_per_second / self.api_workers,
+            retry_backoff_base=self.retry_backoff_base,
+            retry_backoff_max=self.retry_backoff_max,
+            hedging_enabled=self.hedging_enabled,
+            hedge_quantile=self.hedge_quantile,
+            hedge_delay=self.hedge_delay,
+            hedge_min_delay=self.hedge_min_delay,
+            role_stop_sequences=self.role_stop_sequences
         )
     
     @property
     def api_config(self) -> APIConfig:
+        # The single API_KEY keeps working, under the name "default"
+        api_keys = {self.api_key: "default"} if self.api_key else {}
+        if self.api_keys:
+            for entry in self.api_keys.split(','):
+                name, _, key = entry.strip().partition(':')
+                if name and key:
+                    api_keys[key] = name
         return APIConfig(
             api_key=self.api_key,
+            api_keys=api_keys,
             max_tokens=self.max_tokens,
             temperature=self.temperature,
             top_p=self.top_p
         )
     
+    @property
+    def cache_config(self) -> CacheConfig:
+        return CacheConfig(
+            enabled=self.response_cache_enabled,
+            max_entries=self.response_cache_max_entries,
+            max_bytes=self.response_cache_max_bytes,
+            ttl=self.response_cache_ttl,
+            max_temperature=self.response_cache_max_temperature
+        )
+    
+    @property
+    def template_cache_config(self) -> TemplateCacheConfig:
+        return TemplateCacheConfig(
+            enabled=self.template_cache_enabled,
+            max_entries=self.template_cache_max_entries,
+            min_confirmations=self.template_cache_min_confirmations,
+            max_temperature=self.template_cache_max_temperature
+        )
+    
+    @property
+    def slot_affinity_config(self) -> SlotAffinityConfig:
+        return SlotAffinityConfig(
+            enabled=self.slot_affinity_enabled,
+            slots_per_backend=self.parallel_slots,
+            prefix_chars=self.slot_affinity_prefix_chars
+        )
+    
+    @property
+    def prompt_budget_config(self) -> PromptBudgetConfig:
+        # llama.cpp splits --ctx-size evenly across its --parallel slots
+        return PromptBudgetConfig(
+            enabled=self.prompt_trimming_enabled,
+            context_size=max(1, self.context_size // self.parallel_slots),
+            margin=self.prompt_token_margin,
+            max_entries=self.token_count_cache_entries
+        )
+    
+    @property
+    def session_config(self) -> SessionConfig:
+        return SessionConfig(
+            max_sessions=self.session_max_count,
+            max_bytes=self.session_max_bytes,
+            idle_ttl=self.session_idle_ttl,
+            lease_ttl=self.session_lease_ttl
+        )
+    
+    @property
+    def admission_config(self) -> AdmissionConfig:
+        priorities = {}
+        if self.api_key_priorities:
+            for entry in self.api_key_priorities.split(','):
+                key, _, priority = entry.strip().rpartition(':')
+                if key:
+                    priorities[key] = priority
+        return AdmissionConfig(
+            enabled=self.admission_enabled,
+            max_concurrency=self.admission_max_concurrency,
+            max_queue=self.admission_max_queue,
+            api_key_priorities=priorities
+        )
+    
+    @property
+    def quota_config(self) -> QuotaConfig:
+        per_key = {}
+        if self.api_key_quotas:
+            for entry in self.api_key_quotas.split(','):
+                name, _, limits = entry.strip().partition(':')
+                requests_per_second, _, tokens_per_minute = limits.partition(':')
+                if name:
+                    per_key[name] = QuotaLimits(
+                        requests_per_second=float(requests_per_second or 0),
+                        tokens_per_minute=float(tokens_per_minute or 0)
+                    )
+        return QuotaConfig(
+            enabled=self.quota_enabled,
+            default=QuotaLimits(
+                requests_per_second=self.quota_requests_per_second,
+                tokens_per_minute=self.quota_tokens_per_minute
+            ),
+            per_key=per_key
+        )
+    
+    @property
+    def warmup_config(self) -> WarmupConfig:
+        return WarmupConfig(
+            enabled=self.warmup_enabled,
+            prompts_file=self.warmup_prompts_file,
+            slots_per_backend=self.parallel_slots,
+            timeout=self.warmup_timeout,
+            max_backoff=self.warmup_max_backoff
+        )
+    
+    @property
+    def worker_config(self) -> WorkerConfig:
+        return WorkerConfig(
+            workers=self.api_workers,
+            shared_state_dir=self.shared_state_dir,
+            admission_poll_interval=self.admission_poll_interval
+        )
+    
+    @property
+    def logging_config(self) -> LoggingConfig:
+        rate_limits = {}
+        if self.log_rate_limits:
+            for entry in self.log_rate_limits.split(','):
+                level, _, rate = entry.strip().partition(':')
+                if level and rate:
+                    rate_limits[level.lower()] = float(rate)
+        return LoggingConfig(
+            level=self.log_level,
+            queue_enabled=self.log_queue_enabled,
+            queue_size=self.log_queue_size,
+            sample_rate=self.log_sample_rate,
+            rate_limits=rate_limits
+        )
+    
     @property
     def monitoring_config(self) -> MonitoringConfig:
         return MonitoringConfig(
@@ -0,0 +1,44 @@
+"""GBNF grammars that constrain llama.cpp output to a single Cypher statement.
+
+The grammar is deliberately loose inside a clause, since any expression
+may follow a keyword, but strict about structure: the first line must start
+with a clause keyword, later lines must start with a keyword, a boolean
+operator, a closing bracket or indentation, and the statement ends at a
+semicolon or an empty line. Prose after the query is therefore
+unreachable and the model has to emit end-of-sequence instead.
+"""
+
+from typing import Dict, Optional
+
+CLAUSE_KEYWORDS = (
+    "MATCH", "OPTIONAL MATCH", "WHERE", "WITH", "RETURN", "ORDER BY", "SKIP", "LIMIT",
+    "CREATE", "MERGE", "ON CREATE SET", "ON MATCH SET", "SET", "DELETE", "DETACH DELETE",
+    "REMOVE", "UNWIND", "CALL", "YIELD", "UNION", "FOREACH", "AND", "OR", "XOR", "NOT"
+)
+
+def _case_insensitive(keyword: str) -> str:
+    # Whitespace between GBNF items is not literal, so spaces are quoted
+    return " ".join(f"[{c.upper()}{c.lower()}]" if c.isalpha() else f'"{c}"' for c in keyword)
+
+def _keyword_rule() -> str:
+    return " | ".join(_case_insensitive(keyword) for keyword in CLAUSE_KEYWORDS)
+
+_STATEMENT_RULES = f"""statement ::= clause ("\\n" line)* ";"?
+line ::= clause | continuation
+clause ::= keyword body
+continuation ::= [ \\t]+ [^ \\t\\n;] body | [)\\]}}] body
+keyword ::= {_keyword_rule()}
+body ::= [^\\n;]*
+"""
+
+CYPHER_GRAMMAR = 'root ::= statement "\\n"?\n' + _STATEMENT_RULES
+
+CYPHER_FENCED_GRAMMAR = 'root ::= "```cypher\\n" statement "\\n```"\n' + _STATEMENT_RULES
+
+OUTPUT_MODE_GRAMMARS: Dict[str, str] = {
+    "cypher": CYPHER_GRAMMAR,
+    "cypher_fenced": CYPHER_FENCED_GRAMMAR
+}
+
+def grammar_for(output_mode: Optional[str]) -> Optional[str]:
+    return OUTPUT_MODE_GRAMMARS.get(output_mode or "text")
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import structlog
+
+from .backend_pool import Backend, BackendPool
+from .metrics import HEALTH_PROBE_DURATION, HEALTH_PROBE_FAILURES
+
+logger = structlog.get_logger()
+
+class ProbeState:
+    """Last probe results for one backend, with rise/fall hysteresis."""
+
+    def __init__(self, backend: Backend):
+        self.backend = backend
+        self.healthy: Optional[bool] = None
+        self.consecutive_successes = 0
+        self.consecutive_failures = 0
+        self.checked_at: Optional[float] = None
+        self.response_time: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def record(self, ok: bool, rise: int, fall: int) -> bool:
+        """Count a probe result and return whether the health state flipped."""
+        if ok:
+            self.consecutive_successes += 1
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+            self.consecutive_successes = 0
+
+        if self.healthy is None:
+            # The first probe decides the initial state without waiting
+            self.healthy = ok
+            return True
+        if self.healthy and self.consecutive_failures >= fall:
+            self.healthy = False
+            return True
+        if not self.healthy and self.consecutive_successes >= rise:
+            self.healthy = True
+            return True
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "status": "healthy" if self.healthy else "unhealthy",
+            "endpoint": self.backend.endpoint,
+            "outstanding": self.backend.outstanding,
+            "circuit_open": self.backend.circuit_open,
+            "last_checked": time.time() - (time.monotonic() - self.checked_at) if self.checked_at else None
+        }
+        if self.response_time is not None:
+            data["response_time"] = self.response_time
+        if self.error:
+            data["error"] = self.error
+        return data
+
+class HealthProber:
+    """Probes every backend's /health in the background and caches the result.
+
+    A backend is marked unhealthy after ``fall`` consecutive failed probes
+    and healthy again after ``rise`` consecutive successes. Marking it
+    unhealthy opens its circuit in the pool so no request is sent to it;
+    the probes themselves act as the half-open trial that closes it again.
+    Health endpoints read the cached state and never wait on a backend.
+    """
+
+    def __init__(self, pool: BackendPool, client: httpx.AsyncClient, interval: float = 5.0,
+                 timeout: float = 2.0, rise: int = 2, fall: int = 3):
+        self.pool = pool
+        self.client = client
+        self.interval = interval
+        self.timeout = timeout
+        self.rise = rise
+        self.fall = fall
+        self.states: List[ProbeState] = [ProbeState(backend) for backend in pool.backends]
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return any(state.healthy for state in self.states)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error("Health probe round failed", error=str(e))
+
+    async def probe_all(self):
+        await asyncio.gather(*(self._probe(state) for state in self.states))
+
+    async def _probe(self, state: ProbeState):
+        endpoint = state.backend.endpoint
+        start = time.monotonic()
+        try:
+            response = await self.client.get(f"{state.backend.url}/health", timeout=self.timeout)
+            response.raise_for_status()
+            ok, error = True, None
+        except httpx.HTTPStatusError as e:
+            ok, error = False, f"HTTP {e.response.status_code}"
+        except httpx.RequestError as e:
+            ok, error = False, str(e) or type(e).__name__
+
+        duration = time.monotonic() - start
+        HEALTH_PROBE_DURATION.labels(backend=endpoint).observe(duration)
+        state.checked_at = time.monotonic()
+        state.response_time = duration if ok else None
+        state.error = error
+        if not ok:
+            HEALTH_PROBE_FAILURES.labels(backend=endpoint).inc()
+
+        if state.record(ok, self.rise, self.fall):
+            self.pool.set_circuit(state.backend, open=not state.healthy)
+            if state.healthy:
+                logger.info("Backend healthy, circuit closed", endpoint=endpoint)
+            else:
+                logger.warning("Backend unhealthy, circuit opened", endpoint=endpoint, error=error)
+
+    def status(self) -> Dict[str, Any]:
+        results = [state.to_dict() for state in self.states]
+        healthy = [result for result in results if result["status"] == "healthy"]
+
+        health = {
+            "status": "healthy" if healthy else "unhealthy",
+            "endpoint": healthy[0]["endpoint"] if healthy else self.pool.backends[0].endpoint,
+            "healthy_backends": len(healthy),
+            "backends": results
+        }
+        if not healthy:
+            health["error"] = "; ".join(f"{result['endpoint']}: {result.get('error', 'not probed yet')}" for result in results)
+        return health
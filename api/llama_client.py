@@ -1,51 +1,225 @@
 import httpx
 import asyncio
+import json
 import time
-from typing import Dict, Any, Optional
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional, AsyncIterator, Tuple
 from .config import LlamaConfig
-from .models import ChatCompletionRequest
+from .models import ChatCompletionRequest, ChatMessage, ROLE_STOP_SEQUENCES
+from .cypher_grammar import grammar_for
+from .cache import ResponseCache, TemplateCache, sampling_key
+from .backend_pool import Backend, BackendPool, BackendUnavailable
+from .health import HealthProber
+from .retry import RetryBudget, LatencyQuantile, backoff_delay
+from .transport import build_http_client
+from .slot_affinity import SlotAffinity
+from .admission import AdmissionController, AdmissionRejected
+from .single_flight import SingleFlight
+from .prompt_budget import PromptBudget
+from .shared_state import SharedState
+from .metrics import LLAMA_TIME_TO_FIRST_TOKEN, LLAMA_INTER_TOKEN_LATENCY, HEDGE_WINS, HEDGE_DELAY, record_llama_metrics, record_prompt_cache_reuse
 import structlog
 
 logger = structlog.get_logger()
 
+class Attempt:
+    """One streaming request to one backend slot.
+    
+    A task reads llama.cpp's messages into ``messages`` as they arrive. The
+    queue ends with the final message, put only once the response has been
+    closed, with None if the stream ended without one, or with the error
+    that ended the request.
+    """
+    
+    __slots__ = ("backend", "id_slot", "start_time", "messages", "task")
+    
+    def __init__(self, backend: Backend, id_slot: int):
+        self.backend = backend
+        self.id_slot = id_slot
+        self.start_time = time.time()
+        self.messages: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+    
+    async def next(self) -> Optional[Dict[str, Any]]:
+        """The next message, or None once the stream has ended; raises the request's error."""
+        message = await self.messages.get()
+        if isinstance(message, BaseException):
+            raise message
+        return message
+
 class LlamaClient:
-    def __init__(self, config: LlamaConfig):
+    def __init__(self, config: LlamaConfig, response_cache: Optional[ResponseCache] = None,
+                 template_cache: Optional[TemplateCache] = None, slot_affinity: Optional[SlotAffinity] = None,
+                 admission: Optional[AdmissionController] = None, single_flight: Optional[SingleFlight] = None,
+                 prompt_budget: Optional[PromptBudget] = None, shared_state: Optional[SharedState] = None):
         self.config = config
-        self.client = httpx.AsyncClient(timeout=config.timeout)
+        # Set when the caches live in the database shared between workers
+        self.shared_state = shared_state
+        self.prompt_budget = prompt_budget
+        self._context_size: Optional[int] = None
+        self.admission = admission
+        self.single_flight = single_flight
+        self.response_cache = response_cache
+        self.template_cache = template_cache
+        self.slot_affinity = slot_affinity
+        self.pool = BackendPool(
+            config.backend_endpoints,
+            failure_threshold=config.failure_threshold,
+            ejection_time=config.ejection_time,
+            max_ejection_time=config.max_ejection_time,
+            slow_start=config.slow_start,
+            circuit_retry_after=max(1, round(config.health_interval * config.health_rise))
+        )
+        self.client, base_urls = build_http_client(
+            config.backend_endpoints,
+            timeout=config.timeout,
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry
+        )
+        for backend in self.pool.backends:
+            backend.url = base_urls[backend.endpoint]
+        self.health = HealthProber(
+            self.pool,
+            self.client,
+            interval=config.health_interval,
+            timeout=config.health_timeout,
+            rise=config.health_rise,
+            fall=config.health_fall
+        )
+        self.retry_budget = RetryBudget(
+            ratio=config.retry_budget_ratio,
+            min_per_second=config.retry_budget_min_per_second
+        )
+        self.first_token_latency = LatencyQuantile(quantile=config.hedge_quantile) if config.hedging_enabled else None
         
     async def __aenter__(self):
         return self
         
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.health.stop()
         await self.client.aclose()
     
-    async def health_check(self) -> Dict[str, Any]:
+    def health_check(self) -> Dict[str, Any]:
+        """Backend health as last seen by the background prober."""
+        return self.health.status()
+    
+    async def prime(self, backend: Backend, prompt: str, id_slot: int):
+        """Evaluate ``prompt`` on one slot so the slot's prompt cache holds it."""
+        response = await self.client.post(f"{backend.url}/completion", json={
+            "prompt": prompt,
+            "n_predict": 1,
+            "temperature": 0,
+            "id_slot": id_slot,
+            "cache_prompt": True
+        })
+        response.raise_for_status()
+    
+    async def count_tokens(self, text: str) -> int:
+        backend = self.pool.select()
+        response = await self.client.post(f"{backend.url}/tokenize", json={"content": text})
+        response.raise_for_status()
+        return len(response.json()["tokens"])
+    
+    async def context_size(self) -> int:
+        """Per-slot context size reported by llama.cpp, or the configured fallback."""
+        if self._context_size is None:
+            backend = self.pool.select()
+            try:
+                response = await self.client.get(f"{backend.url}/props")
+                response.raise_for_status()
+                self._context_size = response.json()["default_generation_settings"]["n_ctx"]
+            except httpx.RequestError as e:
+                # Backend unreachable; try again on the next request
+                logger.warning("Could not read context size from llama.cpp", backend=backend.endpoint, error=str(e))
+                return self.prompt_budget.context_size
+            except (httpx.HTTPStatusError, KeyError, TypeError, ValueError) as e:
+                logger.warning("llama.cpp does not report its context size, using configured value",
+                               backend=backend.endpoint,
+                               context_size=self.prompt_budget.context_size,
+                               error=str(e))
+                self._context_size = self.prompt_budget.context_size
+        return self._context_size
+    
+    async def fit_messages(self, messages: List[ChatMessage], max_tokens: Optional[int]) -> List[ChatMessage]:
+        """Drop the oldest turns so the prompt plus ``max_tokens`` fits the context window."""
+        if self.prompt_budget is None or not messages:
+            return messages
         try:
-            response = await self.client.get(f"{self.config.endpoint}/health")
-            response.raise_for_status()
-            return {
-                "status": "healthy",
-                "endpoint": self.config.endpoint,
-                "response_time": response.elapsed.total_seconds()
-            }
-        except httpx.RequestError as e:
-            logger.error("Health check failed", error=str(e), endpoint=self.config.endpoint)
-            return {
-                "status": "unhealthy",
-                "endpoint": self.config.endpoint,
-                "error": str(e)
-            }
-        except httpx.HTTPStatusError as e:
-            logger.error("Health check HTTP error", status_code=e.response.status_code, endpoint=self.config.endpoint)
-            return {
-                "status": "unhealthy",
-                "endpoint": self.config.endpoint,
-                "error": f"HTTP {e.response.status_code}"
-            }
-    
-    async def generate(self, request: ChatCompletionRequest) -> Dict[str, Any]:
-        prompt_text = request.get_prompt_text()
+            return await self.prompt_budget.fit_messages(messages, max_tokens, self.count_tokens, await self.context_size())
+        except (httpx.HTTPError, KeyError, ValueError) as e:
+            # Fall back to llama.cpp's own truncation rather than failing the request
+            logger.warning("Could not count prompt tokens, sending history untrimmed", error=str(e))
+            return messages
+    
+    async def _fit_prompt(self, request: ChatCompletionRequest) -> ChatCompletionRequest:
+        if request.prompt or not request.messages:
+            return request
+        messages = await self.fit_messages(request.messages, request.max_tokens)
+        if len(messages) == len(request.messages):
+            return request
+        return request.model_copy(update={"messages": messages})
+    
+    async def _retry_delay(self, attempt: int, tried: list):
+        # Fail over to an untried backend immediately; back off once all have been tried
+        if len(tried) < len(self.pool):
+            return
+        await asyncio.sleep(backoff_delay(attempt, self.config.retry_backoff_base, self.config.retry_backoff_max))
+    
+    def _hedge_delay(self, tried: list) -> Optional[float]:
+        """Seconds to wait before hedging, or None when there is nowhere to hedge to."""
+        if self.first_token_latency is None:
+            return None
+        now = time.monotonic()
+        if not any(backend not in tried and not backend.circuit_open and not backend.is_ejected(now)
+                   for backend in self.pool.backends):
+            return None
+        observed = self.first_token_latency.value
+        delay = max(self.config.hedge_min_delay, observed) if observed is not None else self.config.hedge_delay
+        HEDGE_DELAY.set(delay)
+        return delay
+    
+    @asynccontextmanager
+    async def _admitted(self, priority: str, deadline: Optional[float]):
+        if self.admission is None:
+            yield
+            return
+        async with self.admission.admit(priority, deadline):
+            yield
+    
+    def _acquire(self, tried: list, affinity_key: Optional[str]) -> Tuple[Backend, int]:
+        """Reserve a backend and, with slot affinity enabled, the key's slot on it."""
+        if affinity_key is None:
+            backend = self.pool.acquire(exclude=tried)
+            tried.append(backend)
+            return backend, -1
         
+        preferred_endpoint = self.slot_affinity.preferred_endpoint(affinity_key)
+        preferred = self.pool.get(preferred_endpoint) if preferred_endpoint else None
+        backend = self.pool.acquire(exclude=tried, prefer=preferred)
+        tried.append(backend)
+        return backend, self.slot_affinity.assign(affinity_key, backend.endpoint)
+    
+    def _release(self, backend: Backend, id_slot: int):
+        self.pool.release(backend)
+        if self.slot_affinity is not None:
+            self.slot_affinity.release(backend.endpoint, id_slot)
+    
+    @staticmethod
+    def _prompt_tokens_reused(result: Dict[str, Any]) -> int:
+        # tokens_cached also counts generated tokens, so prefer the number of
+        # prompt tokens llama.cpp actually had to evaluate when it reports it
+        tokens_evaluated = result.get("tokens_evaluated", 0)
+        prompt_n = result.get("timings", {}).get("prompt_n")
+        if prompt_n is not None:
+            return max(0, tokens_evaluated - prompt_n)
+        return min(result.get("tokens_cached", 0), tokens_evaluated)
+    
+    def _build_payload(self, request: ChatCompletionRequest, prompt_text: str, stream: bool = False) -> Dict[str, Any]:
+        stop = request.stop if isinstance(request.stop, list) else [request.stop] if request.stop else []
+        # Always on in the Cypher modes; free-form text only gets them when configured
+        if request.output_mode != "text" or self.config.role_stop_sequences:
+            stop = stop + [sequence for sequence in ROLE_STOP_SEQUENCES if sequence not in stop]
         payload = {
             "prompt": prompt_text,
             "n_predict": request.max_tokens,
@@ -53,58 +227,411 @@ class LlamaClient:
             "top_p": request.top_p,
             "top_k": request.top_k,
             "repeat_penalty": request.repeat_penalty,
-            "stop": request.stop if isinstance(request.stop, list) else [request.stop] if request.stop else [],
-            "stream": False,
+            "stop": stop,
+            "stream": stream,
             "cache_prompt": True
         }
+        grammar = grammar_for(request.output_mode)
+        if grammar is not None:
+            payload["grammar"] = grammar
+        return payload
+    
+    @staticmethod
+    def _stop_reason(result: Dict[str, Any]) -> str:
+        # llama.cpp sets "stop" on every final message; the stopped_* flags say why
+        if result.get("stopped_limit", False):
+            return "length"
+        return "stop" if result.get("stop", False) else "length"
+    
+    @classmethod
+    def _telemetry_stop_reason(cls, result: Dict[str, Any]) -> str:
+        if result.get("truncated", False):
+            return "truncated"
+        if result.get("stopped_word", False):
+            return "stop_word"
+        return cls._stop_reason(result)
+    
+    def _record_telemetry(self, backend: Backend, result: Dict[str, Any], generation_time: float, tokens_reused: int):
+        tokens_evaluated = result.get("tokens_evaluated", 0)
+        tokens_predicted = result.get("tokens_predicted", 0)
+        record_prompt_cache_reuse(backend.endpoint, tokens_evaluated, tokens_reused)
+        record_llama_metrics(
+            backend.endpoint,
+            generation_time,
+            tokens_predicted,
+            result.get("timings", {}),
+            context_tokens=tokens_evaluated + tokens_predicted,
+            stop_reason=self._telemetry_stop_reason(result)
+        )
+    
+    def _cache_key(self, request: ChatCompletionRequest, prompt_text: str, use_cache: bool) -> Optional[str]:
+        if not use_cache or self.response_cache is None or not self.response_cache.is_cacheable(request):
+            return None
+        return sampling_key(request, prompt_text)
+    
+    def _flight_key(self, request: ChatCompletionRequest, prompt_text: str, use_cache: bool, priority: str) -> Optional[str]:
+        """Key for coalescing identical requests, or None if the request must run on its own.
+        
+        Only requests that could be served from the cache are merged: a
+        sampled request is entitled to its own sample, and ``no-cache`` asks
+        for a fresh generation. Followers wait in the leader's admission
+        queue, so the key includes the priority class.
+        """
+        if self.single_flight is None or not use_cache:
+            return None
+        cache = self.response_cache if self.response_cache is not None else self.template_cache
+        deterministic = cache.is_cacheable(request) if cache is not None else not request.temperature
+        if not deterministic:
+            return None
+        return f"{priority}:{sampling_key(request, prompt_text)}"
+    
+    def _use_template_cache(self, request: ChatCompletionRequest, use_cache: bool) -> bool:
+        return use_cache and self.template_cache is not None and self.template_cache.is_cacheable(request)
+    
+    async def _caches(self, fn, *args):
+        # Shared caches query SQLite, which may block; keep that off the event loop
+        if self.shared_state is None:
+            return fn(*args)
+        return await self.shared_state.run(fn, *args)
+    
+    def _lookup_caches(self, request: ChatCompletionRequest, prompt_text: str,
+                       cache_key: Optional[str], use_cache: bool) -> Optional[Dict[str, Any]]:
+        if cache_key:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                logger.debug("Serving generation from response cache", prompt_length=len(prompt_text))
+                return cached
+        
+        if self._use_template_cache(request, use_cache):
+            cached = self.template_cache.lookup(request, prompt_text)
+            if cached is not None:
+                logger.debug("Serving generation from template cache", prompt_length=len(prompt_text))
+                return cached
+        
+        return None
+    
+    def _store_caches(self, request: ChatCompletionRequest, prompt_text: str,
+                      cache_key: Optional[str], use_cache: bool, generation: Dict[str, Any]):
+        if cache_key:
+            self.response_cache.put(cache_key, generation)
+        
+        if self._use_template_cache(request, use_cache) and generation["stop_reason"] == "stop" and not generation["truncated"]:
+            self.template_cache.learn(request, prompt_text, generation["content"])
+    
+    async def generate(self, request: ChatCompletionRequest, use_cache: bool = True,
+                       session_id: Optional[str] = None, priority: str = "default",
+                       deadline: Optional[float] = None) -> Dict[str, Any]:
+        """Return a completion, from cache or from the least loaded backend.
+        
+        Conversation history is first trimmed to fit the context window.
+        ``priority`` and ``deadline`` (a ``time.monotonic()`` value) are used
+        by admission control; ``AdmissionRejected`` is raised when shed.
+        """
+        request = await self._fit_prompt(request)
+        prompt_text = request.get_prompt_text()
+        
+        cache_key = self._cache_key(request, prompt_text, use_cache)
+        cached = await self._caches(self._lookup_caches, request, prompt_text, cache_key, use_cache)
+        if cached is not None:
+            return dict(cached, cached=True)
+        
+        async def complete():
+            async with self._admitted(priority, deadline):
+                return await self._complete(request, prompt_text, cache_key, use_cache, session_id)
+        
+        flight_key = self._flight_key(request, prompt_text, use_cache, priority)
+        if flight_key is None:
+            return await complete()
+        # A follower shed for the leader's deadline retries under its own
+        return await self.single_flight.run(flight_key, complete, run_alone=(AdmissionRejected,))
+    
+    def _start(self, payload: Dict[str, Any], tried: list, affinity_key: Optional[str],
+               number: int, prompt_length: int) -> Attempt:
+        backend, id_slot = self._acquire(tried, affinity_key)
+        attempt = Attempt(backend, id_slot)
+        attempt.task = asyncio.ensure_future(self._run_attempt(payload, attempt, number, prompt_length))
+        return attempt
+    
+    async def _run_attempt(self, payload: Dict[str, Any], attempt: Attempt, number: int, prompt_length: int):
+        backend = attempt.backend
+        try:
+            logger.info("Sending generation request", 
+                       attempt=number + 1, 
+                       max_retries=self.config.max_retries,
+                       backend=backend.endpoint,
+                       id_slot=attempt.id_slot,
+                       prompt_length=prompt_length)
+            
+            async with self.client.stream(
+                "POST",
+                f"{backend.url}/completion",
+                json=dict(payload, id_slot=attempt.id_slot)
+            ) as response:
+                if response.is_error:
+                    await response.aread()
+                response.raise_for_status()
+                self.pool.record_success(backend)
+                
+                final = None
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    message = json.loads(line[len("data: "):])
+                    if message.get("stop", False):
+                        # Read on to the end of the body, which follows, to keep the connection
+                        final = message
+                        continue
+                    attempt.messages.put_nowait(message)
+            # Handed over only once the response is closed, so the reader
+            # finishing with it cannot cancel the close half-way
+            attempt.messages.put_nowait(final)
+        
+        except httpx.RequestError as e:
+            self.pool.record_failure(backend, str(e))
+            logger.warning("Generation attempt failed", attempt=number + 1, backend=backend.endpoint, error=str(e))
+            attempt.messages.put_nowait(e)
+        
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code >= 500:
+                self.pool.record_failure(backend, f"HTTP {e.response.status_code}")
+            logger.error("HTTP error from llama.cpp server", 
+                        status_code=e.response.status_code, 
+                        backend=backend.endpoint,
+                        response_text=e.response.text)
+            attempt.messages.put_nowait(e)
+        
+        except Exception as e:
+            attempt.messages.put_nowait(e)
+        
+        finally:
+            self._release(backend, attempt.id_slot)
+    
+    async def _send(self, payload: Dict[str, Any], tried: list, affinity_key: Optional[str],
+                    number: int, prompt_length: int) -> Tuple[Attempt, Optional[Dict[str, Any]]]:
+        """Start one attempt and wait for its first message, hedging it to a
+        second backend if that takes longer than the recent time to first token.
+        
+        The hedge is paid for from the retry budget and is skipped when the
+        budget is spent or no other backend is free. Whichever attempt starts
+        answering first wins and the other is cancelled; when the primary
+        wins, the key's slot affinity is given back to it.
+        """
+        primary = self._start(payload, tried, affinity_key, number, prompt_length)
+        attempts = {asyncio.ensure_future(primary.next()): primary}
+        hedge = winner = None
+        try:
+            delay = self._hedge_delay(tried)
+            if delay is not None:
+                done, _ = await asyncio.wait(attempts, timeout=delay)
+                if not done and self.retry_budget.try_spend("hedge"):
+                    previous_owner = self.slot_affinity.owner(affinity_key) if affinity_key is not None else None
+                    try:
+                        hedge = self._start(payload, tried, affinity_key, number, prompt_length)
+                    except BackendUnavailable as e:
+                        # Every other backend filled up meanwhile; keep waiting on the primary
+                        logger.info("Hedge skipped, no backend available", backend=primary.backend.endpoint, error=str(e))
+                    else:
+                        logger.info("Hedging slow generation", backend=primary.backend.endpoint,
+                                    hedge_backend=hedge.backend.endpoint, delay=delay)
+                        attempts[asyncio.ensure_future(hedge.next())] = hedge
+            
+            errors = {}
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for waiter in done:
+                    if waiter.exception() is not None:
+                        errors[attempts[waiter]] = waiter.exception()
+                        continue
+                    winner = attempts[waiter]
+                    if hedge is not None:
+                        HEDGE_WINS.labels(winner="hedge" if winner is hedge else "primary").inc()
+                    if self.first_token_latency is not None:
+                        self.first_token_latency.observe(time.time() - winner.start_time)
+                    return winner, waiter.result()
+            # Every attempt failed; surface the original one's error
+            raise errors[primary]
+        finally:
+            for waiter, attempt in attempts.items():
+                if not waiter.done():
+                    waiter.cancel()
+                if attempt is not winner:
+                    attempt.task.cancel()
+            if hedge is not None and winner is primary and affinity_key is not None:
+                self.slot_affinity.restore(affinity_key, previous_owner)
+    
+    @staticmethod
+    async def _messages(attempt: Attempt, first: Optional[Dict[str, Any]], start_time: float) -> AsyncIterator[Dict[str, Any]]:
+        """Yield ``first`` and the attempt's following messages up to the final one."""
+        message = first
+        last_token_time = None
+        while message is not None:
+            if message.get("content"):
+                now = time.time()
+                if last_token_time is None:
+                    LLAMA_TIME_TO_FIRST_TOKEN.observe(now - start_time)
+                else:
+                    LLAMA_INTER_TOKEN_LATENCY.observe(now - last_token_time)
+                last_token_time = now
+            yield message
+            if message.get("stop", False):
+                return
+            message = await attempt.next()
+        raise Exception("llama.cpp server closed the stream before the final message")
+    
+    def _finish(self, backend: Backend, result: Dict[str, Any], content: str, start_time: float, event: str) -> Dict[str, Any]:
+        """Record the final message's statistics and build the generation it describes."""
+        generation_time = time.time() - start_time
+        tokens_reused = self._prompt_tokens_reused(result)
+        self._record_telemetry(backend, result, generation_time, tokens_reused)
+        
+        logger.info(event, 
+                   generation_time=generation_time,
+                   backend=backend.endpoint,
+                   tokens_predicted=result.get("tokens_predicted", 0),
+                   tokens_reused=tokens_reused,
+                   prompt_per_second=result.get("timings", {}).get("prompt_per_second"),
+                   predicted_per_second=result.get("timings", {}).get("predicted_per_second"))
+        
+        generation = {
+            "content": content,
+            "tokens_predicted": result.get("tokens_predicted", 0),
+            "tokens_evaluated": result.get("tokens_evaluated", 0),
+            "tokens_cached": tokens_reused,
+            "generation_time": generation_time,
+            "tokens_per_second": result.get("tokens_predicted", 0) / generation_time if generation_time > 0 else 0,
+            "truncated": result.get("truncated", False),
+            "stop_reason": self._stop_reason(result)
+        }
+        return generation
+    
+    async def _complete(self, request: ChatCompletionRequest, prompt_text: str, cache_key: Optional[str],
+                        use_cache: bool, session_id: Optional[str]) -> Dict[str, Any]:
+        # Streamed from llama.cpp too, so a hedge can race the first token
+        payload = self._build_payload(request, prompt_text, stream=True)
+        affinity_key = self.slot_affinity.key_for(prompt_text, session_id) if self.slot_affinity is not None else None
         
         start_time = time.time()
+        tried = []
+        self.retry_budget.record_request()
         
-        for attempt in range(self.config.max_retries):
+        for number in range(self.config.max_retries):
+            attempt = None
             try:
-                logger.info("Sending generation request", 
-                           attempt=attempt + 1, 
-                           max_retries=self.config.max_retries,
-                           prompt_length=len(prompt_text))
+                attempt, first = await self._send(payload, tried, affinity_key, number, len(prompt_text))
+                content_parts = []
+                async for result in self._messages(attempt, first, start_time):
+                    content_parts.append(result.get("content", ""))
                 
-                response = await self.client.post(
-                    f"{self.config.endpoint}/completion",
-                    json=payload
-                )
-                response.raise_for_status()
+            except httpx.RequestError as e:
+                will_retry = number < self.config.max_retries - 1 and self.retry_budget.try_spend()
+                logger.warning("Request failed", 
+                              attempt=number + 1, 
+                              error=str(e),
+                              will_retry=will_retry)
                 
-                result = response.json()
-                generation_time = time.time() - start_time
+                if not will_retry:
+                    raise Exception(f"Failed to connect to llama.cpp server after {number + 1} attempts: {e}")
                 
-                logger.info("Generation completed", 
-                           generation_time=generation_time,
-                           tokens_predicted=result.get("tokens_predicted", 0))
+                await self._retry_delay(number, tried)
+                continue
                 
-                return {
-                    "content": result.get("content", ""),
-                    "tokens_predicted": result.get("tokens_predicted", 0),
-                    "tokens_evaluated": result.get("tokens_evaluated", 0),
-                    "generation_time": generation_time,
-                    "tokens_per_second": result.get("tokens_predicted", 0) / generation_time if generation_time > 0 else 0,
-                    "truncated": result.get("truncated", False),
-                    "stop_reason": "stop" if result.get("stop", False) else "length"
-                }
+            except httpx.HTTPStatusError as e:
+                raise Exception(f"HTTP {e.response.status_code} from llama.cpp server: {e.response.text}")
+            
+            finally:
+                if attempt is not None:
+                    attempt.task.cancel()
+            
+            generation = self._finish(attempt.backend, result, "".join(content_parts), start_time, "Generation completed")
+            await self._caches(self._store_caches, request, prompt_text, cache_key, use_cache, generation)
+            return generation
+        
+        raise Exception("Unexpected error: maximum retries exceeded without raising an exception")
+    
+    async def generate_stream(self, request: ChatCompletionRequest, use_cache: bool = True,
+                              session_id: Optional[str] = None, priority: str = "default",
+                              deadline: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a generation from llama.cpp, yielding one dict per token.
+        
+        Every event carries the new ``content``; the last one has ``done`` set
+        and the same statistics ``generate`` returns. Connection errors are
+        retried only until the first event has been yielded. A cache hit is
+        replayed as a single final event, and an identical cacheable stream
+        already in flight is joined rather than started again. The admission permit is
+        held until the stream finishes.
+        """
+        request = await self._fit_prompt(request)
+        prompt_text = request.get_prompt_text()
+        
+        cache_key = self._cache_key(request, prompt_text, use_cache)
+        cached = await self._caches(self._lookup_caches, request, prompt_text, cache_key, use_cache)
+        if cached is not None:
+            yield dict(cached, done=True, cached=True)
+            return
+        
+        async def complete_stream():
+            async with self._admitted(priority, deadline):
+                async for event in self._complete_stream(request, prompt_text, cache_key, use_cache, session_id):
+                    yield event
+        
+        flight_key = self._flight_key(request, prompt_text, use_cache, priority)
+        events = complete_stream() if flight_key is None else \
+            self.single_flight.stream(flight_key, complete_stream, run_alone=(AdmissionRejected,))
+        async for event in events:
+            yield event
+    
+    async def _complete_stream(self, request: ChatCompletionRequest, prompt_text: str, cache_key: Optional[str],
+                               use_cache: bool, session_id: Optional[str]) -> AsyncIterator[Dict[str, Any]]:
+        payload = self._build_payload(request, prompt_text, stream=True)
+        affinity_key = self.slot_affinity.key_for(prompt_text, session_id) if self.slot_affinity is not None else None
+        
+        start_time = time.time()
+        tried = []
+        self.retry_budget.record_request()
+        
+        for number in range(self.config.max_retries):
+            attempt = None
+            started = False
+            try:
+                attempt, first = await self._send(payload, tried, affinity_key, number, len(prompt_text))
+                content_parts = []
+                
+                async for result in self._messages(attempt, first, start_time):
+                    content = result.get("content", "")
+                    content_parts.append(content)
+                    
+                    if not result.get("stop", False):
+                        started = True
+                        yield {"content": content, "done": False}
+                        continue
+                    
+                    generation = self._finish(attempt.backend, result, "".join(content_parts), start_time,
+                                              "Streaming generation completed")
+                    await self._caches(self._store_caches, request, prompt_text, cache_key, use_cache, generation)
+                    yield dict(generation, content=content, done=True)
+                    return
                 
             except httpx.RequestError as e:
-                logger.warning("Request failed", 
-                              attempt=attempt + 1, 
+                will_retry = not started and number < self.config.max_retries - 1 and self.retry_budget.try_spend()
+                logger.warning("Streaming request failed",
+                              attempt=number + 1,
                               error=str(e),
-                              will_retry=attempt < self.config.max_retries - 1)
+                              will_retry=will_retry)
+                
+                if started:
+                    raise Exception(f"Lost connection to llama.cpp server mid-stream: {e}")
                 
-                if attempt == self.config.max_retries - 1:
-                    raise Exception(f"Failed to connect to llama.cpp server after {self.config.max_retries} attempts: {e}")
+                if not will_retry:
+                    raise Exception(f"Failed to connect to llama.cpp server after {number + 1} attempts: {e}")
                 
-                await asyncio.sleep(2 ** attempt)  # Exponential backoff
+                await self._retry_delay(number, tried)
                 
             except httpx.HTTPStatusError as e:
-                logger.error("HTTP error from llama.cpp server", 
-                            status_code=e.response.status_code, 
-                            response_text=e.response.text)
                 raise Exception(f"HTTP {e.response.status_code} from llama.cpp server: {e.response.text}")
+            
+            finally:
+                if attempt is not None:
+                    attempt.task.cancel()
         
-        raise Exception("Unexpected error: maximum retries exceeded without raising an exception")
\ No newline at end of file
+        raise Exception("Unexpected error: maximum retries exceeded without raising an exception")
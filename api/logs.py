@@ -0,0 +1,177 @@
+"""Structured logging that keeps rendering and writing off the event loop.
+
+The structlog chain run by the caller only filters and collects the event:
+level filtering, per-request sampling of INFO and DEBUG events and
+per-level rate limits. The resulting record is put on a bounded queue and a
+``QueueListener`` thread renders it to JSON and writes it, so a slow stdout
+(a full docker log pipe, a stalled terminal) delays that thread instead of
+every request. When the queue is full new records are dropped and counted
+rather than blocking the caller.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Optional, TextIO
+
+import structlog
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .config import LoggingConfig
+from .metrics import LOG_EVENTS_DROPPED
+
+# None outside a request, so start-up, shutdown and background events are always kept
+_request_sampled: ContextVar[Optional[bool]] = ContextVar("request_sampled", default=None)
+
+SAMPLED_LEVELS = ("debug", "info")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def sample_request(logger, method_name: str, event_dict: Dict) -> Dict:
+    if method_name in SAMPLED_LEVELS and _request_sampled.get() is False:
+        LOG_EVENTS_DROPPED.labels(level=method_name, reason="sampled").inc()
+        raise structlog.DropEvent
+    return event_dict
+
+class LevelRateLimiter:
+    """Token bucket per level allowing ``rate`` events per second.
+
+    Bursts of up to one second's worth pass unchanged; beyond that events
+    are dropped, and the next event let through carries the number dropped
+    since the previous one as ``suppressed``.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        self.rates = rates
+        self._tokens = dict(rates)
+        self._updated = {level: time.monotonic() for level in rates}
+        self._suppressed = {level: 0 for level in rates}
+
+    def __call__(self, logger, method_name: str, event_dict: Dict) -> Dict:
+        rate = self.rates.get(method_name)
+        if rate is None:
+            return event_dict
+
+        now = time.monotonic()
+        tokens = min(rate, self._tokens[method_name] + (now - self._updated[method_name]) * rate)
+        self._updated[method_name] = now
+        if tokens < 1:
+            self._tokens[method_name] = tokens
+            self._suppressed[method_name] += 1
+            LOG_EVENTS_DROPPED.labels(level=method_name, reason="rate_limited").inc()
+            raise structlog.DropEvent
+
+        self._tokens[method_name] = tokens - 1
+        if self._suppressed[method_name]:
+            event_dict["suppressed"] = self._suppressed[method_name]
+            self._suppressed[method_name] = 0
+        return event_dict
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread as they are, never blocking."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting happens in the listener thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_EVENTS_DROPPED.labels(level=record.levelname.lower(), reason="queue_full").inc()
+
+def add_record_timestamp(logger, method_name: str, event_dict: Dict) -> Dict:
+    # Stamped from the record, so the time is when the event happened, not when it was written
+    record = event_dict.get("_record")
+    created = record.created if record is not None else time.time()
+    event_dict["timestamp"] = datetime.fromtimestamp(created, tz=timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+    return event_dict
+
+def build_formatter() -> structlog.stdlib.ProcessorFormatter:
+    return structlog.stdlib.ProcessorFormatter(
+        processors=[
+            structlog.stdlib.add_logger_name,
+            structlog.stdlib.add_log_level,
+            add_record_timestamp,
+            structlog.processors.format_exc_info,
+            structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+            structlog.processors.UnicodeDecoder(),
+            structlog.processors.JSONRenderer()
+        ]
+    )
+
+def configure_logging(config: LoggingConfig, stream: Optional[TextIO] = None):
+    """Configure structlog and the root logger; safe to call again to reconfigure."""
+    global _listener
+    stop_logging()
+
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(build_formatter())
+    if config.queue_enabled:
+        handler = DroppingQueueHandler(queue.Queue(maxsize=config.queue_size))
+        _listener = logging.handlers.QueueListener(handler.queue, writer)
+        _listener.start()
+    else:
+        handler = writer
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(config.level)
+    # httpx logs every backend request at INFO
+    for name in ("httpx", "httpcore"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    processors = [structlog.stdlib.filter_by_level, sample_request]
+    if config.rate_limits:
+        processors.append(LevelRateLimiter(config.rate_limits))
+    processors += [
+        structlog.stdlib.PositionalArgumentsFormatter(),
+        structlog.processors.StackInfoRenderer(),
+        # Rendered by the caller, while the exception is still current
+        structlog.processors.format_exc_info,
+        structlog.stdlib.ProcessorFormatter.wrap_for_formatter
+    ]
+    structlog.configure(
+        processors=processors,
+        context_class=dict,
+        logger_factory=structlog.stdlib.LoggerFactory(),
+        wrapper_class=structlog.stdlib.BoundLogger,
+        cache_logger_on_first_use=True,
+    )
+
+def stop_logging():
+    """Write out everything still queued and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
+
+class LogSamplingMiddleware:
+    """Pure ASGI middleware deciding once per request whether its INFO and
+    DEBUG events are logged, so a sampled request keeps all of its lines.
+    """
+
+    def __init__(self, app: ASGIApp, sample_rate: float):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = _request_sampled.set(random.random() < self.sample_rate)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_sampled.reset(token)
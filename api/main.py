@@ -1,11 +1,16 @@
-from fastapi import FastAPI, HTTPException, Depends, Security, Request
+from fastapi import FastAPI, HTTPException, Depends, Security, Request, UploadFile, File
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response, JSONResponse
+from fastapi.responses import Response, JSONResponse, StreamingResponse, ORJSONResponse
+from starlette.background import BackgroundTask
 from contextlib import asynccontextmanager
+import orjson
+import os
+import tempfile
 import time
 import uuid
 from datetime import datetime
+from typing import Dict, List, Optional, Union
 import structlog
 
 from .config import settings
@@ -17,51 +22,162 @@ from .models import (
     Role,
     Usage,
     HealthResponse,
-    ErrorResponse
+    ErrorResponse,
+    MODEL_NAME,
+    ConversationCreateRequest,
+    ConversationTurnRequest,
+    parse_chat_request_json,
+    build_chat_completion,
+    build_usage
 )
 from .llama_client import LlamaClient
-from .metrics import MetricsMiddleware, get_metrics
-
-structlog.configure(
-    processors=[
-        structlog.stdlib.filter_by_level,
-        structlog.stdlib.add_logger_name,
-        structlog.stdlib.add_log_level,
-        structlog.stdlib.PositionalArgumentsFormatter(),
-        structlog.processors.TimeStamper(fmt="iso"),
-        structlog.processors.StackInfoRenderer(),
-        structlog.processors.format_exc_info,
-        structlog.processors.UnicodeDecoder(),
-        structlog.processors.JSONRenderer()
-    ],
-    context_class=dict,
-    logger_factory=structlog.stdlib.LoggerFactory(),
-    wrapper_class=structlog.stdlib.BoundLogger,
-    cache_logger_on_first_use=True,
-)
+from .cache import ResponseCache, TemplateCache
+from .slot_affinity import SlotAffinity
+from .admission import AdmissionController, AdmissionRejected
+from .backend_pool import BackendUnavailable
+from .single_flight import SingleFlight
+from .prompt_budget import PromptBudget
+from .batches import BatchManager
+from .sessions import Conversation, ConversationBusy, SessionStore
+from .warmup import Warmup, load_warmup_prompts
+from .quotas import ANONYMOUS_KEY, QuotaExceeded, QuotaManager
+from .shared_state import SharedState, SharedResponseCache, SharedEntries, SharedPermits, SharedSessionStore
+from .metrics import MetricsMiddleware, get_metrics, mark_worker_exited
+from .logs import LogSamplingMiddleware, configure_logging, stop_logging
+
+configure_logging(settings.logging_config)
 
 logger = structlog.get_logger()
 
 llama_client: LlamaClient = None
+batch_manager: BatchManager = None
+session_store: SessionStore = None
+warmup: Optional[Warmup] = None
+quota_manager: Optional[QuotaManager] = None
+shared_state: Optional[SharedState] = None
+api_key_priorities: Dict[str, str] = {}
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global llama_client
-    logger.info("Starting API server", llama_endpoint=settings.llama_endpoint)
+    global llama_client, batch_manager, session_store, warmup, quota_manager, shared_state, api_key_priorities
+    logger.info("Starting API server", llama_endpoints=settings.llama_endpoint_list, pid=os.getpid())
     
-    llama_client = LlamaClient(settings.llama_config)
+    # With several workers, caches and conversations live in a database on
+    # tmpfs that every worker opens, and admission permits are lock files beside it
+    worker_config = settings.worker_config
+    shared_state = SharedState(worker_config.shared_state_dir) if worker_config.shared else None
+    
+    cache_config = settings.cache_config
+    response_cache = None
+    if cache_config.enabled:
+        cache_options = dict(
+            max_entries=cache_config.max_entries,
+            max_bytes=cache_config.max_bytes,
+            ttl=cache_config.ttl,
+            max_temperature=cache_config.max_temperature
+        )
+        response_cache = SharedResponseCache(shared_state.conn, **cache_options) if shared_state else ResponseCache(**cache_options)
     
-    health = await llama_client.health_check()
-    if health["status"] != "healthy":
-        logger.error("Failed to connect to llama.cpp server", health=health)
-        raise Exception(f"Cannot connect to llama.cpp server: {health.get('error')}")
+    template_cache_config = settings.template_cache_config
+    template_cache = None
+    if template_cache_config.enabled:
+        template_cache = TemplateCache(
+            max_entries=template_cache_config.max_entries,
+            min_confirmations=template_cache_config.min_confirmations,
+            max_temperature=template_cache_config.max_temperature,
+            entries=SharedEntries(shared_state.conn, "template_cache") if shared_state else None
+        )
+    
+    slot_affinity_config = settings.slot_affinity_config
+    slot_affinity = None
+    if slot_affinity_config.enabled:
+        slot_affinity = SlotAffinity(
+            slots_per_backend=slot_affinity_config.slots_per_backend,
+            prefix_chars=slot_affinity_config.prefix_chars
+        )
+    
+    admission_config = settings.admission_config
+    api_key_priorities = admission_config.api_key_priorities
+    admission = None
+    if admission_config.enabled:
+        admission = AdmissionController(
+            max_concurrency=admission_config.max_concurrency,
+            max_queue=admission_config.max_queue,
+            permits=SharedPermits(worker_config.shared_state_dir, admission_config.max_concurrency) if shared_state else None,
+            poll_interval=worker_config.admission_poll_interval
+        )
+    
+    prompt_budget_config = settings.prompt_budget_config
+    prompt_budget = None
+    if prompt_budget_config.enabled:
+        prompt_budget = PromptBudget(
+            context_size=prompt_budget_config.context_size,
+            margin=prompt_budget_config.margin,
+            max_entries=prompt_budget_config.max_entries
+        )
+    
+    llama_client = LlamaClient(
+        settings.llama_config,
+        response_cache=response_cache,
+        template_cache=template_cache,
+        slot_affinity=slot_affinity,
+        admission=admission,
+        single_flight=SingleFlight() if settings.single_flight_enabled else None,
+        prompt_budget=prompt_budget,
+        shared_state=shared_state
+    )
+    
+    # Serve liveness straight away; readiness waits for a healthy, warmed-up backend
+    warmup_config = settings.warmup_config
+    if warmup_config.enabled:
+        warmup = Warmup(
+            llama_client,
+            load_warmup_prompts(warmup_config.prompts_file),
+            slots_per_backend=warmup_config.slots_per_backend,
+            timeout=warmup_config.timeout,
+            max_backoff=warmup_config.max_backoff
+        )
+        warmup.start()
+    else:
+        await llama_client.health.probe_all()
+        health = llama_client.health_check()
+        if health["status"] != "healthy":
+            logger.warning("llama.cpp server is not healthy yet", health=health)
+    llama_client.health.start()
+    
+    session_config = settings.session_config
+    session_options = dict(
+        max_sessions=session_config.max_sessions,
+        max_bytes=session_config.max_bytes,
+        idle_ttl=session_config.idle_ttl
+    )
+    if shared_state:
+        session_store = SharedSessionStore(shared_state.conn, lease_ttl=session_config.lease_ttl, **session_options)
+    else:
+        session_store = SessionStore(**session_options)
+    
+    quota_config = settings.quota_config
+    if quota_config.enabled:
+        # Buckets are per worker, so each enforces its share of the limits
+        quota_manager = QuotaManager(quota_config.default, quota_config.per_key, share=1 / worker_config.workers)
+    
+    batch_manager = BatchManager(llama_client, settings.batch_dir, settings.batch_concurrency, quotas=quota_manager)
+    batch_manager.resume_all()
     
-    logger.info("Successfully connected to llama.cpp server", health=health)
     yield
     
+    if warmup:
+        await warmup.stop()
+    if batch_manager:
+        await batch_manager.shutdown()
     if llama_client:
+        await llama_client.health.stop()
         await llama_client.client.aclose()
+    if shared_state:
+        shared_state.close()
+    mark_worker_exited()
     logger.info("API server shutdown complete")
+    stop_logging()
 
 app = FastAPI(
     title="Stable Cypher Instruct API",
@@ -81,18 +197,40 @@ app.add_middleware(
 if settings.monitoring_config.enable_metrics:
     app.add_middleware(MetricsMiddleware)
 
+if settings.logging_config.sample_rate < 1:
+    app.add_middleware(LogSamplingMiddleware, sample_rate=settings.logging_config.sample_rate)
+
 security = HTTPBearer(auto_error=False)
+api_keys = settings.api_config.api_keys
+
+async def verify_api_key(credentials: HTTPAuthorizationCredentials = Security(security)) -> str:
+    """Return the name of the caller's API key."""
+    if not api_keys:
+        return ANONYMOUS_KEY
+    if not credentials or credentials.credentials not in api_keys:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    return api_keys[credentials.credentials]
+
+async def enforce_quota(key_name: str = Depends(verify_api_key)) -> str:
+    if quota_manager is not None:
+        try:
+            quota_manager.check(key_name)
+        except QuotaExceeded as e:
+            raise _shed_error(e)
+    return key_name
 
-def verify_api_key(credentials: HTTPAuthorizationCredentials = Security(security)):
-    if settings.api_config.api_key:
-        if not credentials or credentials.credentials != settings.api_config.api_key:
-            raise HTTPException(status_code=401, detail="Invalid API key")
-    return True
+def _charge_usage(key_name: str, result: dict):
+    if quota_manager is not None:
+        quota_manager.charge_result(key_name, result)
+
+def _refund_request(key_name: str):
+    if quota_manager is not None:
+        quota_manager.refund(key_name)
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     try:
-        llama_health = await llama_client.health_check()
+        llama_health = llama_client.health_check()
         
         return HealthResponse(
             status="healthy" if llama_health["status"] == "healthy" else "degraded",
@@ -103,95 +241,370 @@ async def health_check():
         logger.error("Health check failed", error=str(e))
         raise HTTPException(status_code=503, detail=f"Health check failed: {e}")
 
-@app.post("/v1/chat/completions", response_model=ChatCompletionResponse)
+@app.get("/health/live")
+async def liveness():
+    # The process is serving requests; backend state is for readiness
+    return {"status": "alive", "timestamp": datetime.utcnow().isoformat()}
+
+@app.get("/health/ready")
+async def readiness():
+    health = llama_client.health_check() if llama_client is not None else {"status": "unhealthy"}
+    warmed_up = warmup is None or warmup.done
+    ready = llama_client is not None and llama_client.health.ready and warmed_up
+    content = {
+        "status": "ready" if ready else "not_ready",
+        "timestamp": datetime.utcnow().isoformat(),
+        "llama_server": health
+    }
+    if warmup is not None:
+        content["warmup"] = warmup.status()
+    return JSONResponse(status_code=200 if ready else 503, content=content)
+
+def _sse_event(data: dict) -> bytes:
+    return b"data: " + orjson.dumps(data) + b"\n\n"
+
+def _request_priority(request: Request, key_name: str) -> str:
+    # A priority assigned to the caller's API key cannot be overridden by the header
+    if key_name in api_key_priorities:
+        return api_key_priorities[key_name]
+    return request.headers.get("x-priority", "default").lower()
+
+def _request_deadline(request: Request) -> float:
+    timeout = float(settings.request_timeout)
+    header = request.headers.get("x-request-timeout")
+    if header:
+        try:
+            timeout = float(header)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Request-Timeout must be a number of seconds")
+    return time.monotonic() + timeout
+
+def _shed_error(e: Union[AdmissionRejected, BackendUnavailable, QuotaExceeded]) -> HTTPException:
+    return HTTPException(
+        status_code=e.status_code,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+def _cache_bypass_requested(request: Request) -> bool:
+    cache_control = request.headers.get("cache-control", "").lower()
+    return "no-cache" in cache_control or "no-store" in cache_control
+
+async def _stream_chat_completion(events, first_event: dict, key_name: str):
+    completion_id = str(uuid.uuid4())
+    created_timestamp = int(time.time())
+    start_time = time.time()
+    
+    def chunk(delta: dict, finish_reason=None, usage=None) -> bytes:
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created_timestamp,
+            "model": MODEL_NAME,
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": delta,
+                    "finish_reason": finish_reason
+                }
+            ]
+        }
+        if usage is not None:
+            data["usage"] = usage
+        return _sse_event(data)
+    
+    async def all_events():
+        yield first_event
+        async for event in events:
+            yield event
+    
+    yield chunk({"role": "assistant", "content": ""})
+    
+    streamed = 0
+    charged = False
+    try:
+        async for event in all_events():
+            if event["content"]:
+                streamed += 1
+                yield chunk({"content": event["content"]})
+            
+            if event["done"]:
+                _charge_usage(key_name, event)
+                charged = True
+                # The final chunk carries the token counts, as in OpenAI's include_usage mode
+                yield chunk({}, finish_reason=event["stop_reason"], usage=build_usage(event))
+                
+                logger.info("Streaming chat completion successful",
+                           completion_id=completion_id,
+                           total_time=time.time() - start_time,
+                           tokens_per_second=event.get("tokens_per_second", 0))
+    except Exception as e:
+        logger.error("Streaming chat completion failed", completion_id=completion_id, error=str(e))
+        yield _sse_event({"error": {"message": str(e), "type": "server_error"}})
+    finally:
+        if not charged:
+            # Cut short by an error or a disconnect: charge the tokens that were streamed, one per event
+            _charge_usage(key_name, {"tokens_predicted": streamed, "coalesced": first_event.get("coalesced", False)})
+    
+    yield b"data: [DONE]\n\n"
+
+@app.post("/v1/chat/completions", response_model=ChatCompletionResponse, response_model_exclude_none=True)
 async def chat_completions(
     request: Request,
-    _: bool = Depends(verify_api_key)
+    key_name: str = Depends(enforce_quota)
 ):
     try:
-        # Parse request body manually
-        body = await request.json()
-        
-        # Manual validation
-        messages = body.get('messages')
-        prompt = body.get('prompt')
-        
-        if not messages and not prompt:
-            raise HTTPException(status_code=422, detail="Either messages or prompt must be provided")
-        if messages and prompt:
-            raise HTTPException(status_code=422, detail="Cannot provide both messages and prompt")
-        
-        # Create ChatCompletionRequest manually
-        req_data = {
-            'messages': messages,
-            'prompt': prompt,
-            'max_tokens': body.get('max_tokens', 512),
-            'temperature': body.get('temperature', 0.7),
-            'top_p': body.get('top_p', 0.9),
-            'top_k': body.get('top_k', 40),
-            'repeat_penalty': body.get('repeat_penalty', 1.1),
-            'stop': body.get('stop'),
-            'stream': body.get('stream', False)
-        }
-        
-        chat_request = ChatCompletionRequest(**req_data)
+        try:
+            chat_request = parse_chat_request_json(await request.body())
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
         
         logger.info("Processing chat completion request", 
                    has_messages=bool(chat_request.messages),
                    has_prompt=bool(chat_request.prompt),
-                   max_tokens=chat_request.max_tokens)
+                   max_tokens=chat_request.max_tokens,
+                   stream=chat_request.stream)
         
-        start_time = time.time()
-        result = await llama_client.generate(chat_request)
+        use_cache = not _cache_bypass_requested(request)
+        session_id = request.headers.get("x-session-id")
+        priority = _request_priority(request, key_name)
+        deadline = _request_deadline(request)
         
-        completion_id = str(uuid.uuid4())
-        created_timestamp = int(time.time())
+        if chat_request.stream:
+            events = llama_client.generate_stream(
+                chat_request,
+                use_cache=use_cache,
+                session_id=session_id,
+                priority=priority,
+                deadline=deadline
+            )
+            # Wait for the first event so admission failures still get a proper status code
+            first_event = await events.__anext__()
+            return StreamingResponse(
+                _stream_chat_completion(events, first_event, key_name),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
         
-        # Manually construct the response data to avoid validation issues
-        response_data = {
-            "id": completion_id,
-            "object": "chat.completion",
-            "created": created_timestamp,
-            "model": "stable-cypher-instruct-3b",
-            "choices": [
-                {
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": result["content"]
-                    },
-                    "finish_reason": "stop"
-                }
-            ],
-            "usage": {
-                "prompt_tokens": result.get("tokens_evaluated", 0),
-                "completion_tokens": result.get("tokens_predicted", 0),
-                "total_tokens": result.get("tokens_evaluated", 0) + result.get("tokens_predicted", 0)
-            }
-        }
+        start_time = time.time()
+        result = await llama_client.generate(
+            chat_request,
+            use_cache=use_cache,
+            session_id=session_id,
+            priority=priority,
+            deadline=deadline
+        )
+        _charge_usage(key_name, result)
+        response_data = build_chat_completion(result)
+        completion_id = response_data["id"]
         
         total_time = time.time() - start_time
         logger.info("Chat completion successful",
                    completion_id=completion_id,
                    total_time=total_time,
+                   cached=result.get("cached", False),
+                   coalesced=result.get("coalesced", False),
                    tokens_per_second=result.get("tokens_per_second", 0))
         
-        return response_data
+        # Returning a Response skips FastAPI's response_model re-validation;
+        # build_chat_completion already produces the documented shape
+        return ORJSONResponse(
+            content=response_data,
+            headers={"X-Cache": "HIT" if result.get("cached") else "MISS"}
+        )
         
+    except HTTPException:
+        raise
+    except (AdmissionRejected, BackendUnavailable) as e:
+        # Never reached the backend, so it does not count against the key's request rate
+        _refund_request(key_name)
+        raise _shed_error(e)
     except Exception as e:
         logger.error("Chat completion failed", error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _sessions(fn, *args):
+    """Run a session store or lock call, on the shared-state thread when conversations are shared."""
+    if shared_state is None:
+        return fn(*args)
+    return await shared_state.run(fn, *args)
+
+async def _get_conversation(conversation_id: str) -> Conversation:
+    conversation = await _sessions(session_store.get, conversation_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail=f"Conversation {conversation_id} not found")
+    return conversation
+
+async def _commit_turn(conversation: Conversation, kept: Optional[List[ChatMessage]], user_message: ChatMessage, reply: str):
+    """Record a completed turn, first dropping the history trimmed from its prompt."""
+    if kept is not None:
+        conversation.replace(kept)
+    conversation.extend([user_message, ChatMessage(role=Role.ASSISTANT, content=reply)])
+    await _sessions(session_store.commit, conversation)
+
+async def _record_streamed_turn(conversation: Conversation, kept: Optional[List[ChatMessage]],
+                                user_message: ChatMessage, events, first_event: dict):
+    """Pass stream events through, appending the turn once the reply is complete."""
+    parts = [first_event["content"]]
+    if first_event["done"]:
+        await _commit_turn(conversation, kept, user_message, "".join(parts))
+    async for event in events:
+        parts.append(event["content"])
+        if event["done"]:
+            await _commit_turn(conversation, kept, user_message, "".join(parts))
+        yield event
+
+@app.post("/v1/conversations")
+async def create_conversation(request: Request, _: str = Depends(verify_api_key)):
+    try:
+        create_request = ConversationCreateRequest.model_validate_json(await request.body() or b"{}")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    messages = list(create_request.messages)
+    if create_request.system:
+        messages.insert(0, ChatMessage(role=Role.SYSTEM, content=create_request.system))
+    conversation = await _sessions(session_store.create, messages)
+    return conversation.to_dict()
+
+@app.get("/v1/conversations/{conversation_id}")
+async def get_conversation(conversation_id: str, _: str = Depends(verify_api_key)):
+    return (await _get_conversation(conversation_id)).to_dict()
+
+@app.delete("/v1/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: str, _: str = Depends(verify_api_key)):
+    try:
+        deleted = await _sessions(session_store.delete, conversation_id)
+    except ConversationBusy:
+        raise HTTPException(status_code=409, detail=f"Conversation {conversation_id} has a turn in progress")
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"Conversation {conversation_id} not found")
+    return {"id": conversation_id, "object": "conversation.deleted", "deleted": True}
+
+@app.post("/v1/conversations/{conversation_id}/messages", response_model=ChatCompletionResponse, response_model_exclude_none=True)
+async def conversation_turn(
+    conversation_id: str,
+    request: Request,
+    key_name: str = Depends(enforce_quota)
+):
+    try:
+        turn = ConversationTurnRequest.model_validate_json(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    conversation = await _get_conversation(conversation_id)
+    if not await _sessions(conversation.lock.try_acquire):
+        raise HTTPException(status_code=409, detail=f"Conversation {conversation_id} already has a turn in progress")
+    streaming = False
+    
+    try:
+        user_message = ChatMessage(role=Role.USER, content=turn.content)
+        history = await llama_client.fit_messages(conversation.messages + [user_message], turn.max_tokens)
+        # Slide the window once the turn succeeds, so later turns share the new prefix
+        kept = history[:-1] if len(history) <= len(conversation.messages) else None
+        
+        chat_request = ChatCompletionRequest(
+            prompt=conversation.prompt_with(user_message, kept),
+            **turn.model_dump(exclude={"content"})
+        )
+        options = {
+            "use_cache": not _cache_bypass_requested(request),
+            "session_id": conversation.id,
+            "priority": _request_priority(request, key_name),
+            "deadline": _request_deadline(request)
+        }
+        
+        if turn.stream:
+            events = llama_client.generate_stream(chat_request, **options)
+            first_event = await events.__anext__()
+            response = StreamingResponse(
+                _stream_chat_completion(
+                    _record_streamed_turn(conversation, kept, user_message, events, first_event),
+                    first_event,
+                    key_name
+                ),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                # Runs once the stream has finished or the client has gone away
+                background=BackgroundTask(_sessions, conversation.lock.release)
+            )
+            streaming = True
+            return response
+        
+        result = await llama_client.generate(chat_request, **options)
+        _charge_usage(key_name, result)
+        await _commit_turn(conversation, kept, user_message, result["content"])
+        
+        return ORJSONResponse(
+            content=build_chat_completion(result),
+            headers={"X-Cache": "HIT" if result.get("cached") else "MISS"}
+        )
+        
+    except HTTPException:
+        raise
+    except (AdmissionRejected, BackendUnavailable) as e:
+        # Never reached the backend, so it does not count against the key's request rate
+        _refund_request(key_name)
+        raise _shed_error(e)
+    except Exception as e:
+        logger.error("Conversation turn failed", conversation_id=conversation_id, error=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if not streaming:
+            await _sessions(conversation.lock.release)
+
+def _get_batch(batch_id: str):
+    job = batch_manager.get(batch_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Batch {batch_id} not found")
+    return job
+
+@app.post("/v1/batches")
+async def create_batch(
+    file: UploadFile = File(..., description="JSONL file with one chat completion request per line"),
+    key_name: str = Depends(enforce_quota)
+):
+    fd, upload_path = tempfile.mkstemp(dir=settings.batch_dir, suffix=".upload")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := await file.read(1024 * 1024):
+                f.write(chunk)
+        job = batch_manager.create(upload_path, key_name)
+    finally:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+    
+    return job.status()
+
+@app.get("/v1/batches")
+async def list_batches(_: str = Depends(verify_api_key)):
+    return {"object": "list", "data": [job.status() for job in batch_manager.list_jobs()]}
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str, _: str = Depends(verify_api_key)):
+    return _get_batch(batch_id).status()
+
+@app.get("/v1/batches/{batch_id}/results")
+async def get_batch_results(batch_id: str, follow: bool = True, _: str = Depends(verify_api_key)):
+    job = _get_batch(batch_id)
+    return StreamingResponse(
+        batch_manager.results(job, follow=follow),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"}
+    )
+
+@app.post("/v1/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str, _: str = Depends(verify_api_key)):
+    job = _get_batch(batch_id)
+    await batch_manager.cancel(job)
+    return job.status()
+
 @app.get("/metrics")
 async def metrics():
     if not settings.monitoring_config.enable_metrics:
         raise HTTPException(status_code=404, detail="Metrics disabled")
     
-    from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
-    return Response(
-        content=generate_latest(),
-        media_type=CONTENT_TYPE_LATEST
-    )
+    return get_metrics()
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
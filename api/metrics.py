@@ -1,7 +1,10 @@
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from prometheus_client import Counter, Histogram, Gauge, CollectorRegistry, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+from fastapi import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import os
 import time
+from typing import Any, Dict
 
 REQUEST_COUNT = Counter(
     'api_requests_total',
@@ -11,78 +14,429 @@ REQUEST_COUNT = Counter(
 
 REQUEST_DURATION = Histogram(
     'api_request_duration_seconds',
-    'API request duration in seconds',
+    'API request duration in seconds, until the last response byte is sent',
+    ['method', 'endpoint']
+)
+
+REQUEST_TIME_TO_FIRST_BYTE = Histogram(
+    'api_request_time_to_first_byte_seconds',
+    'Time from receiving an API request until the response headers are sent',
     ['method', 'endpoint']
 )
 
 ACTIVE_REQUESTS = Gauge(
     'api_active_requests',
-    'Number of active API requests'
+    'Number of active API requests',
+    multiprocess_mode='livesum'
 )
 
 LLAMA_GENERATION_DURATION = Histogram(
     'llama_generation_duration_seconds',
     'Time spent generating responses from llama.cpp',
+    ['backend'],
     buckets=[0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0]
 )
 
 LLAMA_TOKENS_GENERATED = Counter(
     'llama_tokens_generated_total',
-    'Total number of tokens generated by llama.cpp'
+    'Total number of tokens generated by llama.cpp',
+    ['backend']
 )
 
 LLAMA_TOKENS_PER_SECOND = Histogram(
     'llama_tokens_per_second',
-    'Tokens generated per second by llama.cpp',
+    'Decode rate reported by llama.cpp in generated tokens per second',
+    ['backend'],
     buckets=[1, 5, 10, 20, 50, 100, 200]
 )
 
+LLAMA_PROMPT_EVAL_TOKENS_PER_SECOND = Histogram(
+    'llama_prompt_eval_tokens_per_second',
+    'Prompt evaluation rate reported by llama.cpp in prompt tokens per second',
+    ['backend'],
+    buckets=[10, 50, 100, 250, 500, 1000, 2500, 5000]
+)
+
+LLAMA_PROMPT_EVAL_DURATION = Histogram(
+    'llama_prompt_eval_duration_seconds',
+    'Time llama.cpp spent evaluating the uncached part of the prompt',
+    ['backend'],
+    buckets=[0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0]
+)
+
+LLAMA_DECODE_DURATION = Histogram(
+    'llama_decode_duration_seconds',
+    'Time llama.cpp spent generating tokens',
+    ['backend'],
+    buckets=[0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0]
+)
+
 LLAMA_CONTEXT_SIZE = Histogram(
     'llama_context_size_tokens',
-    'Size of context sent to llama.cpp in tokens',
+    'Tokens occupying the llama.cpp context per generation (prompt plus generated)',
+    ['backend'],
     buckets=[100, 500, 1000, 2000, 4000, 8000]
 )
 
-class MetricsMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        if request.url.path == "/metrics":
-            return await call_next(request)
-        
-        start_time = time.time()
+LLAMA_STOP_REASONS = Counter(
+    'llama_stop_reasons_total',
+    'Generations by why llama.cpp stopped (stop, stop_word, length, truncated)',
+    ['backend', 'reason']
+)
+
+LLAMA_TIME_TO_FIRST_TOKEN = Histogram(
+    'llama_time_to_first_token_seconds',
+    'Time from sending a request to llama.cpp until the first token arrives',
+    buckets=[0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0]
+)
+
+LLAMA_INTER_TOKEN_LATENCY = Histogram(
+    'llama_inter_token_latency_seconds',
+    'Time between consecutive streamed tokens from llama.cpp',
+    buckets=[0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0]
+)
+
+RESPONSE_CACHE_HITS = Counter(
+    'response_cache_hits_total',
+    'Number of completions served from the response cache'
+)
+
+RESPONSE_CACHE_MISSES = Counter(
+    'response_cache_misses_total',
+    'Number of cacheable completions not found in the response cache'
+)
+
+RESPONSE_CACHE_EVICTIONS = Counter(
+    'response_cache_evictions_total',
+    'Number of entries removed from the response cache',
+    ['reason']
+)
+
+RESPONSE_CACHE_BYTES = Gauge(
+    'response_cache_bytes',
+    'Approximate memory held by the response cache in bytes',
+    multiprocess_mode='livemostrecent'
+)
+
+TEMPLATE_CACHE_LOOKUPS = Counter(
+    'template_cache_lookups_total',
+    'Parameterized template cache lookups by result (hit, miss, unconfirmed)',
+    ['result']
+)
+
+TEMPLATE_CACHE_OBSERVATIONS = Counter(
+    'template_cache_observations_total',
+    'Generations checked against the template cache by outcome (learned, confirmed, conflict, rejected)',
+    ['outcome']
+)
+
+TOKEN_COUNT_CACHE_LOOKUPS = Counter(
+    'token_count_cache_lookups_total',
+    'Per-message token count lookups by result (hit, miss)',
+    ['result']
+)
+
+PROMPT_TRIMMED_REQUESTS = Counter(
+    'prompt_trimmed_requests_total',
+    'Requests whose conversation history was trimmed to fit the context window'
+)
+
+PROMPT_TRIMMED_MESSAGES = Counter(
+    'prompt_trimmed_messages_total',
+    'Conversation messages dropped to fit the context window'
+)
+
+BACKEND_OUTSTANDING_REQUESTS = Gauge(
+    'llama_backend_outstanding_requests',
+    'Generations currently in flight per llama.cpp backend',
+    ['backend'],
+    multiprocess_mode='livesum'
+)
+
+BACKEND_HEALTHY = Gauge(
+    'llama_backend_healthy',
+    'Whether a llama.cpp backend is currently routable (1) or ejected (0)',
+    ['backend'],
+    multiprocess_mode='livemin'
+)
+
+BACKEND_EJECTIONS = Counter(
+    'llama_backend_ejections_total',
+    'Number of times a llama.cpp backend was ejected after consecutive failures',
+    ['backend']
+)
+
+BACKEND_CONNECTIONS = Counter(
+    'llama_backend_requests_by_connection_total',
+    'Requests to a llama.cpp backend by whether they opened a new connection or reused a pooled one',
+    ['backend', 'connection']
+)
+
+BACKEND_CIRCUIT_OPEN = Gauge(
+    'llama_backend_circuit_open',
+    'Whether the health prober has opened the circuit to a llama.cpp backend (1) or not (0)',
+    ['backend'],
+    multiprocess_mode='livemax'
+)
+
+CIRCUIT_REJECTED_REQUESTS = Counter(
+    'llama_circuit_rejected_requests_total',
+    'Requests failed fast because every llama.cpp backend circuit was open'
+)
+
+WARMUP_STEP_DURATION = Gauge(
+    'api_warmup_step_duration_seconds',
+    'Duration of each startup warm-up step (waiting for the backend, priming each backend, total)',
+    ['step'],
+    multiprocess_mode='livemax'
+)
+
+WARMUP_COMPLETE = Gauge(
+    'api_warmup_complete',
+    'Whether the startup warm-up primed every slot (1) or is still running or failed (0)',
+    multiprocess_mode='livemin'
+)
+
+WARMUP_FAILED = Gauge(
+    'api_warmup_failed',
+    'Whether the startup warm-up timed out or left slots unprimed (1)',
+    multiprocess_mode='livemax'
+)
+
+HEALTH_PROBE_DURATION = Histogram(
+    'llama_health_probe_duration_seconds',
+    'Duration of background health probes against llama.cpp backends',
+    ['backend'],
+    buckets=[0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
+)
+
+RETRY_ATTEMPTS = Counter(
+    'llama_retry_attempts_total',
+    'Retries and hedges requested from the retry budget, by whether the budget allowed them',
+    ['kind', 'outcome']
+)
+
+HEDGE_WINS = Counter(
+    'llama_hedge_wins_total',
+    'Hedged generations by which attempt started answering first',
+    ['winner']
+)
+
+HEDGE_DELAY = Gauge(
+    'llama_hedge_delay_seconds',
+    'Current delay before a slow generation is hedged to another backend',
+    multiprocess_mode='livemax'
+)
+
+HEALTH_PROBE_FAILURES = Counter(
+    'llama_health_probe_failures_total',
+    'Failed background health probes against llama.cpp backends',
+    ['backend']
+)
+
+SLOT_AFFINITY_ASSIGNMENTS = Counter(
+    'llama_slot_affinity_assignments_total',
+    'Slot assignments by result (pinned, new, evicted, busy)',
+    ['result']
+)
+
+LLAMA_PROMPT_TOKENS = Counter(
+    'llama_prompt_tokens_total',
+    'Prompt tokens sent to llama.cpp',
+    ['backend']
+)
+
+LLAMA_PROMPT_TOKENS_REUSED = Counter(
+    'llama_prompt_tokens_reused_total',
+    'Prompt tokens served from the llama.cpp slot cache instead of being re-evaluated',
+    ['backend']
+)
+
+LLAMA_PREFIX_REUSE_RATIO = Histogram(
+    'llama_prompt_prefix_reuse_ratio',
+    'Fraction of each prompt reused from the llama.cpp slot cache',
+    ['backend'],
+    buckets=[0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 1.0]
+)
+
+ADMISSION_ACTIVE = Gauge(
+    'admission_active_requests',
+    'Generations currently holding an admission permit',
+    multiprocess_mode='livesum'
+)
+
+ADMISSION_QUEUE_DEPTH = Gauge(
+    'admission_queue_depth',
+    'Requests waiting for an admission permit',
+    ['priority'],
+    multiprocess_mode='livesum'
+)
+
+ADMISSION_WAIT_TIME = Histogram(
+    'admission_wait_seconds',
+    'Time spent waiting for an admission permit',
+    ['priority'],
+    buckets=[0.0, 0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0]
+)
+
+ADMISSION_SHED = Counter(
+    'admission_shed_total',
+    'Requests rejected by admission control',
+    ['priority', 'reason']
+)
+
+API_KEY_REQUESTS = Counter(
+    'api_key_requests_total',
+    'Generation requests per API key name, by outcome (admitted, rate_limited, token_limited, shed)',
+    ['api_key', 'outcome']
+)
+
+API_KEY_TOKENS = Counter(
+    'api_key_tokens_total',
+    'Tokens charged to each API key name, by type (prompt, completion)',
+    ['api_key', 'type']
+)
+
+SINGLE_FLIGHT_COALESCED = Counter(
+    'single_flight_coalesced_total',
+    'Requests attached to an identical in-flight generation instead of starting their own',
+    ['mode']
+)
+
+SINGLE_FLIGHT_IN_FLIGHT = Gauge(
+    'single_flight_in_flight',
+    'Distinct generations currently in flight that later identical requests can join',
+    multiprocess_mode='livesum'
+)
+
+SESSIONS_ACTIVE = Gauge(
+    'conversation_sessions_active',
+    'Server-side conversations currently held in memory',
+    multiprocess_mode='livemostrecent'
+)
+
+SESSIONS_BYTES = Gauge(
+    'conversation_sessions_bytes',
+    'Approximate memory held by server-side conversations in bytes',
+    multiprocess_mode='livemostrecent'
+)
+
+SESSION_EVICTIONS = Counter(
+    'conversation_session_evictions_total',
+    'Server-side conversations dropped by reason (idle, capacity)',
+    ['reason']
+)
+
+BATCH_JOBS_ACTIVE = Gauge(
+    'batch_jobs_active',
+    'Batch jobs currently being processed',
+    multiprocess_mode='livesum'
+)
+
+BATCH_REQUESTS_COMPLETED = Counter(
+    'batch_requests_completed_total',
+    'Batch requests processed by outcome',
+    ['status']
+)
+
+LOG_EVENTS_DROPPED = Counter(
+    'log_events_dropped_total',
+    'Log events not written, by level and reason (sampled, rate_limited, queue_full)',
+    ['level', 'reason']
+)
+
+HTTP_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+def _route_label(scope: Scope) -> str:
+    # Set by the router once a route matched; anything else shares one label
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request counts and latency.
+
+    Requests are labelled by route template (``/v1/batches/{job_id}``) rather
+    than raw path, so unknown URLs cannot create unbounded series. Time to
+    first byte is taken when the response headers are sent and time to last
+    byte once the application has sent the final body chunk; messages are
+    passed straight through, so streamed responses are never buffered.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status_code = 500
+        first_byte_time = None
         ACTIVE_REQUESTS.inc()
-        
+
+        async def send_with_metrics(message: Message):
+            nonlocal status_code, first_byte_time
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                first_byte_time = time.perf_counter()
+            await send(message)
+
         try:
-            response = await call_next(request)
-            
-            duration = time.time() - start_time
-            
-            REQUEST_COUNT.labels(
-                method=request.method,
-                endpoint=request.url.path,
-                status_code=response.status_code
-            ).inc()
-            
-            REQUEST_DURATION.labels(
-                method=request.method,
-                endpoint=request.url.path
-            ).observe(duration)
-            
-            return response
-            
+            await self.app(scope, receive, send_with_metrics)
         finally:
+            end_time = time.perf_counter()
+            method = scope["method"] if scope["method"] in HTTP_METHODS else "OTHER"
+            endpoint = _route_label(scope)
+
+            REQUEST_COUNT.labels(method=method, endpoint=endpoint, status_code=status_code).inc()
+            REQUEST_DURATION.labels(method=method, endpoint=endpoint).observe(end_time - start_time)
+            if first_byte_time is not None:
+                REQUEST_TIME_TO_FIRST_BYTE.labels(method=method, endpoint=endpoint).observe(first_byte_time - start_time)
             ACTIVE_REQUESTS.dec()
 
 metrics_middleware = MetricsMiddleware
 
-def record_llama_metrics(generation_time: float, tokens_generated: int, tokens_per_second: float, context_tokens: int = 0):
-    LLAMA_GENERATION_DURATION.observe(generation_time)
-    LLAMA_TOKENS_GENERATED.inc(tokens_generated)
-    LLAMA_TOKENS_PER_SECOND.observe(tokens_per_second)
+def record_llama_metrics(backend: str, generation_time: float, tokens_generated: int,
+                         timings: Dict[str, Any], context_tokens: int = 0, stop_reason: str = "stop"):
+    LLAMA_GENERATION_DURATION.labels(backend=backend).observe(generation_time)
+    LLAMA_TOKENS_GENERATED.labels(backend=backend).inc(tokens_generated)
+    LLAMA_STOP_REASONS.labels(backend=backend, reason=stop_reason).inc()
     if context_tokens > 0:
-        LLAMA_CONTEXT_SIZE.observe(context_tokens)
+        LLAMA_CONTEXT_SIZE.labels(backend=backend).observe(context_tokens)
+    
+    # A fully cached prompt or an empty completion reports no meaningful rate
+    if timings.get("prompt_n", 0) > 0:
+        LLAMA_PROMPT_EVAL_TOKENS_PER_SECOND.labels(backend=backend).observe(timings.get("prompt_per_second", 0))
+        LLAMA_PROMPT_EVAL_DURATION.labels(backend=backend).observe(timings.get("prompt_ms", 0) / 1000)
+    if timings.get("predicted_n", 0) > 0:
+        LLAMA_TOKENS_PER_SECOND.labels(backend=backend).observe(timings.get("predicted_per_second", 0))
+        LLAMA_DECODE_DURATION.labels(backend=backend).observe(timings.get("predicted_ms", 0) / 1000)
+
+def record_prompt_cache_reuse(backend: str, prompt_tokens: int, reused_tokens: int):
+    if prompt_tokens <= 0:
+        return
+    LLAMA_PROMPT_TOKENS.labels(backend=backend).inc(prompt_tokens)
+    LLAMA_PROMPT_TOKENS_REUSED.labels(backend=backend).inc(reused_tokens)
+    LLAMA_PREFIX_REUSE_RATIO.labels(backend=backend).observe(reused_tokens / prompt_tokens)
+
+def multiprocess_enabled() -> bool:
+    # Set by api.serve before the workers start; prometheus_client then keeps
+    # every metric in per-process files under this directory
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
 
 def get_metrics():
+    registry = REGISTRY
+    if multiprocess_enabled():
+        # Aggregate the files of all workers rather than this worker's own values
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
     return Response(
-        content=generate_latest(),
+        content=generate_latest(registry),
         media_type=CONTENT_TYPE_LATEST
-    )
\ No newline at end of file
+    )
+
+def mark_worker_exited():
+    """Drop this worker's live gauge values once it shuts down."""
+    if multiprocess_enabled():
+        multiprocess.mark_process_dead(os.getpid())
\ No newline at end of file
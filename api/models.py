@@ -1,6 +1,10 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Union, Dict, Any
+from typing import List, Optional, Union, Dict, Any, Literal
 from enum import Enum
+import time
+import uuid
+
+MODEL_NAME = "stable-cypher-instruct-3b"
 
 class Role(str, Enum):
     SYSTEM = "system"
@@ -10,10 +14,22 @@ class Role(str, Enum):
 class ChatMessage(BaseModel):
     role: Role
     content: str
-    
-class ChatCompletionRequest(BaseModel):
-    messages: Optional[List[ChatMessage]] = None
-    prompt: Optional[str] = None
+
+ROLE_PREFIXES = {
+    Role.SYSTEM: "System",
+    Role.USER: "Human",
+    Role.ASSISTANT: "Assistant"
+}
+
+ASSISTANT_CUE = "Assistant:"
+
+# A generation that starts a new turn has run past its answer
+ROLE_STOP_SEQUENCES = [f"\n{prefix}:" for prefix in ROLE_PREFIXES.values()]
+
+def format_message(message: ChatMessage) -> str:
+    return f"{ROLE_PREFIXES[message.role]}: {message.content}"
+
+class SamplingParams(BaseModel):
     max_tokens: Optional[int] = Field(default=512, ge=1, le=4096)
     temperature: Optional[float] = Field(default=0.7, ge=0.0, le=2.0)
     top_p: Optional[float] = Field(default=0.9, ge=0.0, le=1.0)
@@ -21,27 +37,30 @@ class ChatCompletionRequest(BaseModel):
     repeat_penalty: Optional[float] = Field(default=1.1, ge=0.0, le=2.0)
     stop: Optional[Union[str, List[str]]] = None
     stream: bool = False
-    
+    output_mode: Literal["text", "cypher", "cypher_fenced"] = "text"
+
+class ChatCompletionRequest(SamplingParams):
+    messages: Optional[List[ChatMessage]] = None
+    prompt: Optional[str] = None
     
     def get_prompt_text(self) -> str:
         if self.prompt:
             return self.prompt
         
         if self.messages:
-            parts = []
-            for msg in self.messages:
-                if msg.role == Role.SYSTEM:
-                    parts.append(f"System: {msg.content}")
-                elif msg.role == Role.USER:
-                    parts.append(f"Human: {msg.content}")
-                elif msg.role == Role.ASSISTANT:
-                    parts.append(f"Assistant: {msg.content}")
-            
-            parts.append("Assistant:")
+            parts = [format_message(msg) for msg in self.messages]
+            parts.append(ASSISTANT_CUE)
             return "\n\n".join(parts)
         
         return ""
 
+class ConversationCreateRequest(BaseModel):
+    system: Optional[str] = None
+    messages: List[ChatMessage] = Field(default_factory=list)
+
+class ConversationTurnRequest(SamplingParams):
+    content: str = Field(..., min_length=1)
+
 class Usage(BaseModel):
     prompt_tokens: int
     completion_tokens: int
@@ -52,6 +71,10 @@ class ChatCompletionChoice(BaseModel):
     message: ChatMessage
     finish_reason: Optional[str] = None
 
+class CypherTemplate(BaseModel):
+    query: str
+    params: Dict[str, Any]
+
 class ChatCompletionResponse(BaseModel):
     id: str
     object: str = "chat.completion"
@@ -59,6 +82,67 @@ class ChatCompletionResponse(BaseModel):
     model: str
     choices: List[ChatCompletionChoice]
     usage: Usage
+    cypher_template: Optional[CypherTemplate] = None
+
+def _check_prompt_or_messages(request: ChatCompletionRequest) -> ChatCompletionRequest:
+    if not request.messages and not request.prompt:
+        raise ValueError("Either messages or prompt must be provided")
+    if request.messages and request.prompt:
+        raise ValueError("Cannot provide both messages and prompt")
+    return request
+
+def parse_chat_request(body: Dict[str, Any]) -> ChatCompletionRequest:
+    """Build a ChatCompletionRequest from a decoded request body.
+    
+    Raises ValueError (including pydantic's ValidationError) for invalid input.
+    """
+    if not isinstance(body, dict):
+        raise ValueError("Request body must be a JSON object")
+    return _check_prompt_or_messages(ChatCompletionRequest.model_validate(body))
+
+def parse_chat_request_json(raw: bytes) -> ChatCompletionRequest:
+    """Decode and validate a raw request body in a single pass.
+    
+    pydantic parses the JSON straight into the model without building an
+    intermediate dict. Raises ValueError for malformed or invalid input.
+    """
+    return _check_prompt_or_messages(ChatCompletionRequest.model_validate_json(raw))
+
+def build_usage(result: Dict[str, Any]) -> Dict[str, int]:
+    return {
+        "prompt_tokens": result.get("tokens_evaluated", 0),
+        "completion_tokens": result.get("tokens_predicted", 0),
+        "total_tokens": result.get("tokens_evaluated", 0) + result.get("tokens_predicted", 0)
+    }
+
+def build_chat_completion(result: Dict[str, Any], completion_id: Optional[str] = None) -> Dict[str, Any]:
+    """Render a LlamaClient generation result as a chat.completion response body.
+    
+    The dict is built directly rather than through ChatCompletionResponse to
+    avoid a second round of validation.
+    """
+    response_data = {
+        "id": completion_id or str(uuid.uuid4()),
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": MODEL_NAME,
+        "choices": [
+            {
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": result["content"]
+                },
+                "finish_reason": result.get("stop_reason", "stop")
+            }
+        ],
+        "usage": build_usage(result)
+    }
+    
+    if "cypher_template" in result:
+        response_data["cypher_template"] = result["cypher_template"]
+    
+    return response_data
 
 class HealthResponse(BaseModel):
     status: str
@@ -0,0 +1,94 @@
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import structlog
+
+from .models import ChatMessage, Role, ASSISTANT_CUE, format_message
+from .metrics import TOKEN_COUNT_CACHE_LOOKUPS, PROMPT_TRIMMED_REQUESTS, PROMPT_TRIMMED_MESSAGES
+
+logger = structlog.get_logger()
+
+# Messages are joined with a blank line, which tokenizes to a single token
+SEPARATOR_TOKENS = 1
+
+class PromptBudget:
+    """Trims chat history so the prompt plus ``max_tokens`` fits the context.
+
+    System messages are always kept; the remaining turns are kept newest
+    first for as long as they fit, and the final message is kept even when
+    it alone exceeds the budget. Token counts are memoized per rendered
+    message, so only turns that have not been seen before are tokenized.
+    """
+
+    def __init__(self, context_size: int, margin: int = 16, max_entries: int = 8192):
+        self.context_size = context_size
+        self.margin = margin
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[bytes, int]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    async def fit_messages(self, messages: List[ChatMessage], max_tokens: Optional[int],
+                           count_tokens: Callable[[str], Awaitable[int]], context_size: int) -> List[ChatMessage]:
+        """Return ``messages`` with their oldest non-system turns dropped as needed."""
+        budget = context_size - (max_tokens or 0) - self.margin
+        texts = [format_message(message) for message in messages]
+        counts = await self._count_all(texts + [ASSISTANT_CUE], count_tokens)
+        cue_tokens = counts.pop()
+        counts = [count + SEPARATOR_TOKENS for count in counts]
+
+        if sum(counts) + cue_tokens <= budget:
+            return messages
+
+        last = len(messages) - 1
+        keep = {index for index, message in enumerate(messages) if message.role == Role.SYSTEM}
+        keep.add(last)
+        remaining = budget - cue_tokens - sum(counts[index] for index in keep)
+
+        for index in range(last - 1, -1, -1):
+            if index in keep:
+                continue
+            if counts[index] > remaining:
+                break
+            keep.add(index)
+            remaining -= counts[index]
+
+        kept = [message for index, message in enumerate(messages) if index in keep]
+        dropped = len(messages) - len(kept)
+        if dropped:
+            PROMPT_TRIMMED_REQUESTS.inc()
+            PROMPT_TRIMMED_MESSAGES.inc(dropped)
+            logger.info("Trimmed conversation history to fit context",
+                        dropped_messages=dropped,
+                        kept_messages=len(kept),
+                        prompt_tokens=budget - remaining,
+                        budget=budget)
+        return kept
+
+    async def _count_all(self, texts: List[str], count_tokens: Callable[[str], Awaitable[int]]) -> List[int]:
+        keys = [hashlib.sha1(text.encode("utf-8")).digest() for text in texts]
+        counts: Dict[bytes, int] = {}
+        missing: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key in counts or key in missing:
+                continue
+            if key in self._counts:
+                self._counts.move_to_end(key)
+                counts[key] = self._counts[key]
+                TOKEN_COUNT_CACHE_LOOKUPS.labels(result="hit").inc()
+            else:
+                missing[key] = text
+                TOKEN_COUNT_CACHE_LOOKUPS.labels(result="miss").inc()
+
+        if missing:
+            counted = await asyncio.gather(*(count_tokens(text) for text in missing.values()))
+            for key, count in zip(missing, counted):
+                counts[key] = count
+                self._counts[key] = count
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+
+        return [counts[key] for key in keys]
@@ -0,0 +1,141 @@
+import math
+import time
+from typing import Any, Dict, Optional
+
+import structlog
+
+from .config import QuotaLimits
+from .metrics import API_KEY_REQUESTS, API_KEY_TOKENS
+
+logger = structlog.get_logger()
+
+# Key name used for every caller when no API keys are configured
+ANONYMOUS_KEY = "anonymous"
+
+class QuotaExceeded(Exception):
+    """Raised when an API key has used up its request or token allowance."""
+
+    def __init__(self, key_name: str, reason: str, retry_after: int):
+        super().__init__(f"Quota exceeded for API key {key_name} ({reason}), retry after {retry_after}s")
+        self.status_code = 429
+        self.reason = reason
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Refills at ``rate`` per second up to ``capacity``.
+
+    The balance may go negative when a charge is only known afterwards;
+    the caller then waits until the debt is paid back.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` tokens are available, 0 if they are now."""
+        self._refill(now)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens -= amount
+
+    def give(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class KeyQuota:
+    def __init__(self, limits: QuotaLimits, share: float):
+        # A bucket holds one second of requests, at least one, and one minute of tokens
+        requests_per_second = limits.requests_per_second * share
+        tokens_per_minute = limits.tokens_per_minute * share
+        self.requests = TokenBucket(requests_per_second, max(1.0, requests_per_second)) if requests_per_second else None
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+
+class QuotaManager:
+    """Per-API-key token buckets for requests per second and tokens per minute.
+
+    ``check`` is called before a generation: it takes one request token and
+    fails unless the key's token balance is positive; ``refund`` returns the
+    request token when admission control sheds the request. The prompt and
+    completion tokens are charged afterwards from the reported usage, so a
+    long generation can push the balance below zero and hold off the key's
+    next request until it has been paid back. Both are a dict lookup and a
+    little arithmetic.
+
+    Buckets live in process memory. With several API workers each enforces
+    ``share`` of the configured limits.
+    """
+
+    def __init__(self, default: QuotaLimits, per_key: Optional[Dict[str, QuotaLimits]] = None, share: float = 1.0):
+        self.default = default
+        self.per_key = per_key or {}
+        self.share = share
+        self._quotas: Dict[str, KeyQuota] = {}
+
+    def _quota(self, key_name: str) -> KeyQuota:
+        quota = self._quotas.get(key_name)
+        if quota is None:
+            quota = self._quotas[key_name] = KeyQuota(self.per_key.get(key_name, self.default), self.share)
+        return quota
+
+    def check(self, key_name: str):
+        """Admit one request for ``key_name`` or raise ``QuotaExceeded``."""
+        quota = self._quota(key_name)
+        now = time.monotonic()
+
+        if quota.tokens is not None:
+            wait = quota.tokens.wait_time(1, now)
+            if wait > 0:
+                self._reject(key_name, "token_limited", wait)
+        if quota.requests is not None:
+            wait = quota.requests.wait_time(1, now)
+            if wait > 0:
+                self._reject(key_name, "rate_limited", wait)
+            quota.requests.take(1, now)
+
+        API_KEY_REQUESTS.labels(api_key=key_name, outcome="admitted").inc()
+
+    def refund(self, key_name: str):
+        """Give back the request taken by ``check`` for a request shed before reaching the backend."""
+        quota = self._quota(key_name)
+        if quota.requests is not None:
+            quota.requests.give(1, time.monotonic())
+        API_KEY_REQUESTS.labels(api_key=key_name, outcome="shed").inc()
+
+    def _reject(self, key_name: str, reason: str, wait: float):
+        API_KEY_REQUESTS.labels(api_key=key_name, outcome=reason).inc()
+        logger.warning("Request rejected by quota", api_key=key_name, reason=reason, retry_after=wait)
+        raise QuotaExceeded(key_name, reason, max(1, math.ceil(wait)))
+
+    def token_wait(self, key_name: str) -> float:
+        """Seconds until ``key_name`` may start another generation."""
+        quota = self._quota(key_name)
+        if quota.tokens is None:
+            return 0.0
+        return quota.tokens.wait_time(1, time.monotonic())
+
+    def charge(self, key_name: str, prompt_tokens: int, completion_tokens: int):
+        quota = self._quota(key_name)
+        if quota.tokens is not None:
+            quota.tokens.take(prompt_tokens + completion_tokens, time.monotonic())
+        API_KEY_TOKENS.labels(api_key=key_name, type="prompt").inc(prompt_tokens)
+        API_KEY_TOKENS.labels(api_key=key_name, type="completion").inc(completion_tokens)
+
+    def charge_result(self, key_name: str, result: Dict[str, Any]):
+        """Charge the usage of a generation result.
+
+        Cache hits and results shared from another caller's generation cost
+        the backend nothing, so they are not charged.
+        """
+        if not result.get("cached") and not result.get("coalesced"):
+            self.charge(key_name, result.get("tokens_evaluated", 0), result.get("tokens_predicted", 0))
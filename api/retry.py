@@ -0,0 +1,82 @@
+import math
+import random
+import time
+from collections import deque
+from typing import Deque, List, Optional
+
+from .metrics import RETRY_ATTEMPTS
+
+class RetryBudget:
+    """Caps retries and hedges at a fraction of recent requests.
+
+    Within a sliding ``window`` of seconds, extra attempts are allowed while
+    they number fewer than ``ratio`` times the requests seen plus a floor of
+    ``min_per_second`` per second, so an outage cannot multiply load.
+
+    The budget lives in process memory, so with several API workers each
+    has its own. The ratio applies to each worker's share of the traffic
+    and the floor is divided between the workers.
+    """
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 1.0, window: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self._requests: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+
+    def _trim(self, now: float):
+        cutoff = now - self.window
+        for events in (self._requests, self._retries):
+            while events and events[0] < cutoff:
+                events.popleft()
+
+    def record_request(self):
+        now = time.monotonic()
+        self._trim(now)
+        self._requests.append(now)
+
+    def try_spend(self, kind: str = "retry") -> bool:
+        """Take one extra attempt from the budget, or return False when it is spent."""
+        now = time.monotonic()
+        self._trim(now)
+        allowed = self.min_per_second * self.window + self.ratio * len(self._requests)
+        if len(self._retries) >= allowed:
+            RETRY_ATTEMPTS.labels(kind=kind, outcome="budget_exhausted").inc()
+            return False
+        self._retries.append(now)
+        RETRY_ATTEMPTS.labels(kind=kind, outcome="allowed").inc()
+        return True
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class LatencyQuantile:
+    """Quantile of the most recent latencies, recomputed periodically."""
+
+    def __init__(self, quantile: float = 0.95, window: int = 512, min_samples: int = 20, refresh_every: int = 32):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.refresh_every = refresh_every
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._since_refresh = 0
+        self._value: Optional[float] = None
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+        self._since_refresh += 1
+        if self._since_refresh >= self.refresh_every or self._value is None:
+            self._refresh()
+
+    def _refresh(self):
+        self._since_refresh = 0
+        if len(self._samples) < self.min_samples:
+            return
+        ordered: List[float] = sorted(self._samples)
+        index = min(len(ordered) - 1, math.ceil(self.quantile * len(ordered)) - 1)
+        self._value = ordered[index]
+
+    @property
+    def value(self) -> Optional[float]:
+        return self._value
@@ -0,0 +1,51 @@
+"""Start the API with ``API_WORKERS`` uvicorn worker processes.
+
+With more than one worker, this prepares what the workers share before
+they start: an empty ``PROMETHEUS_MULTIPROC_DIR``, so /metrics in any
+worker reports the sum over all of them, and an empty shared-state
+database under ``SHARED_STATE_DIR`` for the caches and conversations.
+Admission permits are lock files in the same directory. With one worker it is equivalent to running uvicorn
+directly.
+
+Usage: python -m api.serve [--host 0.0.0.0] [--port 8000] [--workers N]
+"""
+
+import argparse
+import glob
+import os
+import shutil
+
+import uvicorn
+
+from .config import settings
+
+def reset_directory(path: str):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+def prepare_shared_state(workers: int):
+    # Workers read these at import time, so they must be in the environment
+    # before uvicorn spawns them
+    os.environ["API_WORKERS"] = str(workers)
+    state_dir = settings.worker_config.shared_state_dir
+    multiproc_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(state_dir, "prometheus"))
+
+    # Left-over files would add a previous run's counters and entries to this one
+    reset_directory(multiproc_dir)
+    for path in glob.glob(os.path.join(state_dir, "state.db*")):
+        os.remove(path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.worker_config.workers)
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        prepare_shared_state(args.workers)
+    uvicorn.run("api.main:app", host=args.host, port=args.port, workers=args.workers,
+                log_level=settings.log_level.lower())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+import structlog
+
+from .models import ChatMessage, ASSISTANT_CUE, format_message
+from .metrics import SESSIONS_ACTIVE, SESSIONS_BYTES, SESSION_EVICTIONS
+
+logger = structlog.get_logger()
+
+PROMPT_SEPARATOR = "\n\n"
+
+class ConversationBusy(Exception):
+    """Raised when deleting a conversation that has a turn in progress."""
+
+class TurnLock:
+    """Marks a conversation as having a turn in progress.
+
+    A second turn is refused rather than queued, so acquiring never waits.
+    """
+
+    __slots__ = ("_held",)
+
+    def __init__(self):
+        self._held = False
+
+    def locked(self) -> bool:
+        return self._held
+
+    def try_acquire(self) -> bool:
+        if self._held:
+            return False
+        self._held = True
+        return True
+
+    def release(self):
+        self._held = False
+
+class Conversation:
+    """A server-side chat history whose prompt is rendered incrementally.
+
+    Appending a turn formats only the new messages, so the prompt prefix
+    stays byte-identical between turns and llama.cpp can reuse its KV cache.
+    ``lock`` allows one turn at a time; a turn only modifies the history
+    once its generation has succeeded.
+    """
+
+    def __init__(self, conversation_id: str, messages: Iterable[ChatMessage] = ()):
+        self.id = conversation_id
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        self.lock = TurnLock()
+        self.messages: List[ChatMessage] = []
+        self.prompt = ""
+        self.accounted_bytes = 0
+        self.extend(messages)
+
+    @property
+    def size(self) -> int:
+        # The rendered prompt plus roughly the same again for the message objects
+        return 2 * len(self.prompt)
+
+    def extend(self, messages: Iterable[ChatMessage]):
+        for message in messages:
+            part = format_message(message)
+            self.prompt = self.prompt + PROMPT_SEPARATOR + part if self.prompt else part
+            self.messages.append(message)
+
+    def replace(self, messages: Iterable[ChatMessage]):
+        self.messages = []
+        self.prompt = ""
+        self.extend(messages)
+
+    def prompt_with(self, message: ChatMessage, history: Optional[List[ChatMessage]] = None) -> str:
+        """The prompt for generating a reply to ``message`` without appending it.
+
+        With ``history``, the prompt is rendered as if the conversation held
+        those messages instead of its own.
+        """
+        prompt = self.prompt if history is None else PROMPT_SEPARATOR.join(format_message(m) for m in history)
+        parts = [prompt] if prompt else []
+        parts.extend([format_message(message), ASSISTANT_CUE])
+        return PROMPT_SEPARATOR.join(parts)
+
+    def to_dict(self, include_messages: bool = True) -> Dict[str, Any]:
+        data = {
+            "id": self.id,
+            "object": "conversation",
+            "created": int(self.created_at),
+            "message_count": len(self.messages)
+        }
+        if include_messages:
+            data["messages"] = [message.model_dump(mode="json") for message in self.messages]
+        return data
+
+class SessionStore:
+    """In-memory conversations with idle expiry and a memory cap.
+
+    Conversations idle for longer than ``idle_ttl`` seconds are dropped, and
+    the least recently used ones are evicted once there are more than
+    ``max_sessions`` or their approximate size exceeds ``max_bytes``.
+    Conversations with a turn in progress are never evicted.
+    """
+
+    def __init__(self, max_sessions: int, max_bytes: int, idle_ttl: float):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.total_bytes = 0
+        self._conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    def create(self, messages: Iterable[ChatMessage] = ()) -> Conversation:
+        conversation = Conversation(f"conv_{uuid.uuid4().hex}", messages)
+        self._conversations[conversation.id] = conversation
+        self.commit(conversation)
+        return conversation
+
+    def get(self, conversation_id: str) -> Optional[Conversation]:
+        self._expire()
+        conversation = self._conversations.get(conversation_id)
+        if conversation is not None:
+            conversation.last_used = time.monotonic()
+            self._conversations.move_to_end(conversation_id)
+        return conversation
+
+    def delete(self, conversation_id: str) -> bool:
+        """Delete a conversation; raises ``ConversationBusy`` while a turn holds its lock."""
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None:
+            return False
+        if conversation.lock.locked():
+            raise ConversationBusy(conversation_id)
+        del self._conversations[conversation_id]
+        self._forget(conversation)
+        return True
+
+    def commit(self, conversation: Conversation):
+        """Account for a conversation's new size and evict others if over budget.
+
+        Does nothing for a conversation that is no longer in the store.
+        """
+        if self._conversations.get(conversation.id) is not conversation:
+            return
+        self.total_bytes += conversation.size - conversation.accounted_bytes
+        conversation.accounted_bytes = conversation.size
+        conversation.last_used = time.monotonic()
+        self._conversations.move_to_end(conversation.id)
+        self._expire()
+
+        for victim in list(self._conversations.values()):
+            if len(self._conversations) <= self.max_sessions and self.total_bytes <= self.max_bytes:
+                break
+            if victim is conversation or victim.lock.locked():
+                continue
+            del self._conversations[victim.id]
+            self._forget(victim)
+            SESSION_EVICTIONS.labels(reason="capacity").inc()
+            logger.info("Evicted conversation", conversation_id=victim.id, reason="capacity")
+
+        self._update_metrics()
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        for conversation in list(self._conversations.values()):
+            # Ordered by last use, so everything after the first fresh entry is fresh too
+            if conversation.last_used > cutoff:
+                break
+            if conversation.lock.locked():
+                continue
+            del self._conversations[conversation.id]
+            self._forget(conversation)
+            SESSION_EVICTIONS.labels(reason="idle").inc()
+        self._update_metrics()
+
+    def _forget(self, conversation: Conversation):
+        self.total_bytes -= conversation.accounted_bytes
+        conversation.accounted_bytes = 0
+        self._update_metrics()
+
+    def _update_metrics(self):
+        SESSIONS_ACTIVE.set(len(self._conversations))
+        SESSIONS_BYTES.set(self.total_bytes)
@@ -0,0 +1,367 @@
+import asyncio
+import fcntl
+import json
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import structlog
+
+from .cache import ResponseCache, ENTRY_OVERHEAD_BYTES
+from .models import ChatMessage
+from .sessions import Conversation, ConversationBusy, SessionStore
+from .metrics import (
+    RESPONSE_CACHE_HITS,
+    RESPONSE_CACHE_MISSES,
+    RESPONSE_CACHE_EVICTIONS,
+    RESPONSE_CACHE_BYTES,
+    SESSIONS_ACTIVE,
+    SESSIONS_BYTES,
+    SESSION_EVICTIONS
+)
+
+logger = structlog.get_logger()
+
+STATE_DB = "state.db"
+PERMITS_DIR = "permits"
+
+def connect(directory: str) -> sqlite3.Connection:
+    """Open the SQLite database the workers of one deployment share.
+
+    The directory is meant to be on tmpfs (``/dev/shm``), so every operation
+    stays in memory; durability is not needed for caches and conversations,
+    which are rebuilt from scratch when the deployment restarts.
+    """
+    os.makedirs(directory, exist_ok=True)
+    # Used from the SharedState thread once serving; opened and set up by the caller
+    conn = sqlite3.connect(os.path.join(directory, STATE_DB), timeout=5.0, isolation_level=None,
+                           check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    return conn
+
+@contextmanager
+def transaction(conn: sqlite3.Connection):
+    # IMMEDIATE takes the write lock up front, so read-modify-write is atomic across workers
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+class SharedState:
+    """The shared database and the thread this worker queries it from.
+
+    SQLite calls block, for up to the 5 s busy timeout while another worker
+    holds the write lock, so they must not run on the event loop. The
+    shared caches and conversations are only used through ``run``, which
+    executes a call on a dedicated thread; that also serializes this
+    worker's use of the connection.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.conn = connect(directory)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.conn.close()
+
+class SharedResponseCache(ResponseCache):
+    """ResponseCache whose entries are shared by all workers.
+
+    Same eviction rules as the in-memory cache: least recently used first
+    once ``max_entries`` or ``max_bytes`` would be exceeded, and expired
+    entries on lookup. Results are stored as JSON. LlamaClient makes every
+    call through ``SharedState.run``.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, max_entries: int, max_bytes: int, ttl: float, max_temperature: float):
+        self.conn = conn
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        conn.execute("""CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY, expires_at REAL, size INTEGER, used_at REAL, result TEXT)""")
+        conn.execute("CREATE INDEX IF NOT EXISTS response_cache_used_at ON response_cache (used_at)")
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+    @property
+    def total_bytes(self) -> int:
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("SELECT expires_at, result FROM response_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            RESPONSE_CACHE_MISSES.inc()
+            return None
+
+        expires_at, result = row
+        now = time.time()
+        if expires_at <= now:
+            self._remove(key)
+            RESPONSE_CACHE_EVICTIONS.labels(reason="expired").inc()
+            RESPONSE_CACHE_MISSES.inc()
+            return None
+
+        self.conn.execute("UPDATE response_cache SET used_at = ? WHERE key = ?", (now, key))
+        RESPONSE_CACHE_HITS.inc()
+        return json.loads(result)
+
+    def put(self, key: str, result: Dict[str, Any], ttl: Optional[float] = None):
+        size = len(key) + len(result.get("content", "").encode("utf-8")) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+
+        now = time.time()
+        with transaction(self.conn):
+            self.conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            count, total_bytes = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache").fetchone()
+            while count and (count >= self.max_entries or total_bytes + size > self.max_bytes):
+                oldest_key, oldest_size = self.conn.execute(
+                    "SELECT key, size FROM response_cache ORDER BY used_at LIMIT 1").fetchone()
+                self.conn.execute("DELETE FROM response_cache WHERE key = ?", (oldest_key,))
+                count -= 1
+                total_bytes -= oldest_size
+                RESPONSE_CACHE_EVICTIONS.labels(reason="capacity").inc()
+
+            expires_at = now + (self.ttl if ttl is None else ttl)
+            self.conn.execute("INSERT INTO response_cache VALUES (?, ?, ?, ?, ?)",
+                              (key, expires_at, size, now, json.dumps(result)))
+        RESPONSE_CACHE_BYTES.set(total_bytes + size)
+
+    def clear(self):
+        self.conn.execute("DELETE FROM response_cache")
+        RESPONSE_CACHE_BYTES.set(0)
+
+    def _remove(self, key: str):
+        self.conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+        RESPONSE_CACHE_BYTES.set(self.total_bytes)
+
+class SharedEntries:
+    """The OrderedDict operations TemplateCache uses, over a table shared by all workers.
+
+    Values are stored as JSON, so a value read back is a copy: changes to it
+    must be written back with ``entries[key] = value``.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, table: str):
+        self.conn = conn
+        self.table = table
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, used_at REAL, value TEXT)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_used_at ON {table} (used_at)")
+
+    def __len__(self) -> int:
+        return self.conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        row = self.conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def __setitem__(self, key: str, value: Any):
+        # Unlike OrderedDict, overwriting also moves the key to the end
+        self.conn.execute(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?)", (key, time.time(), json.dumps(value)))
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        with transaction(self.conn):
+            value = self.get(key, default)
+            self.conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        return value
+
+    def move_to_end(self, key: str):
+        self.conn.execute(f"UPDATE {self.table} SET used_at = ? WHERE key = ?", (time.time(), key))
+
+    def popitem(self, last: bool = True) -> Tuple[str, Any]:
+        order = "DESC" if last else "ASC"
+        with transaction(self.conn):
+            row = self.conn.execute(f"SELECT key, value FROM {self.table} ORDER BY used_at {order} LIMIT 1").fetchone()
+            if row is None:
+                raise KeyError("popitem(): no entries")
+            self.conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (row[0],))
+        return row[0], json.loads(row[1])
+
+class SharedPermits:
+    """Admission permits counted across all workers.
+
+    Permit ``i`` is an exclusive ``flock`` on the file ``permits/i``, so
+    taking or returning one is a single non-blocking system call rather
+    than a database transaction, and the kernel drops the locks of a
+    worker that dies: its permits cannot leak.
+    """
+
+    def __init__(self, directory: str, limit: int):
+        permits_dir = os.path.join(directory, PERMITS_DIR)
+        os.makedirs(permits_dir, exist_ok=True)
+        self.limit = limit
+        # A lock taken through one descriptor conflicts with every other, in this process too
+        self._files = [os.open(os.path.join(permits_dir, str(i)), os.O_RDWR | os.O_CREAT, 0o600) for i in range(limit)]
+        self._held: List[int] = []
+
+    def try_acquire(self) -> bool:
+        for fd in self._files:
+            if fd in self._held:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            self._held.append(fd)
+            return True
+        return False
+
+    def release(self):
+        fcntl.flock(self._held.pop(), fcntl.LOCK_UN)
+
+    def close(self):
+        for fd in self._files:
+            os.close(fd)
+        self._files = []
+        self._held = []
+
+class SessionLease:
+    """Cross-worker stand-in for the conversation's ``TurnLock``.
+
+    A turn holds a lease on the conversation's row; the lease expires after
+    ``ttl`` seconds so a worker that dies mid-turn cannot block the
+    conversation forever. Like the in-memory lock, a turn that finds the
+    lease taken is refused rather than queued. Every method queries the
+    database, so callers run them through ``SharedState.run``.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, conversation_id: str, ttl: float):
+        self.conn = conn
+        self.conversation_id = conversation_id
+        self.ttl = ttl
+
+    def locked(self) -> bool:
+        row = self.conn.execute("SELECT lease_until FROM sessions WHERE id = ?", (self.conversation_id,)).fetchone()
+        return row is not None and row[0] > time.time()
+
+    def try_acquire(self) -> bool:
+        now = time.time()
+        cursor = self.conn.execute("UPDATE sessions SET lease_until = ? WHERE id = ? AND lease_until <= ?",
+                                   (now + self.ttl, self.conversation_id, now))
+        if cursor.rowcount:
+            return True
+        # The conversation is gone, so there is nothing to guard
+        return self.conn.execute("SELECT 1 FROM sessions WHERE id = ?", (self.conversation_id,)).fetchone() is None
+
+    def release(self):
+        self.conn.execute("UPDATE sessions SET lease_until = 0 WHERE id = ?", (self.conversation_id,))
+
+class SharedSessionStore(SessionStore):
+    """SessionStore whose conversations are shared by all workers.
+
+    Each ``get`` rebuilds the conversation from its stored messages; the
+    rendered prompt is byte-identical to the one the in-memory store keeps,
+    so llama.cpp's prompt cache still applies. Idle expiry and the
+    count/size limits work as in SessionStore, measured across workers.
+    Every method queries the database; call them through ``SharedState.run``.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, max_sessions: int, max_bytes: int, idle_ttl: float, lease_ttl: float):
+        super().__init__(max_sessions, max_bytes, idle_ttl)
+        self.conn = conn
+        self.lease_ttl = lease_ttl
+        conn.execute("""CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY, created_at REAL, used_at REAL, size INTEGER, lease_until REAL, messages TEXT)""")
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_used_at ON sessions (used_at)")
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def _conversation(self, conversation_id: str, messages: Iterable[ChatMessage]) -> Conversation:
+        conversation = Conversation(conversation_id, messages)
+        conversation.lock = SessionLease(self.conn, conversation_id, self.lease_ttl)
+        return conversation
+
+    def create(self, messages: Iterable[ChatMessage] = ()) -> Conversation:
+        conversation = self._conversation(f"conv_{uuid.uuid4().hex}", messages)
+        self._save(conversation, create=True)
+        return conversation
+
+    def get(self, conversation_id: str) -> Optional[Conversation]:
+        self._expire()
+        row = self.conn.execute("SELECT created_at, size, messages FROM sessions WHERE id = ?", (conversation_id,)).fetchone()
+        if row is None:
+            return None
+
+        created_at, size, messages = row
+        conversation = self._conversation(conversation_id, [ChatMessage(**message) for message in json.loads(messages)])
+        conversation.created_at = created_at
+        conversation.accounted_bytes = size
+        self.conn.execute("UPDATE sessions SET used_at = ? WHERE id = ?", (time.time(), conversation_id))
+        return conversation
+
+    def delete(self, conversation_id: str) -> bool:
+        """Delete a conversation; raises ``ConversationBusy`` while a turn holds its lease."""
+        now = time.time()
+        with transaction(self.conn):
+            deleted = self.conn.execute("DELETE FROM sessions WHERE id = ? AND lease_until <= ?",
+                                        (conversation_id, now)).rowcount > 0
+            busy = not deleted and self.conn.execute(
+                "SELECT 1 FROM sessions WHERE id = ?", (conversation_id,)).fetchone() is not None
+        if busy:
+            raise ConversationBusy(conversation_id)
+        self._update_metrics()
+        return deleted
+
+    def commit(self, conversation: Conversation):
+        """Store a conversation's messages and evict others if over budget.
+
+        Does nothing for a conversation that has been deleted meanwhile.
+        """
+        self._save(conversation, create=False)
+
+    def _save(self, conversation: Conversation, create: bool):
+        now = time.time()
+        messages = json.dumps([message.model_dump(mode="json") for message in conversation.messages])
+        with transaction(self.conn):
+            if create:
+                self.conn.execute("INSERT INTO sessions VALUES (?, ?, ?, ?, 0, ?)",
+                                  (conversation.id, conversation.created_at, now, conversation.size, messages))
+            elif not self.conn.execute("UPDATE sessions SET used_at = ?, size = ?, messages = ? WHERE id = ?",
+                                       (now, conversation.size, messages, conversation.id)).rowcount:
+                return
+            conversation.accounted_bytes = conversation.size
+
+            count, total_bytes = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions").fetchone()
+            while count > self.max_sessions or total_bytes > self.max_bytes:
+                # Conversations with a turn in progress are never evicted
+                victim = self.conn.execute("""SELECT id, size FROM sessions WHERE id != ? AND lease_until <= ?
+                    ORDER BY used_at LIMIT 1""", (conversation.id, now)).fetchone()
+                if victim is None:
+                    break
+                self.conn.execute("DELETE FROM sessions WHERE id = ?", (victim[0],))
+                count -= 1
+                total_bytes -= victim[1]
+                SESSION_EVICTIONS.labels(reason="capacity").inc()
+                logger.info("Evicted conversation", conversation_id=victim[0], reason="capacity")
+
+        self._expire()
+
+    def _expire(self):
+        now = time.time()
+        expired = self.conn.execute("DELETE FROM sessions WHERE used_at < ? AND lease_until <= ?",
+                                    (now - self.idle_ttl, now)).rowcount
+        if expired:
+            SESSION_EVICTIONS.labels(reason="idle").inc(expired)
+        self._update_metrics()
+
+    def _update_metrics(self):
+        count, total_bytes = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions").fetchone()
+        SESSIONS_ACTIVE.set(count)
+        SESSIONS_BYTES.set(total_bytes)
@@ -0,0 +1,127 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Type
+
+from .metrics import SINGLE_FLIGHT_COALESCED, SINGLE_FLIGHT_IN_FLIGHT
+
+class _Flight:
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.events: List[Dict[str, Any]] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+class SingleFlight:
+    """Coalesces concurrent identical generations onto one in-flight request.
+
+    The generation runs in its own task so a caller going away does not
+    cancel it for the others; it is only cancelled once every caller has
+    left. Streaming callers that join late first replay the events buffered
+    so far and then follow the live stream. Followers' results and events
+    are marked ``coalesced``.
+
+    A follower whose shared flight fails with one of ``run_alone`` before
+    producing anything runs ``factory`` itself instead. The leader's
+    failure may not apply to it: admission control may have shed the
+    leader for the leader's own deadline, for example.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[Dict[str, Any]]],
+                  run_alone: Tuple[Type[BaseException], ...] = ()) -> Dict[str, Any]:
+        key = f"completion:{key}"
+        flight, leader = self._join(key, "completion")
+        if leader:
+            flight.task = asyncio.create_task(factory())
+            flight.task.add_done_callback(lambda _: self._finish(key, flight))
+
+        try:
+            result = await asyncio.shield(flight.task)
+        except run_alone:
+            if leader:
+                raise
+            return await factory()
+        finally:
+            self._leave(key, flight)
+        return result if leader else dict(result, coalesced=True)
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator[Dict[str, Any]]],
+                     run_alone: Tuple[Type[BaseException], ...] = ()) -> AsyncIterator[Dict[str, Any]]:
+        key = f"stream:{key}"
+        flight, leader = self._join(key, "stream")
+        if leader:
+            flight.task = asyncio.create_task(self._produce(flight, factory))
+            flight.task.add_done_callback(lambda _: self._finish(key, flight))
+
+        alone = False
+        try:
+            index = 0
+            while True:
+                changed = flight.changed
+                while index < len(flight.events):
+                    event = flight.events[index]
+                    yield event if leader else dict(event, coalesced=True)
+                    index += 1
+                if flight.done:
+                    if flight.error is None:
+                        return
+                    if leader or index or not isinstance(flight.error, run_alone):
+                        raise flight.error
+                    alone = True
+                    break
+                await changed.wait()
+        finally:
+            self._leave(key, flight)
+
+        if alone:
+            async for event in factory():
+                yield event
+
+    def _join(self, key: str, mode: str):
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _Flight()
+            self._flights[key] = flight
+            SINGLE_FLIGHT_IN_FLIGHT.set(len(self._flights))
+        else:
+            SINGLE_FLIGHT_COALESCED.labels(mode=mode).inc()
+        flight.subscribers += 1
+        return flight, leader
+
+    def _leave(self, key: str, flight: _Flight):
+        flight.subscribers -= 1
+        if flight.subscribers == 0 and flight.task is not None and not flight.task.done():
+            flight.task.cancel()
+            # The task only finishes on the next loop iteration; a caller
+            # arriving before then must start a new flight, not join this one
+            self._finish(key, flight)
+
+    def _finish(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+            SINGLE_FLIGHT_IN_FLIGHT.set(len(self._flights))
+
+    async def _produce(self, flight: _Flight, factory: Callable[[], AsyncIterator[Dict[str, Any]]]):
+        try:
+            async for event in factory():
+                flight.events.append(event)
+                flight.notify()
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.notify()
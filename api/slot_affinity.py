@@ -0,0 +1,83 @@
+import hashlib
+from collections import OrderedDict
+from typing import Optional, Set, Tuple
+
+from .metrics import SLOT_AFFINITY_ASSIGNMENTS
+
+class SlotAffinity:
+    """Pins conversations to llama.cpp slots so their KV cache prefix is reused.
+
+    Requests are keyed by session ID when the client sends one, otherwise by
+    a hash of the first ``prefix_chars`` characters of the rendered prompt
+    (the system prompt and opening turn of a conversation). Each key owns at
+    most one ``(backend, id_slot)`` pair; when a backend has no unowned slot
+    left, the least recently used key on that backend gives up its slot.
+    """
+
+    def __init__(self, slots_per_backend: int, prefix_chars: int = 512):
+        self.slots_per_backend = slots_per_backend
+        self.prefix_chars = prefix_chars
+        self._owners: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._busy: Set[Tuple[str, int]] = set()
+
+    def __len__(self) -> int:
+        return len(self._owners)
+
+    def key_for(self, prompt_text: str, session_id: Optional[str] = None) -> str:
+        if session_id:
+            return f"session:{session_id}"
+        prefix = prompt_text[:self.prefix_chars]
+        return "prefix:" + hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+
+    def preferred_endpoint(self, key: str) -> Optional[str]:
+        owner = self._owners.get(key)
+        return owner[0] if owner else None
+
+    def owner(self, key: str) -> Optional[Tuple[str, int]]:
+        return self._owners.get(key)
+
+    def restore(self, key: str, owner: Optional[Tuple[str, int]]):
+        """Give ``key`` back the slot it owned before a reassignment that did
+        not pay off, unless another key has taken that slot since."""
+        self._owners.pop(key, None)
+        if owner is None or any(other == owner for other in self._owners.values()):
+            return
+        self._owners[key] = owner
+
+    def assign(self, key: str, endpoint: str) -> int:
+        """Reserve the key's slot on ``endpoint``, returning -1 if none is usable."""
+        owner = self._owners.get(key)
+        if owner is not None and owner[0] == endpoint:
+            if owner in self._busy:
+                SLOT_AFFINITY_ASSIGNMENTS.labels(result="busy").inc()
+                return -1
+            self._owners.move_to_end(key)
+            self._busy.add(owner)
+            SLOT_AFFINITY_ASSIGNMENTS.labels(result="pinned").inc()
+            return owner[1]
+
+        if owner is not None:
+            del self._owners[key]
+
+        owned = {slot for owner_endpoint, slot in self._owners.values() if owner_endpoint == endpoint}
+        free = [slot for slot in range(self.slots_per_backend)
+                if slot not in owned and (endpoint, slot) not in self._busy]
+        if free:
+            slot = free[0]
+            SLOT_AFFINITY_ASSIGNMENTS.labels(result="new").inc()
+        else:
+            victim = next((other_key for other_key, other in self._owners.items()
+                           if other[0] == endpoint and other not in self._busy), None)
+            if victim is None:
+                SLOT_AFFINITY_ASSIGNMENTS.labels(result="busy").inc()
+                return -1
+            slot = self._owners.pop(victim)[1]
+            SLOT_AFFINITY_ASSIGNMENTS.labels(result="evicted").inc()
+
+        self._owners[key] = (endpoint, slot)
+        self._busy.add((endpoint, slot))
+        return slot
+
+    def release(self, endpoint: str, slot: int):
+        if slot >= 0:
+            self._busy.discard((endpoint, slot))
@@ -0,0 +1,70 @@
+from typing import Dict, Iterable, Tuple
+
+import httpx
+
+from .metrics import BACKEND_CONNECTIONS
+
+UNIX_SCHEME = "unix://"
+
+CONNECT_EVENTS = ("connection.connect_tcp.started", "connection.connect_unix_socket.started")
+REQUEST_SENT_EVENT = "http11.send_request_headers.started"
+
+def is_unix_endpoint(endpoint: str) -> bool:
+    return endpoint.startswith(UNIX_SCHEME)
+
+class ConnectionTracker:
+    """Counts, per backend, whether each request opened a connection or reused one.
+
+    Installed as a request event hook; it attaches an httpcore trace callback
+    that notices a connect before the request headers are written.
+    """
+
+    def __init__(self, endpoints_by_host: Dict[str, str]):
+        self.endpoints_by_host = endpoints_by_host
+
+    async def __call__(self, request: httpx.Request):
+        endpoint = self.endpoints_by_host.get(request.url.netloc.decode("ascii"))
+        if endpoint is None:
+            return
+        connected = False
+
+        async def trace(event_name: str, info: dict):
+            nonlocal connected
+            if event_name in CONNECT_EVENTS:
+                connected = True
+            elif event_name == REQUEST_SENT_EVENT:
+                BACKEND_CONNECTIONS.labels(backend=endpoint, connection="new" if connected else "reused").inc()
+
+        request.extensions["trace"] = trace
+
+def build_http_client(endpoints: Iterable[str], timeout: float, max_connections: int,
+                      max_keepalive_connections: int, keepalive_expiry: float) -> Tuple[httpx.AsyncClient, Dict[str, str]]:
+    """Create the client shared by all backends and the base URL for each endpoint.
+
+    ``unix:///path/to/llama.sock`` endpoints get their own transport bound to
+    the socket, mounted under a placeholder host, so the rest of the client
+    builds URLs the same way for TCP and Unix domain socket backends.
+    """
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry
+    )
+    base_urls: Dict[str, str] = {}
+    mounts: Dict[str, httpx.AsyncHTTPTransport] = {}
+    for index, endpoint in enumerate(endpoints):
+        if is_unix_endpoint(endpoint):
+            base_url = f"http://llama-uds-{index}"
+            mounts[base_url] = httpx.AsyncHTTPTransport(uds=endpoint[len(UNIX_SCHEME):], limits=limits)
+        else:
+            base_url = endpoint.rstrip("/")
+        base_urls[endpoint] = base_url
+
+    tracker = ConnectionTracker({httpx.URL(url).netloc.decode("ascii"): endpoint for endpoint, url in base_urls.items()})
+    client = httpx.AsyncClient(
+        timeout=timeout,
+        limits=limits,
+        mounts=mounts,
+        event_hooks={"request": [tracker]}
+    )
+    return client, base_urls
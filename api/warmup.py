@@ -0,0 +1,140 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import structlog
+
+from .backend_pool import Backend
+from .models import parse_chat_request
+from .metrics import WARMUP_STEP_DURATION, WARMUP_COMPLETE, WARMUP_FAILED
+
+logger = structlog.get_logger()
+
+# Used when no warm-up prompts are configured: enough to page in the weights
+DEFAULT_WARMUP_PROMPT = "Human: Return all nodes.\n\nAssistant:"
+
+def load_warmup_prompts(path: Optional[str]) -> List[str]:
+    """Read warm-up prompts from a JSON list.
+
+    Entries are either raw prompt strings or chat requests (``messages`` or
+    ``prompt``), which are rendered exactly as live requests are so that the
+    primed prefix matches theirs token for token.
+    """
+    if not path:
+        return [DEFAULT_WARMUP_PROMPT]
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{path} must contain a non-empty JSON list of warm-up prompts")
+    return [entry if isinstance(entry, str) else parse_chat_request(entry).get_prompt_text() for entry in entries]
+
+class Warmup:
+    """Brings the backends from cold start to ready before traffic is accepted.
+
+    First waits, with capped exponential backoff, for the health prober to
+    see a healthy backend, then runs every warm-up prompt on every slot of
+    every healthy backend so the model is paged in and each slot's prompt
+    cache holds the last prompt. Readiness stays false until this finishes
+    or ``timeout`` seconds pass; the duration of each step is logged,
+    exported and included in the readiness response. Warm-up only counts
+    as complete when every slot was primed.
+    """
+
+    def __init__(self, llama_client, prompts: List[str], slots_per_backend: int,
+                 timeout: float = 300.0, max_backoff: float = 10.0):
+        self.llama_client = llama_client
+        self.prompts = prompts
+        self.slots_per_backend = slots_per_backend
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.state = "pending"
+        self.steps: Dict[str, float] = {}
+        self.failed_slots = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        return self.state in ("complete", "failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def _record_step(self, step: str, started: float):
+        duration = time.monotonic() - started
+        self.steps[step] = round(duration, 3)
+        WARMUP_STEP_DURATION.labels(step=step).set(duration)
+        logger.info("Warm-up step finished", step=step, duration=duration)
+
+    async def run(self):
+        started = time.monotonic()
+        self.state = "waiting_for_backend"
+        try:
+            await asyncio.wait_for(self._prime_all(started), timeout=self.timeout)
+            if self.failed_slots:
+                self.state = "failed"
+                logger.error("Warm-up left slots unprimed", failed_slots=self.failed_slots, steps=self.steps)
+            else:
+                self.state = "complete"
+        except asyncio.TimeoutError:
+            # Readiness falls back to backend health rather than staying down forever
+            self.state = "failed"
+            logger.error("Warm-up did not finish in time", timeout=self.timeout, steps=self.steps)
+        except Exception as e:
+            self.state = "failed"
+            logger.error("Warm-up failed", error=str(e), steps=self.steps)
+        self._record_step("total", started)
+        if self.state == "complete":
+            WARMUP_COMPLETE.set(1)
+        else:
+            WARMUP_FAILED.set(1)
+
+    async def _prime_all(self, started: float):
+        await self._wait_for_backend()
+        self._record_step("wait_for_backend", started)
+
+        self.state = "priming"
+        healthy = [state.backend for state in self.llama_client.health.states if state.healthy]
+        await asyncio.gather(*(self._prime_backend(backend) for backend in healthy))
+
+    async def _wait_for_backend(self):
+        health = self.llama_client.health
+        delay = 0.5
+        while True:
+            await health.probe_all()
+            if health.ready:
+                return
+            logger.info("Waiting for llama.cpp to finish loading", retry_in=delay, health=health.status().get("error"))
+            await asyncio.sleep(delay)
+            delay = min(self.max_backoff, delay * 2)
+
+    async def _prime_backend(self, backend: Backend):
+        started = time.monotonic()
+        await asyncio.gather(*(self._prime_slot(backend, slot) for slot in range(self.slots_per_backend)))
+        self._record_step(f"prime:{backend.endpoint}", started)
+
+    async def _prime_slot(self, backend: Backend, slot: int):
+        # Prompts run in order, so the last one is what stays in the slot's cache
+        for prompt in self.prompts:
+            try:
+                await self.llama_client.prime(backend, prompt, slot)
+            except httpx.HTTPError as e:
+                logger.warning("Warm-up prompt failed", backend=backend.endpoint, slot=slot, error=str(e))
+                self.failed_slots += 1
+                return
+
+    def status(self) -> Dict[str, Any]:
+        status = {"state": self.state, "steps": dict(self.steps)}
+        if self.failed_slots:
+            status["failed_slots"] = self.failed_slots
+        return status
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Microbenchmark for the chat completion request/response codec.
+
+Compares the previous path (json.loads -> ChatCompletionRequest(**body) ->
+ChatCompletionResponse re-validation -> json.dumps) against the current one
+(model_validate_json -> build_chat_completion -> orjson.dumps).
+
+Usage: python scripts/bench_codec.py [iterations]
+"""
+
+import json
+import os
+import sys
+import time
+
+import orjson
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from api.models import (  # noqa: E402
+    ChatCompletionRequest,
+    ChatCompletionResponse,
+    parse_chat_request_json,
+    build_chat_completion
+)
+
+REQUEST_BODY = json.dumps({
+    "messages": [
+        {"role": "system", "content": "You are a Cypher query expert. Generate only valid Cypher queries."},
+        {"role": "user", "content": "Find all movies that an actor named 'Tom Hanks' has acted in"}
+    ],
+    "temperature": 0.0,
+    "max_tokens": 256
+}).encode("utf-8")
+
+GENERATION = {
+    "content": "MATCH (a:Actor {name: 'Tom Hanks'})-[:ACTED_IN]->(m:Movie) RETURN m.title",
+    "tokens_evaluated": 64,
+    "tokens_predicted": 24,
+    "generation_time": 0.12,
+    "tokens_per_second": 200.0
+}
+
+def old_path() -> bytes:
+    body = json.loads(REQUEST_BODY)
+    request = ChatCompletionRequest(**body)
+    request.get_prompt_text()
+    response = ChatCompletionResponse(**build_chat_completion(GENERATION))
+    return json.dumps(response.model_dump(exclude_none=True)).encode("utf-8")
+
+def new_path() -> bytes:
+    request = parse_chat_request_json(REQUEST_BODY)
+    request.get_prompt_text()
+    return orjson.dumps(build_chat_completion(GENERATION))
+
+def bench(name: str, func, iterations: int) -> float:
+    for _ in range(min(1000, iterations)):
+        func()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    per_call = (time.perf_counter() - start) / iterations * 1e6
+    print(f"{name:<6} {per_call:8.2f} us/request")
+    return per_call
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"Codec benchmark ({iterations} iterations)")
+    old = bench("old", old_path, iterations)
+    new = bench("new", new_path, iterations)
+    print(f"speedup {old / new:.2f}x")
+
+if __name__ == "__main__":
+    main()
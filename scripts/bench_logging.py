@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Benchmark of event-loop lag while request handlers log heavily.
+
+Simulated requests, each logging a handful of structured events, run on the
+event loop next to a ticker that sleeps 1 ms at a time and records how late
+it wakes up. The same load runs with records rendered and written by the
+caller (the previous setup), with the background queue writer, and with
+the queue writer plus request sampling. Output goes to a stream whose
+writes stall for a configurable time, as a full log pipe does; use a stall
+of 0 for a fast sink.
+
+Usage: python scripts/bench_logging.py [requests] [write_stall_us]
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import structlog
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from api.config import LoggingConfig  # noqa: E402
+from api.logs import LogSamplingMiddleware, configure_logging, stop_logging  # noqa: E402
+
+EVENTS_PER_REQUEST = 5
+CONCURRENCY = 32
+
+class StallingStream:
+    """Discards output, sleeping ``stall`` seconds per write like a slow pipe."""
+
+    def __init__(self, stall: float):
+        self.stall = stall
+        self.writes = 0
+
+    def write(self, text: str):
+        self.writes += 1
+        if self.stall:
+            time.sleep(self.stall)
+
+    def flush(self):
+        pass
+
+async def handle_request(scope, receive, send):
+    logger = structlog.get_logger("bench")
+    for step in range(EVENTS_PER_REQUEST):
+        logger.info("Request step", step=step, model="stable-cypher-instruct-3b",
+                    prompt_tokens=412, completion_tokens=37, cache_hit=False)
+        await asyncio.sleep(0)
+
+async def measure_lag(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+
+async def run(requests: int, sample_rate: float) -> float:
+    app = LogSamplingMiddleware(handle_request, sample_rate)
+    remaining = iter(range(requests))
+
+    async def client():
+        for _ in remaining:
+            await app({"type": "http"}, None, None)
+
+    await asyncio.gather(*(client() for _ in range(CONCURRENCY)))
+
+async def bench(name: str, config: LoggingConfig, requests: int, stall: float):
+    stream = StallingStream(stall)
+    configure_logging(config, stream)
+    stop, lags = asyncio.Event(), []
+    ticker = asyncio.create_task(measure_lag(stop, lags))
+
+    start = time.perf_counter()
+    await run(requests, config.sample_rate)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+    stop_logging()
+    drained = time.perf_counter() - start
+
+    ordered = sorted(lags)
+    print(f"{name:<16} lag p50 {ordered[len(ordered) // 2] * 1e3:7.2f} ms  "
+          f"p99 {ordered[int(len(ordered) * 0.99)] * 1e3:7.2f} ms  "
+          f"max {ordered[-1] * 1e3:7.2f} ms  mean {statistics.mean(lags) * 1e3:6.2f} ms  "
+          f"{requests / elapsed:7.0f} req/s  written {stream.writes:6d}  "
+          f"all written after {drained:5.2f} s")
+
+async def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    stall = (int(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1e6
+
+    print(f"Logging benchmark ({requests} requests x {EVENTS_PER_REQUEST} INFO events, "
+          f"{CONCURRENCY} concurrent, {stall * 1e6:.0f} us per write)")
+    await bench("inline", LoggingConfig(queue_enabled=False), requests, stall)
+    await bench("queue", LoggingConfig(queue_size=100000), requests, stall)
+    await bench("queue+sample10%", LoggingConfig(queue_size=100000, sample_rate=0.1), requests, stall)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Microbenchmark for the per-request overhead of the metrics middleware.
+
+Drives a minimal FastAPI app in-process through httpx's ASGI transport with
+no middleware, with the previous BaseHTTPMiddleware implementation and with
+the current pure ASGI MetricsMiddleware, for both a JSON and a streaming
+endpoint.
+
+Usage: python scripts/bench_middleware.py [iterations]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from api.metrics import MetricsMiddleware, REQUEST_COUNT, REQUEST_DURATION, ACTIVE_REQUESTS  # noqa: E402
+
+class BaseHTTPMetricsMiddleware(BaseHTTPMiddleware):
+    """The previous implementation, kept here as the baseline."""
+
+    async def dispatch(self, request: Request, call_next):
+        start_time = time.time()
+        ACTIVE_REQUESTS.inc()
+        try:
+            response = await call_next(request)
+        except Exception:
+            ACTIVE_REQUESTS.dec()
+            raise
+
+        body_iterator = response.body_iterator
+
+        async def body_with_metrics():
+            try:
+                async for chunk in body_iterator:
+                    yield chunk
+            finally:
+                REQUEST_COUNT.labels(method=request.method, endpoint=request.url.path,
+                                     status_code=response.status_code).inc()
+                REQUEST_DURATION.labels(method=request.method,
+                                        endpoint=request.url.path).observe(time.time() - start_time)
+                ACTIVE_REQUESTS.dec()
+
+        response.body_iterator = body_with_metrics()
+        return response
+
+def build_app(middleware=None) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: int):
+        return {"id": item_id}
+
+    @app.get("/stream")
+    async def stream():
+        async def events():
+            for i in range(8):
+                yield b"data: %d\n\n" % i
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    if middleware is not None:
+        app.add_middleware(middleware)
+    return app
+
+async def bench(name: str, app: FastAPI, path: str, iterations: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(min(200, iterations)):
+            await client.get(path)
+        start = time.perf_counter()
+        for i in range(iterations):
+            response = await client.get(path)
+            response.raise_for_status()
+        per_request = (time.perf_counter() - start) / iterations * 1e6
+    print(f"{name:<14} {path:<10} {per_request:8.1f} us/request")
+    return per_request
+
+async def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    print(f"Metrics middleware benchmark ({iterations} iterations)")
+    for path in ("/items/1", "/stream"):
+        baseline = await bench("none", build_app(), path, iterations)
+        old = await bench("basehttp", build_app(BaseHTTPMetricsMiddleware), path, iterations)
+        new = await bench("pure-asgi", build_app(MetricsMiddleware), path, iterations)
+        print(f"overhead: basehttp {old - baseline:+.1f} us, pure-asgi {new - baseline:+.1f} us")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Benchmark of the API-to-llama.cpp hop over TCP loopback and a Unix domain socket.
+
+Starts scripts/mock_llama_server.py twice, once on a TCP port and once on a
+Unix socket, and times LlamaClient.count_tokens (a small POST to /tokenize
+that involves no simulated model work) through the client's real connection
+pool. Requests run one at a time and then with several in flight, so the
+numbers are the per-request transport and proxy overhead.
+
+Usage: python scripts/bench_transport.py [iterations] [concurrency]
+"""
+
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from api.config import LlamaConfig  # noqa: E402
+from api.llama_client import LlamaClient  # noqa: E402
+
+MOCK_SERVER = os.path.join(ROOT, "scripts", "mock_llama_server.py")
+PROMPT = "MATCH (p:Person {name: 'John'}) RETURN p"
+
+def start_mock(*args: str) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, MOCK_SERVER, *args],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+async def wait_ready(endpoint: str, timeout: float = 15.0):
+    client = LlamaClient(LlamaConfig(endpoint=endpoint))
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                await client.count_tokens(PROMPT)
+                return
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+    finally:
+        await client.client.aclose()
+
+async def bench(name: str, endpoint: str, iterations: int, concurrency: int):
+    client = LlamaClient(LlamaConfig(endpoint=endpoint))
+    latencies = []
+
+    async def worker(count: int):
+        for _ in range(count):
+            start = time.perf_counter()
+            await client.count_tokens(PROMPT)
+            latencies.append(time.perf_counter() - start)
+
+    try:
+        for _ in range(min(200, iterations)):
+            await client.count_tokens(PROMPT)
+
+        for in_flight in (1, concurrency):
+            latencies.clear()
+            start = time.perf_counter()
+            await asyncio.gather(*(worker(iterations // in_flight) for _ in range(in_flight)))
+            elapsed = time.perf_counter() - start
+            ordered = sorted(latencies)
+            p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+            print(f"{name:<5} in_flight={in_flight:<3} "
+                  f"mean {statistics.mean(latencies) * 1e6:8.1f} us  "
+                  f"p50 {ordered[len(ordered) // 2] * 1e6:8.1f} us  "
+                  f"p99 {p99 * 1e6:8.1f} us  "
+                  f"{len(latencies) / elapsed:8.0f} req/s")
+    finally:
+        await client.client.aclose()
+
+async def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    port = 18765
+
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, "llama.sock")
+        servers = [start_mock("--port", str(port)), start_mock("--uds", socket_path)]
+        try:
+            tcp, uds = f"http://127.0.0.1:{port}", f"unix://{socket_path}"
+            await wait_ready(tcp)
+            await wait_ready(uds)
+            print(f"Transport benchmark ({iterations} requests, POST /tokenize)")
+            await bench("tcp", tcp, iterations, concurrency)
+            await bench("uds", uds, iterations, concurrency)
+        finally:
+            for server in servers:
+                server.terminate()
+                server.wait()
+
+if __name__ == "__main__":
+    asyncio.run(main())
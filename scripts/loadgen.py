@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""Asyncio load generator for the chat completions API.
+
+Open-loop mode starts requests on a schedule (Poisson or constant arrivals,
+optionally ramping between two rates) regardless of how fast the server
+answers, so queueing shows up as latency rather than a lower request rate.
+Closed-loop mode sweeps fixed concurrency levels. Every run reports
+throughput, error rate and p50/p90/p99/p99.9 latency and time to first
+token, and results can be written as JSON or CSV and compared with a
+previous run.
+
+Examples:
+  python scripts/loadgen.py --rate 5 --duration 60 --stream
+  python scripts/loadgen.py --rate 1 --ramp-to 20 --duration 120 --output ramp.json
+  python scripts/loadgen.py --concurrency 1,2,4,8,16 --duration 30 --output sweep.csv
+  python scripts/loadgen.py --rate 5 --duration 60 --compare baseline.json
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import random
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+PROMPTS = [
+    "Find all Person nodes with name 'John'",
+    "Find all movies that an actor named 'Tom Hanks' has acted in",
+    "Find users who have similar preferences to a given user",
+    "Find all products in a specific category with their prices",
+    "Find the shortest path between two people in a social network",
+    "Count the number of movies released each year"
+]
+
+PERCENTILES = [50, 90, 99, 99.9]
+
+REPORT_FIELDS = ["latency_p50", "latency_p99", "ttft_p50", "ttft_p99", "throughput", "error_rate"]
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+class LoadGenerator:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.sequence = 0
+        headers = {"Authorization": f"Bearer {args.api_key}"} if args.api_key else {}
+        limits = httpx.Limits(max_connections=args.max_inflight, max_keepalive_connections=args.max_inflight)
+        self.client = httpx.AsyncClient(base_url=args.url, headers=headers, limits=limits,
+                                        timeout=httpx.Timeout(args.timeout))
+
+    def payload(self) -> Dict[str, Any]:
+        self.sequence += 1
+        prompt = random.choice(self.args.prompts)
+        if not self.args.repeat_prompts:
+            # A unique suffix keeps the response cache and request coalescing out of the measurement
+            prompt = f"{prompt} (request {self.sequence})"
+        return {
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": self.args.max_tokens,
+            "temperature": self.args.temperature,
+            "stream": self.args.stream
+        }
+
+    async def request(self) -> Dict[str, Any]:
+        start = time.perf_counter()
+        result = {"start": start, "latency": None, "ttft": None, "status": None, "error": None, "tokens": 0}
+        try:
+            if self.args.stream:
+                async with self.client.stream("POST", self.args.path, json=self.payload()) as response:
+                    result["status"] = response.status_code
+                    if response.is_error:
+                        await response.aread()
+                        result["error"] = f"HTTP {response.status_code}"
+                    else:
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data: ") or line == "data: [DONE]":
+                                continue
+                            chunk = json.loads(line[len("data: "):])
+                            if "error" in chunk:
+                                result["error"] = "stream_error"
+                                break
+                            if chunk["choices"][0]["delta"].get("content"):
+                                result["tokens"] += 1
+                                if result["ttft"] is None:
+                                    result["ttft"] = time.perf_counter() - start
+            else:
+                response = await self.client.post(self.args.path, json=self.payload())
+                result["status"] = response.status_code
+                if response.is_error:
+                    result["error"] = f"HTTP {response.status_code}"
+                else:
+                    result["tokens"] = response.json()["usage"]["completion_tokens"]
+                    result["ttft"] = time.perf_counter() - start
+        except httpx.TimeoutException:
+            result["error"] = "timeout"
+        except httpx.HTTPError as e:
+            result["error"] = type(e).__name__
+        except (ValueError, KeyError, IndexError):
+            result["error"] = "bad_response"
+        result["latency"] = time.perf_counter() - start
+        return result
+
+    def rate_at(self, elapsed: float) -> float:
+        if self.args.ramp_to is None:
+            return self.args.rate
+        fraction = min(1.0, elapsed / self.args.duration)
+        return self.args.rate + (self.args.ramp_to - self.args.rate) * fraction
+
+    async def open_loop(self) -> Dict[str, Any]:
+        results = []
+        tasks = set()
+        skipped = 0
+        start = time.perf_counter()
+        next_arrival = 0.0
+
+        while next_arrival < self.args.duration:
+            delay = start + next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(tasks) >= self.args.max_inflight:
+                # The client itself is saturated; count it rather than silently slowing down
+                skipped += 1
+            else:
+                task = asyncio.create_task(self.request())
+                tasks.add(task)
+                task.add_done_callback(lambda t: (tasks.discard(t), results.append(t.result())))
+
+            rate = self.rate_at(next_arrival)
+            interval = random.expovariate(rate) if self.args.arrival == "poisson" else 1 / rate
+            next_arrival += interval
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        label = f"{self.args.arrival} {self.args.rate:g}/s" + (f" -> {self.args.ramp_to:g}/s" if self.args.ramp_to is not None else "")
+        return summarize(label, results, elapsed, skipped=skipped, schedule=self.args.duration)
+
+    async def closed_loop(self, concurrency: int) -> Dict[str, Any]:
+        results = []
+        deadline = time.perf_counter() + self.args.duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                results.append(await self.request())
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return summarize(f"concurrency {concurrency}", results, time.perf_counter() - start, concurrency=concurrency)
+
+    async def run(self) -> List[Dict[str, Any]]:
+        try:
+            if self.args.concurrency:
+                runs = []
+                for concurrency in self.args.concurrency:
+                    runs.append(await self.closed_loop(concurrency))
+                    print_run(runs[-1])
+                return runs
+            run = await self.open_loop()
+            print_run(run)
+            return [run]
+        finally:
+            await self.client.aclose()
+
+def summarize(label: str, results: List[Dict[str, Any]], elapsed: float,
+              skipped: int = 0, concurrency: Optional[int] = None, schedule: Optional[float] = None) -> Dict[str, Any]:
+    """Aggregate one run; ``schedule`` is how long arrivals were generated, excluding the drain."""
+    ok = [result for result in results if result["error"] is None]
+    latencies = [result["latency"] for result in ok]
+    ttfts = [result["ttft"] for result in ok if result["ttft"] is not None]
+    summary = {
+        "label": label,
+        "concurrency": concurrency,
+        "duration": elapsed,
+        "requests": len(results),
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "skipped": skipped,
+        "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+        "errors": dict(Counter(result["error"] for result in results if result["error"] is not None)),
+        "offered_rate": (len(results) + skipped) / (schedule or elapsed) if elapsed > 0 else 0.0,
+        "throughput": len(ok) / elapsed if elapsed > 0 else 0.0,
+        "tokens_per_second": sum(result["tokens"] for result in ok) / elapsed if elapsed > 0 else 0.0,
+        "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+        "latency_max": max(latencies) if latencies else None
+    }
+    for p in PERCENTILES:
+        name = f"p{p:g}".replace(".", "_")
+        summary[f"latency_{name}"] = percentile(latencies, p)
+        summary[f"ttft_{name}"] = percentile(ttfts, p)
+    return summary
+
+def fmt_seconds(value: Optional[float]) -> str:
+    return f"{value * 1000:8.1f}ms" if value is not None else "       n/a"
+
+def print_run(run: Dict[str, Any]):
+    print(f"\n=== {run['label']} ===")
+    print(f"requests {run['requests']}  ok {run['succeeded']}  failed {run['failed']}  "
+          f"skipped {run['skipped']}  error rate {run['error_rate']:.2%}")
+    if run["errors"]:
+        print(f"errors   {run['errors']}")
+    print(f"rate     offered {run['offered_rate']:.2f}/s  throughput {run['throughput']:.2f}/s  "
+          f"tokens {run['tokens_per_second']:.1f}/s")
+    for kind in ("latency", "ttft"):
+        print(f"{kind:<8} " + "  ".join(f"p{p:g} {fmt_seconds(run[f'{kind}_p{p:g}'.replace('.', '_')])}" for p in PERCENTILES))
+
+def write_output(path: str, config: Dict[str, Any], runs: List[Dict[str, Any]]):
+    if path.endswith(".csv"):
+        fields = [field for field in runs[0] if field != "errors"]
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(runs)
+    else:
+        with open(path, "w") as f:
+            json.dump({"config": config, "runs": runs}, f, indent=2)
+    print(f"\nResults saved to {path}")
+
+def compare(path: str, runs: List[Dict[str, Any]]):
+    with open(path) as f:
+        baseline = {run["label"]: run for run in json.load(f)["runs"]}
+    print(f"\n=== Compared with {path} ===")
+    for run in runs:
+        old = baseline.get(run["label"])
+        if old is None:
+            print(f"{run['label']}: no matching run in baseline")
+            continue
+        print(run["label"])
+        for field in REPORT_FIELDS:
+            before, after = old.get(field), run.get(field)
+            if before is None or after is None:
+                continue
+            change = f"{(after - before) / before:+.1%}" if before else "n/a"
+            print(f"  {field:<12} {before:12.4f} -> {after:12.4f}  ({change})")
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load generator for the chat completions API",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument("--url", default="http://localhost:8000", help="API base URL")
+    parser.add_argument("--path", default="/v1/chat/completions", help="Endpoint to load")
+    parser.add_argument("--api-key", help="Bearer token sent with every request")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per run")
+    parser.add_argument("--rate", type=float, default=2.0, help="Open-loop arrival rate in requests/s")
+    parser.add_argument("--ramp-to", type=float, help="Ramp the arrival rate linearly from --rate to this over the run")
+    parser.add_argument("--arrival", choices=["poisson", "constant"], default="poisson", help="Open-loop arrival process")
+    parser.add_argument("--concurrency", help="Comma-separated closed-loop concurrency levels to sweep instead of open-loop")
+    parser.add_argument("--max-inflight", type=int, default=512, help="Client-side cap on open requests")
+    parser.add_argument("--stream", action="store_true", help="Use streaming requests and measure time to first token")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--prompts-file", help="File with one prompt per line")
+    parser.add_argument("--repeat-prompts", action="store_true", help="Send prompts verbatim so caches and coalescing apply")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible arrival schedules")
+    parser.add_argument("--output", help="Write results to a .json or .csv file")
+    parser.add_argument("--compare", help="JSON results from an earlier run to compare against")
+    args = parser.parse_args()
+
+    if args.concurrency:
+        args.concurrency = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    if args.prompts_file:
+        with open(args.prompts_file) as f:
+            args.prompts = [line.strip() for line in f if line.strip()]
+    else:
+        args.prompts = PROMPTS
+    return args
+
+def main():
+    args = parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("prompts", "api_key")}
+    runs = asyncio.run(LoadGenerator(args).run())
+
+    if args.output:
+        write_output(args.output, config, runs)
+    if args.compare:
+        compare(args.compare, runs)
+
+    sys.exit(0 if all(run["succeeded"] for run in runs) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""Stand-in for llama.cpp's HTTP server, for load testing the API layer.
+
+Implements the endpoints the API uses (/health, /props, /tokenize and
+/completion with and without streaming) with simulated timing: prompt
+evaluation and decoding run at configurable tokens per second with random
+jitter, at most ``--slots`` generations run at once (the rest queue, as with
+llama.cpp's --parallel), and each slot remembers its last prompt so a
+repeated prefix is not evaluated again. Tokens are approximated as four
+characters of text.
+
+Without a grammar the mock behaves like an unconstrained model: after the
+query it rambles on with an explanation and a made-up next "Human:" turn
+until a stop string or the token limit ends it. With a grammar it emits
+only the statement (fenced if the grammar asks for a code block) and then
+end-of-sequence.
+
+Usage: python scripts/mock_llama_server.py --port 8080 --prompt-rate 400 --decode-rate 30
+       python scripts/mock_llama_server.py --uds /tmp/llama.sock
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+COMPLETION = "MATCH (p:Person {name: 'John'})-[:ACTED_IN]->(m:Movie) WHERE m.released > 2000 RETURN p.name, m.title ORDER BY m.released DESC LIMIT 10"
+RUN_ON = ("\n\nThis query finds the movies John acted in after 2000, newest first."
+          "\n\nHuman: Now only return the titles.\n\nAssistant: ")
+CHARS_PER_TOKEN = 4
+
+def tokenize(text: str) -> List[int]:
+    return [hash(text[i:i + CHARS_PER_TOKEN]) & 0x7FFF for i in range(0, len(text), CHARS_PER_TOKEN)]
+
+def split_tokens(text: str) -> List[str]:
+    return [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)]
+
+def completion_pieces(body: Dict[str, Any], limit: int) -> Tuple[List[str], Optional[str]]:
+    """Tokens the mock model generates, and the stop string that ended them, if any."""
+    grammar = body.get("grammar")
+    if grammar:
+        text = f"```cypher\n{COMPLETION}\n```" if "```" in grammar else COMPLETION
+        return split_tokens(text)[:limit], None
+
+    pieces = split_tokens((COMPLETION + RUN_ON) * (limit * CHARS_PER_TOKEN // len(COMPLETION + RUN_ON) + 1))[:limit]
+    text = "".join(pieces)
+    found = [(text.find(word), word) for word in body.get("stop") or [] if word and word in text]
+    if not found:
+        return pieces, None
+    end, word = min(found)
+    # llama.cpp stops before emitting the stop string
+    return split_tokens(text[:end]), word
+
+class MockLlamaServer:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.slots = asyncio.Semaphore(args.slots)
+        self.slot_prompts: Dict[int, List[int]] = {}
+        self.next_slot = 0
+
+    def jittered(self, seconds: float) -> float:
+        return max(0.0, seconds * (1 + random.uniform(-self.args.jitter, self.args.jitter)))
+
+    def pick_slot(self, requested: int) -> int:
+        if 0 <= requested < self.args.slots:
+            return requested
+        self.next_slot = (self.next_slot + 1) % self.args.slots
+        return self.next_slot
+
+    def cached_prefix(self, slot: int, prompt_tokens: List[int]) -> int:
+        previous = self.slot_prompts.get(slot, [])
+        common = 0
+        for a, b in zip(previous, prompt_tokens):
+            if a != b:
+                break
+            common += 1
+        return common
+
+    async def generate(self, body: Dict[str, Any]):
+        """Yield (content, final) pairs for one generation while holding a slot."""
+        prompt_tokens = tokenize(body.get("prompt", ""))
+        n_predict = body.get("n_predict") or self.args.max_tokens
+        if n_predict < 0:
+            n_predict = self.args.max_tokens
+        pieces, stopping_word = completion_pieces(body, min(n_predict, self.args.max_tokens))
+        truncated = len(prompt_tokens) + len(pieces) > self.args.ctx_size
+
+        async with self.slots:
+            slot = self.pick_slot(body.get("id_slot", -1))
+            cached = self.cached_prefix(slot, prompt_tokens) if body.get("cache_prompt", True) else 0
+            prompt_n = len(prompt_tokens) - cached
+
+            start = time.monotonic()
+            await asyncio.sleep(self.jittered(prompt_n / self.args.prompt_rate))
+            prompt_ms = (time.monotonic() - start) * 1000
+
+            decode_start = time.monotonic()
+            for piece in pieces:
+                await asyncio.sleep(self.jittered(1 / self.args.decode_rate))
+                yield piece, None
+            predicted_ms = (time.monotonic() - decode_start) * 1000
+            self.slot_prompts[slot] = prompt_tokens
+
+        stopped_limit = stopping_word is None and len(pieces) >= n_predict
+        yield "", {
+            "stop": True,
+            "id_slot": slot,
+            "tokens_predicted": len(pieces),
+            "tokens_evaluated": len(prompt_tokens),
+            "tokens_cached": cached + len(pieces),
+            "truncated": truncated,
+            "stopped_eos": not stopped_limit and stopping_word is None,
+            "stopped_limit": stopped_limit,
+            "stopped_word": stopping_word is not None,
+            "stopping_word": stopping_word or "",
+            "generation_settings": {"n_ctx": self.args.ctx_size},
+            "timings": {
+                "prompt_n": prompt_n,
+                "prompt_ms": prompt_ms,
+                "prompt_per_second": prompt_n / (prompt_ms / 1000) if prompt_ms > 0 else 0.0,
+                "predicted_n": len(pieces),
+                "predicted_ms": predicted_ms,
+                "predicted_per_second": len(pieces) / (predicted_ms / 1000) if predicted_ms > 0 else 0.0
+            }
+        }
+
+def build_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI(title="Mock llama.cpp server")
+    server = MockLlamaServer(args)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.get("/props")
+    async def props():
+        return {"default_generation_settings": {"n_ctx": args.ctx_size}, "total_slots": args.slots}
+
+    @app.post("/tokenize")
+    async def tokenize_endpoint(request: Request):
+        body = await request.json()
+        return {"tokens": tokenize(body.get("content", ""))}
+
+    @app.post("/completion")
+    async def completion(request: Request):
+        body = await request.json()
+
+        if not body.get("stream"):
+            content = []
+            final: Optional[Dict[str, Any]] = None
+            async for piece, final in server.generate(body):
+                content.append(piece)
+            return dict(final, content="".join(content))
+
+        async def events():
+            async for piece, final in server.generate(body):
+                message = dict(final, content=piece) if final else {"content": piece, "stop": False}
+                yield f"data: {json.dumps(message)}\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock llama.cpp server for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--uds", help="Listen on this Unix domain socket instead of TCP")
+    parser.add_argument("--prompt-rate", type=float, default=400.0, help="Prompt evaluation speed in tokens/s")
+    parser.add_argument("--decode-rate", type=float, default=30.0, help="Decode speed per slot in tokens/s")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Relative random jitter applied to every delay (0.1 = +/-10%%)")
+    parser.add_argument("--slots", type=int, default=4, help="Concurrent generations, like llama.cpp --parallel")
+    parser.add_argument("--ctx-size", type=int, default=1024, help="Per-slot context size reported by /props")
+    parser.add_argument("--max-tokens", type=int, default=64, help="Upper bound on generated tokens per request")
+    args = parser.parse_args()
+
+    uvicorn.run(build_app(args), host=args.host, port=args.port, uds=args.uds, log_level="warning")
+
+if __name__ == "__main__":
+    main()
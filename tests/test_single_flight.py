@@ -0,0 +1,94 @@
+import asyncio
+
+from api.cache import ResponseCache
+from api.config import LlamaConfig
+from api.llama_client import LlamaClient
+from api.models import ChatCompletionRequest
+from api.single_flight import SingleFlight
+
+CONCURRENCY = 5
+
+def make_client():
+    client = LlamaClient(
+        LlamaConfig(endpoint="http://127.0.0.1:1"),
+        response_cache=ResponseCache(max_entries=16, max_bytes=1 << 20, ttl=60, max_temperature=0.1),
+        single_flight=SingleFlight()
+    )
+    calls = []
+
+    async def complete(request, prompt_text, cache_key, use_cache, session_id):
+        calls.append(request.temperature)
+        sample = len(calls)
+        await asyncio.sleep(0.05)
+        return {"content": f"sample {sample}", "tokens_predicted": 2, "tokens_evaluated": 3,
+                "truncated": False, "stop_reason": "stop"}
+
+    async def complete_stream(request, prompt_text, cache_key, use_cache, session_id):
+        calls.append(request.temperature)
+        sample = len(calls)
+        await asyncio.sleep(0.05)
+        yield {"content": f"sample {sample}", "done": True, "stop_reason": "stop"}
+
+    client._complete = complete
+    client._complete_stream = complete_stream
+    return client, calls
+
+async def generate_concurrently(client, temperature, use_cache=True):
+    request = ChatCompletionRequest(prompt="MATCH (n) RETURN n", temperature=temperature)
+    return await asyncio.gather(*(client.generate(request, use_cache=use_cache) for _ in range(CONCURRENCY)))
+
+async def stream_concurrently(client, temperature, use_cache=True):
+    request = ChatCompletionRequest(prompt="MATCH (n) RETURN n", temperature=temperature, stream=True)
+
+    async def consume():
+        return [event async for event in client.generate_stream(request, use_cache=use_cache)]
+
+    return await asyncio.gather(*(consume() for _ in range(CONCURRENCY)))
+
+def test_deterministic_requests_are_coalesced():
+    client, calls = make_client()
+    results = asyncio.run(generate_concurrently(client, temperature=0.0))
+    assert len(calls) == 1
+    assert len({result["content"] for result in results}) == 1
+    assert sum(1 for result in results if result.get("coalesced")) == CONCURRENCY - 1
+
+def test_sampled_requests_are_not_coalesced():
+    client, calls = make_client()
+    results = asyncio.run(generate_concurrently(client, temperature=0.9))
+    assert len(calls) == CONCURRENCY
+    assert len({result["content"] for result in results}) == CONCURRENCY
+    assert not any(result.get("coalesced") for result in results)
+
+def test_no_cache_requests_are_not_coalesced():
+    client, calls = make_client()
+    results = asyncio.run(generate_concurrently(client, temperature=0.0, use_cache=False))
+    assert len(calls) == CONCURRENCY
+    assert len({result["content"] for result in results}) == CONCURRENCY
+
+def test_sampled_and_no_cache_streams_are_not_coalesced():
+    client, calls = make_client()
+    asyncio.run(stream_concurrently(client, temperature=0.9))
+    assert len(calls) == CONCURRENCY
+
+    client, calls = make_client()
+    asyncio.run(stream_concurrently(client, temperature=0.0, use_cache=False))
+    assert len(calls) == CONCURRENCY
+
+    client, calls = make_client()
+    asyncio.run(stream_concurrently(client, temperature=0.0))
+    assert len(calls) == 1
+
+def test_new_caller_after_last_one_left_starts_a_new_flight():
+    client, calls = make_client()
+    request = ChatCompletionRequest(prompt="MATCH (n) RETURN n", temperature=0.0)
+
+    async def scenario():
+        first = asyncio.ensure_future(client.generate(request))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0)
+        return await client.generate(request)
+
+    result = asyncio.run(scenario())
+    assert len(calls) == 2
+    assert not result.get("coalesced")
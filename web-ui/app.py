@@ -1,12 +1,19 @@
+import eventlet
+# Make sockets cooperative so upstream calls yield to other green threads
+eventlet.monkey_patch()
+
 from flask import Flask, render_template, request, jsonify, session
 from flask_socketio import SocketIO, emit
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import time
 import uuid
 from datetime import datetime
 import threading
 import os
+import sqlite3
+import sys
 from prometheus_client.parser import text_string_to_metric_families
 
 app = Flask(__name__)
@@ -18,18 +25,32 @@ class Config:
     PROMETHEUS_URL = os.environ.get('PROMETHEUS_URL', 'http://localhost:9090')
     METRICS_URL = os.environ.get('METRICS_URL', 'http://localhost:8000/metrics')
     UPDATE_INTERVAL = int(os.environ.get('UPDATE_INTERVAL', '5'))
+    API_POOL_SIZE = int(os.environ.get('API_POOL_SIZE', '64'))
+    API_CONNECT_TIMEOUT = float(os.environ.get('API_CONNECT_TIMEOUT', '5'))
+    API_READ_TIMEOUT = float(os.environ.get('API_READ_TIMEOUT', '120'))
+    CHAT_HISTORY_LIMIT = int(os.environ.get('CHAT_HISTORY_LIMIT', '1000'))
+    CHAT_DB_PATH = os.environ.get('CHAT_DB_PATH', 'data/chat_history.db')
+    CHAT_PAGE_SIZE = int(os.environ.get('CHAT_PAGE_SIZE', '50'))
+    METRICS_TIMEOUT = float(os.environ.get('METRICS_TIMEOUT', '5'))
+    HISTORY_RANGE = int(os.environ.get('HISTORY_RANGE', '3600'))
+    HISTORY_POINTS = int(os.environ.get('HISTORY_POINTS', '120'))
 
 config = Config()
 
 class APIClient:
-    def __init__(self, base_url):
+    def __init__(self, base_url, pool_size=64):
         self.base_url = base_url
+        self.timeout = (config.API_CONNECT_TIMEOUT, config.API_READ_TIMEOUT)
         self.session = requests.Session()
-        self.session.timeout = 30
+        # One keep-alive pool shared by every green thread; a burst beyond
+        # pool_size opens extra connections instead of queueing behind others
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
     
     def health_check(self):
         try:
-            response = self.session.get(f"{self.base_url}/health")
+            response = self.session.get(f"{self.base_url}/health", timeout=self.timeout)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -47,101 +68,342 @@ class APIClient:
             response = self.session.post(
                 f"{self.base_url}/v1/chat/completions",
                 json=payload,
-                headers={"Content-Type": "application/json"}
+                headers={"Content-Type": "application/json"},
+                timeout=self.timeout
             )
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
             return {"error": str(e)}
+    
+    def stream_chat_completion(self, prompt, max_tokens=512, temperature=0.7, top_p=0.9):
+        """Yield {"content", "finish_reason", "usage"} deltas as the API streams them, or one {"error"}.
+        
+        ``usage`` is only set on the final chunk.
+        """
+        payload = {
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "stream": True
+        }
+        
+        try:
+            with self.session.post(
+                f"{self.base_url}/v1/chat/completions",
+                json=payload,
+                headers={"Content-Type": "application/json", "Accept": "text/event-stream"},
+                timeout=self.timeout,
+                stream=True
+            ) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                    if not line or not line.startswith('data: '):
+                        continue
+                    data = line[len('data: '):]
+                    if data == '[DONE]':
+                        return
+                    chunk = json.loads(data)
+                    if 'error' in chunk:
+                        yield {"error": chunk['error'].get('message', 'Generation failed')}
+                        return
+                    choice = chunk['choices'][0]
+                    yield {
+                        "content": choice['delta'].get('content', ''),
+                        "finish_reason": choice.get('finish_reason'),
+                        "usage": chunk.get('usage')
+                    }
+        except (requests.exceptions.RequestException, ValueError) as e:
+            yield {"error": str(e)}
+
+class ChatHistory:
+    """Chat entries per browser in SQLite, so the cookie only carries an id.
+    
+    Rows are keyed by (client_id, seq), which makes appends and cursor pages
+    index lookups regardless of how long the history is. Each client keeps
+    its newest ``limit`` entries.
+    """
+    
+    def __init__(self, path, limit):
+        self.limit = limit
+        self.lock = threading.Lock()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS chat_history (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                client_id TEXT NOT NULL,
+                entry TEXT NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS chat_history_client ON chat_history (client_id, seq)")
+    
+    def append(self, client_id, entry):
+        with self.lock:
+            self.db.execute("BEGIN")
+            self.db.execute(
+                "INSERT INTO chat_history (client_id, entry) VALUES (?, ?)",
+                (client_id, json.dumps(entry))
+            )
+            self.db.execute("""
+                DELETE FROM chat_history WHERE client_id = ? AND seq <= (
+                    SELECT seq FROM chat_history WHERE client_id = ?
+                    ORDER BY seq DESC LIMIT 1 OFFSET ?
+                )
+            """, (client_id, client_id, self.limit))
+            self.db.execute("COMMIT")
+    
+    def page(self, client_id, before=None, limit=50):
+        """Up to ``limit`` entries older than cursor ``before``, newest first, and the next cursor."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT seq, entry FROM chat_history WHERE client_id = ? AND seq < ? "
+                "ORDER BY seq DESC LIMIT ?",
+                (client_id, before if before is not None else sys.maxsize, limit + 1)
+            ).fetchall()
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return [json.loads(entry) for _, entry in rows[:limit]], next_cursor
+    
+    def clear(self, client_id):
+        with self.lock:
+            self.db.execute("DELETE FROM chat_history WHERE client_id = ?", (client_id,))
+
+def histogram_quantile(quantile, buckets):
+    """Estimate a quantile from cumulative (upper_bound, count) buckets, as PromQL does."""
+    buckets = sorted(buckets)
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    rank = quantile * buckets[-1][1]
+    lower_bound, lower_count = 0.0, 0.0
+    for upper_bound, count in buckets:
+        if count >= rank:
+            if upper_bound == float('inf'):
+                return lower_bound
+            if count == lower_count:
+                return upper_bound
+            return lower_bound + (upper_bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+        lower_bound, lower_count = upper_bound, count
+    return lower_bound
 
-class MetricsCollector:
-    def __init__(self, metrics_url, prometheus_url):
+class MetricsScrape:
+    """One parse of the API's /metrics, with samples summed across labels."""
+    
+    def __init__(self, text, scraped_at):
+        self.scraped_at = scraped_at
+        self.totals = {}
+        self.buckets = {}
+        for family in text_string_to_metric_families(text):
+            for sample in family.samples:
+                if sample.name.endswith('_bucket'):
+                    name = sample.name[:-len('_bucket')]
+                    bound = float(sample.labels['le'])
+                    by_bound = self.buckets.setdefault(name, {})
+                    by_bound[bound] = by_bound.get(bound, 0.0) + sample.value
+                else:
+                    self.totals[sample.name] = self.totals.get(sample.name, 0.0) + sample.value
+    
+    def total(self, name):
+        return self.totals.get(name, 0.0)
+    
+    def increase(self, previous, name):
+        if previous is None:
+            return self.total(name)
+        # A drop means the API restarted and its counters were reset
+        delta = self.total(name) - previous.total(name)
+        return delta if delta >= 0 else self.total(name)
+    
+    def bucket_increase(self, previous, name):
+        current = self.buckets.get(name, {})
+        if previous is None:
+            return list(current.items())
+        earlier = previous.buckets.get(name, {})
+        deltas = [(bound, count - earlier.get(bound, 0.0)) for bound, count in current.items()]
+        if any(delta < 0 for _, delta in deltas):
+            return list(current.items())
+        return deltas
+
+class MetricsPoller:
+    """Polls the API once per interval for every connected browser.
+    
+    Each tick scrapes /metrics and /health into a cached snapshot and
+    broadcasts only the fields that changed since the previous tick. Rates,
+    averages and percentiles are computed from the increase between the last
+    two scrapes, i.e. over the poll interval. Historical series come from
+    Prometheus range queries and are cached for one step, so chart loads cost
+    the same however many browsers ask.
+    """
+    
+    HISTORY_QUERIES = {
+        'tokens_per_second': 'sum(rate(llama_tokens_generated_total[{window}s]))',
+        'active_requests': 'sum(avg_over_time(api_active_requests[{window}s]))'
+    }
+    
+    def __init__(self, metrics_url, prometheus_url, api_base_url, interval, timeout):
         self.metrics_url = metrics_url
         self.prometheus_url = prometheus_url
+        self.api_base_url = api_base_url
+        self.interval = interval
+        self.timeout = timeout
         self.session = requests.Session()
-        self.session.timeout = 10
+        self.snapshot = {}
+        self.previous_scrape = None
+        self.history_cache = {}
+        self.started = False
+        self.start_lock = threading.Lock()
     
-    def get_prometheus_metrics(self):
-        try:
-            response = self.session.get(self.metrics_url)
-            response.raise_for_status()
-            
-            metrics = {}
-            for family in text_string_to_metric_families(response.text):
-                for sample in family.samples:
-                    metric_name = sample.name
-                    labels = sample.labels
-                    value = sample.value
-                    
-                    if metric_name not in metrics:
-                        metrics[metric_name] = []
-                    
-                    metrics[metric_name].append({
-                        'labels': labels,
-                        'value': value,
-                        'timestamp': time.time()
-                    })
-            
-            return metrics
-        except requests.exceptions.RequestException as e:
-            return {"error": str(e)}
+    def start(self):
+        with self.start_lock:
+            if self.started:
+                return
+            self.started = True
+        socketio.start_background_task(self.run)
     
-    def get_summary_metrics(self):
-        raw_metrics = self.get_prometheus_metrics()
-        
-        if "error" in raw_metrics:
-            return raw_metrics
-        
-        summary = {
-            'requests_total': 0,
-            'active_requests': 0,
-            'avg_response_time': 0,
-            'tokens_generated_total': 0,
-            'avg_tokens_per_second': 0,
-            'generation_duration_avg': 0,
-            'health_status': 'unknown',
+    def run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Error updating metrics: {e}")
+            socketio.sleep(self.interval)
+    
+    def poll(self):
+        """Refresh the snapshot, broadcast what changed and return the changes."""
+        snapshot = self.collect()
+        changes = {key: value for key, value in snapshot.items()
+                   if key != 'timestamp' and self.snapshot.get(key) != value}
+        # Fields that disappeared (e.g. a cleared error) are sent as null
+        changes.update({key: None for key in self.snapshot if key not in snapshot})
+        self.snapshot = snapshot
+        if changes:
+            changes['timestamp'] = snapshot['timestamp']
+            socketio.emit('metrics_delta', changes)
+        return changes
+    
+    def get_snapshot(self):
+        if not self.snapshot:
+            self.poll()
+        return self.snapshot
+    
+    def collect(self):
+        snapshot = {
+            'health_status': self.check_health(),
             'timestamp': datetime.utcnow().isoformat()
         }
+        try:
+            response = self.session.get(self.metrics_url, timeout=self.timeout)
+            response.raise_for_status()
+            scrape = MetricsScrape(response.text, time.monotonic())
+        except (requests.exceptions.RequestException, ValueError) as e:
+            snapshot['error'] = str(e)
+            return snapshot
         
-        # Extract key metrics
-        if 'api_requests_total' in raw_metrics:
-            summary['requests_total'] = sum(m['value'] for m in raw_metrics['api_requests_total'])
+        previous = self.previous_scrape
+        self.previous_scrape = scrape
+        elapsed = scrape.scraped_at - previous.scraped_at if previous is not None else 0
         
-        if 'api_active_requests' in raw_metrics:
-            values = [m['value'] for m in raw_metrics['api_active_requests']]
-            summary['active_requests'] = values[0] if values else 0
+        def rate(name):
+            return round(scrape.increase(previous, name) / elapsed, 3) if elapsed > 0 else 0
         
-        if 'llama_tokens_generated_total' in raw_metrics:
-            summary['tokens_generated_total'] = sum(m['value'] for m in raw_metrics['llama_tokens_generated_total'])
+        def interval_mean(name):
+            count = scrape.increase(previous, f'{name}_count')
+            return round(scrape.increase(previous, f'{name}_sum') / count, 4) if count else 0
         
-        if 'llama_tokens_per_second' in raw_metrics:
-            values = [m['value'] for m in raw_metrics['llama_tokens_per_second'] if m['labels'].get('le') == '+Inf']
-            summary['avg_tokens_per_second'] = values[0] if values else 0
+        def interval_quantile(quantile, name):
+            value = histogram_quantile(quantile, scrape.bucket_increase(previous, name))
+            return round(value, 4) if value is not None else 0
         
-        # Check API health
+        snapshot.update({
+            'requests_total': scrape.total('api_requests_total'),
+            'active_requests': scrape.total('api_active_requests'),
+            'tokens_generated_total': scrape.total('llama_tokens_generated_total'),
+            'requests_per_second': rate('api_requests_total'),
+            'throughput_tokens_per_second': rate('llama_tokens_generated_total'),
+            'avg_tokens_per_second': interval_mean('llama_tokens_per_second'),
+            'generation_duration_avg': interval_mean('llama_generation_duration_seconds'),
+            'generation_duration_p95': interval_quantile(0.95, 'llama_generation_duration_seconds'),
+            'request_duration_p50': interval_quantile(0.5, 'api_request_duration_seconds'),
+            'request_duration_p95': interval_quantile(0.95, 'api_request_duration_seconds'),
+            'request_duration_p99': interval_quantile(0.99, 'api_request_duration_seconds')
+        })
+        return snapshot
+    
+    def check_health(self):
         try:
-            health_response = self.session.get(f"{config.API_BASE_URL}/health")
-            summary['health_status'] = 'healthy' if health_response.status_code == 200 else 'unhealthy'
-        except:
-            summary['health_status'] = 'unhealthy'
+            response = self.session.get(f"{self.api_base_url}/health", timeout=self.timeout)
+            return 'healthy' if response.status_code == 200 else 'unhealthy'
+        except requests.exceptions.RequestException:
+            return 'unhealthy'
+    
+    def get_history(self, range_seconds, points):
+        """Downsampled series for the last ``range_seconds``, at most ``points`` each."""
+        step = max(int(range_seconds / points), self.interval, 1)
+        now = time.time()
+        key = (range_seconds, step)
+        cached = self.history_cache.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
         
-        return summary
+        # Align to the step so every browser asking within one step shares a result
+        end = now - now % step
+        # rate() needs at least two scrapes inside its window
+        window = max(step, 30)
+        history = {'step': step, 'series': {}}
+        for name, query in self.HISTORY_QUERIES.items():
+            try:
+                response = self.session.get(
+                    f"{self.prometheus_url}/api/v1/query_range",
+                    params={'query': query.format(window=window), 'start': end - range_seconds, 'end': end, 'step': step},
+                    timeout=self.timeout
+                )
+                response.raise_for_status()
+                result = response.json()['data']['result']
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                return {"error": str(e)}
+            values = result[0]['values'] if result else []
+            history['series'][name] = [
+                [int(ts), None if value == 'NaN' else round(float(value), 4)] for ts, value in values
+            ]
+        
+        self.history_cache = {k: v for k, v in self.history_cache.items() if v[0] > now}
+        self.history_cache[key] = (end + step, history)
+        return history
 
-api_client = APIClient(config.API_BASE_URL)
-metrics_collector = MetricsCollector(config.METRICS_URL, config.PROMETHEUS_URL)
+api_client = APIClient(config.API_BASE_URL, pool_size=config.API_POOL_SIZE)
+metrics_poller = MetricsPoller(
+    config.METRICS_URL,
+    config.PROMETHEUS_URL,
+    config.API_BASE_URL,
+    config.UPDATE_INTERVAL,
+    config.METRICS_TIMEOUT
+)
+chat_history_store = ChatHistory(config.CHAT_DB_PATH, config.CHAT_HISTORY_LIMIT)
 
-def background_metrics_updater():
-    while True:
-        try:
-            metrics = metrics_collector.get_summary_metrics()
-            socketio.emit('metrics_update', metrics)
-            time.sleep(config.UPDATE_INTERVAL)
-        except Exception as e:
-            print(f"Error updating metrics: {e}")
-            time.sleep(config.UPDATE_INTERVAL)
+def client_id():
+    if 'client_id' not in session:
+        session['client_id'] = str(uuid.uuid4())
+    return session['client_id']
+
+def build_chat_entry(chat_id, prompt, response_text, duration, usage, max_tokens, temperature, top_p):
+    return {
+        'id': chat_id,
+        'prompt': prompt,
+        'response': response_text,
+        'timestamp': datetime.utcnow().isoformat(),
+        'duration': duration,
+        'usage': usage,
+        'max_tokens': max_tokens,
+        'temperature': temperature,
+        'top_p': top_p
+    }
 
 @app.route('/')
 def index():
+    # Socket.IO handlers see a copy of the session, so assign the id up front
+    client_id()
     return render_template('index.html')
 
 @app.route('/api/health')
@@ -159,10 +421,6 @@ def chat():
     if not prompt:
         return jsonify({"error": "Prompt is required"}), 400
     
-    # Store chat in session
-    if 'chat_history' not in session:
-        session['chat_history'] = []
-    
     chat_id = str(uuid.uuid4())
     start_time = time.time()
     
@@ -173,34 +431,45 @@ def chat():
     
     end_time = time.time()
     
-    chat_entry = {
-        'id': chat_id,
-        'prompt': prompt,
-        'response': result.get('choices', [{}])[0].get('message', {}).get('content', ''),
-        'timestamp': datetime.utcnow().isoformat(),
-        'duration': end_time - start_time,
-        'usage': result.get('usage', {}),
-        'max_tokens': max_tokens,
-        'temperature': temperature,
-        'top_p': top_p
-    }
+    chat_entry = build_chat_entry(
+        chat_id,
+        prompt,
+        result.get('choices', [{}])[0].get('message', {}).get('content', ''),
+        end_time - start_time,
+        result.get('usage', {}),
+        max_tokens,
+        temperature,
+        top_p
+    )
     
-    session['chat_history'].append(chat_entry)
+    chat_history_store.append(client_id(), chat_entry)
     
     return jsonify(chat_entry)
 
 @app.route('/api/chat/history')
 def chat_history():
-    return jsonify(session.get('chat_history', []))
+    limit = min(max(request.args.get('limit', config.CHAT_PAGE_SIZE, type=int), 1), 500)
+    before = request.args.get('before', type=int)
+    entries, next_cursor = chat_history_store.page(client_id(), before, limit)
+    return jsonify({"entries": entries, "next_cursor": next_cursor})
 
 @app.route('/api/chat/clear', methods=['POST'])
 def clear_chat():
-    session['chat_history'] = []
+    chat_history_store.clear(client_id())
     return jsonify({"status": "cleared"})
 
 @app.route('/api/metrics')
 def get_metrics():
-    return jsonify(metrics_collector.get_summary_metrics())
+    return jsonify(metrics_poller.get_snapshot())
+
+@app.route('/api/metrics/history')
+def get_metrics_history():
+    range_seconds = min(max(request.args.get('range', config.HISTORY_RANGE, type=int), 60), 7 * 24 * 3600)
+    points = min(max(request.args.get('points', config.HISTORY_POINTS, type=int), 2), 1000)
+    history = metrics_poller.get_history(range_seconds, points)
+    if "error" in history:
+        return jsonify(history), 502
+    return jsonify(history)
 
 @app.route('/api/examples')
 def get_examples():
@@ -241,23 +510,70 @@ def get_examples():
 @socketio.on('connect')
 def handle_connect():
     print(f"Client connected: {request.sid}")
-    # Send initial metrics
-    metrics = metrics_collector.get_summary_metrics()
-    emit('metrics_update', metrics)
+    # New clients get the cached snapshot; later ticks only send what changed
+    metrics_poller.start()
+    emit('metrics_update', metrics_poller.snapshot)
 
 @socketio.on('disconnect')
 def handle_disconnect():
     print(f"Client disconnected: {request.sid}")
 
+@socketio.on('chat_stream')
+def handle_chat_stream(data):
+    # python-socketio runs each event in its own green thread, so a long
+    # generation here does not hold up other clients
+    sid = request.sid
+    chat_id = data.get('id') or str(uuid.uuid4())
+    prompt = (data.get('prompt') or '').strip()
+    max_tokens = data.get('max_tokens', 512)
+    temperature = data.get('temperature', 0.7)
+    top_p = data.get('top_p', 0.9)
+    
+    if not prompt:
+        emit('chat_error', {'id': chat_id, 'error': 'Prompt is required'})
+        return
+    
+    start_time = time.time()
+    parts = []
+    usage = None
+    events = api_client.stream_chat_completion(prompt, max_tokens, temperature, top_p)
+    
+    try:
+        for event in events:
+            if 'error' in event:
+                emit('chat_error', {'id': chat_id, 'error': event['error']})
+                return
+            if not socketio.server.manager.is_connected(sid, '/'):
+                # Browser went away; closing the stream cancels the generation upstream
+                return
+            if event['usage']:
+                usage = event['usage']
+            if event['content']:
+                parts.append(event['content'])
+                emit('chat_token', {'id': chat_id, 'content': event['content']})
+    finally:
+        events.close()
+    
+    chat_entry = build_chat_entry(
+        chat_id,
+        prompt,
+        ''.join(parts),
+        time.time() - start_time,
+        # Older API versions send no usage; a chunk is roughly one token
+        usage or {'completion_tokens': len(parts)},
+        max_tokens,
+        temperature,
+        top_p
+    )
+    chat_history_store.append(session.get('client_id', sid), chat_entry)
+    emit('chat_done', chat_entry)
+
 @socketio.on('request_metrics')
 def handle_metrics_request():
-    metrics = metrics_collector.get_summary_metrics()
-    emit('metrics_update', metrics)
+    emit('metrics_update', metrics_poller.get_snapshot())
 
 if __name__ == '__main__':
-    # Start background metrics updater
-    metrics_thread = threading.Thread(target=background_metrics_updater, daemon=True)
-    metrics_thread.start()
+    metrics_poller.start()
     
     # Run the app
     socketio.run(app, host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
@@ -8,12 +8,9 @@ class CypherApp {
             temperature: 0.7,
             topP: 0.9
         };
-        this.metricsHistory = {
-            tokens: [],
-            requests: [],
-            timestamps: []
-        };
-        this.maxHistoryPoints = 20;
+        this.metrics = {};
+        this.historyRefreshMs = 30000;
+        this.pendingStreams = {};
     }
 
     init() {
@@ -21,6 +18,8 @@ class CypherApp {
         this.initializeSocket();
         this.initializeEventListeners();
         this.initializeCharts();
+        this.loadMetricsHistory();
+        setInterval(() => this.loadMetricsHistory(), this.historyRefreshMs);
         this.loadSettings();
         this.loadExamples();
         this.checkHealth();
@@ -58,6 +57,8 @@ class CypherApp {
             totalRequests: document.getElementById('total-requests'),
             totalTokens: document.getElementById('total-tokens'),
             avgGenerationTime: document.getElementById('avg-generation-time'),
+            throughputMetric: document.getElementById('throughput-metric'),
+            latencyP95Metric: document.getElementById('latency-p95-metric'),
             metricsStatus: document.getElementById('metrics-status')
         };
     }
@@ -73,10 +74,32 @@ class CypherApp {
         this.socket.on('disconnect', () => {
             console.log('Socket disconnected');
             this.updateMetricsStatus('Offline', 'danger');
+            Object.keys(this.pendingStreams).forEach((id) => {
+                this.failStream(id, 'Connection lost');
+            });
+        });
+
+        this.socket.on('chat_token', (data) => {
+            this.appendStreamToken(data.id, data.content);
+        });
+
+        this.socket.on('chat_done', (entry) => {
+            this.finishStream(entry);
+        });
+
+        this.socket.on('chat_error', (data) => {
+            this.failStream(data.id, data.error);
         });
         
+        // The server sends a full snapshot on connect, then only changed fields
         this.socket.on('metrics_update', (metrics) => {
-            this.updateMetrics(metrics);
+            this.metrics = metrics;
+            this.updateMetrics(this.metrics);
+        });
+
+        this.socket.on('metrics_delta', (delta) => {
+            Object.assign(this.metrics, delta);
+            this.updateMetrics(this.metrics);
         });
     }
 
@@ -204,11 +227,75 @@ class CypherApp {
         this.setUIState(false);
         this.showTypingIndicator();
 
-        try {
-            // Add user message to chat
-            this.addMessage('user', prompt);
-            this.elements.chatInput.value = '';
+        // Add user message to chat
+        this.addMessage('user', prompt);
+        this.elements.chatInput.value = '';
 
+        if (this.socket && this.socket.connected) {
+            this.streamMessage(prompt);
+        } else {
+            await this.sendMessageHttp(prompt);
+        }
+    }
+
+    streamMessage(prompt) {
+        const id = `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+        this.pendingStreams[id] = { content: '', element: null };
+
+        this.socket.emit('chat_stream', {
+            id: id,
+            prompt: prompt,
+            max_tokens: this.settings.maxTokens,
+            temperature: this.settings.temperature,
+            top_p: this.settings.topP
+        });
+    }
+
+    appendStreamToken(id, content) {
+        const stream = this.pendingStreams[id];
+        if (!stream) return;
+
+        if (!stream.element) {
+            this.hideTypingIndicator();
+            stream.element = this.addMessage('assistant', '');
+            stream.contentElement = stream.element.querySelector('.message-content');
+            stream.contentElement.classList.add('streaming');
+        }
+
+        stream.content += content;
+        stream.contentElement.textContent = stream.content;
+        this.scrollToBottom();
+    }
+
+    finishStream(entry) {
+        const stream = this.pendingStreams[entry.id];
+        if (!stream) return;
+        delete this.pendingStreams[entry.id];
+
+        // Re-render the complete reply with formatting and actions
+        this.hideTypingIndicator();
+        if (stream.element) {
+            stream.element.remove();
+        }
+        this.addMessage('assistant', entry.response, entry);
+        this.setUIState(true);
+    }
+
+    failStream(id, error) {
+        const stream = this.pendingStreams[id];
+        if (!stream) return;
+        delete this.pendingStreams[id];
+
+        this.hideTypingIndicator();
+        if (stream.element) {
+            stream.element.remove();
+        }
+        this.addMessage('assistant', `Error: ${error}`, null, true);
+        this.setUIState(true);
+    }
+
+    async sendMessageHttp(prompt) {
+        try {
             // Send request to API
             const response = await fetch('/api/chat', {
                 method: 'POST',
@@ -279,6 +366,8 @@ class CypherApp {
         if (bubbleDiv.querySelector('code')) {
             Prism.highlightAllUnder(bubbleDiv);
         }
+
+        return messageDiv;
     }
 
     processMessageContent(content) {
@@ -363,8 +452,17 @@ class CypherApp {
 
     async exportChat() {
         try {
-            const response = await fetch('/api/chat/history');
-            const history = await response.json();
+            // Page backwards through the history, then restore chronological order
+            const history = [];
+            let cursor = null;
+            do {
+                const query = cursor === null ? '' : `?before=${cursor}`;
+                const response = await fetch(`/api/chat/history${query}`);
+                const page = await response.json();
+                history.push(...page.entries);
+                cursor = page.next_cursor;
+            } while (cursor !== null);
+            history.reverse();
             
             const blob = new Blob([JSON.stringify(history, null, 2)], {
                 type: 'application/json'
@@ -473,7 +571,6 @@ class CypherApp {
     updateMetrics(metrics) {
         if (metrics.error) {
             console.error('Metrics error:', metrics.error);
-            return;
         }
 
         // Update metric displays
@@ -488,35 +585,33 @@ class CypherApp {
         this.elements.totalTokens.textContent = Math.round(metrics.tokens_generated_total || 0);
         this.elements.avgGenerationTime.textContent = 
             `${Math.round(metrics.generation_duration_avg * 1000 || 0)}ms`;
-
-        // Update charts
-        this.updateChartsData(metrics);
+        this.elements.throughputMetric.textContent =
+            `${(metrics.throughput_tokens_per_second || 0).toFixed(1)} tok/s`;
+        this.elements.latencyP95Metric.textContent =
+            `${Math.round(metrics.request_duration_p95 * 1000 || 0)}ms`;
     }
 
-    updateChartsData(metrics) {
-        const now = new Date().toLocaleTimeString();
-        
-        // Add new data points
-        this.metricsHistory.timestamps.push(now);
-        this.metricsHistory.tokens.push(metrics.avg_tokens_per_second || 0);
-        this.metricsHistory.requests.push(metrics.active_requests || 0);
-        
-        // Keep only recent data
-        if (this.metricsHistory.timestamps.length > this.maxHistoryPoints) {
-            this.metricsHistory.timestamps.shift();
-            this.metricsHistory.tokens.shift();
-            this.metricsHistory.requests.shift();
+    async loadMetricsHistory() {
+        // Charts come from Prometheus, downsampled server-side and shared by all browsers
+        try {
+            const response = await fetch('/api/metrics/history');
+            const history = await response.json();
+            if (history.error) {
+                console.error('Metrics history error:', history.error);
+                return;
+            }
+
+            this.updateChart(this.charts.tokens, history.series.tokens_per_second || []);
+            this.updateChart(this.charts.requests, history.series.active_requests || []);
+        } catch (error) {
+            console.error('Error loading metrics history:', error);
         }
-        
-        // Update tokens chart
-        this.charts.tokens.data.labels = [...this.metricsHistory.timestamps];
-        this.charts.tokens.data.datasets[0].data = [...this.metricsHistory.tokens];
-        this.charts.tokens.update('none');
-        
-        // Update requests chart
-        this.charts.requests.data.labels = [...this.metricsHistory.timestamps];
-        this.charts.requests.data.datasets[0].data = [...this.metricsHistory.requests];
-        this.charts.requests.update('none');
+    }
+
+    updateChart(chart, points) {
+        chart.data.labels = points.map(([ts]) => new Date(ts * 1000).toLocaleTimeString());
+        chart.data.datasets[0].data = points.map(([, value]) => value);
+        chart.update('none');
     }
 
     updateMetricsStatus(status, type) {